@@ -0,0 +1,91 @@
+"""
+Benchmark of the calendar generation used to create the placeholder rows of the demand table.
+It compares the vectorized build_calendar (through new_rows) with the previous per-region merge
+implementation and reports the generation time and the peak memory of each one.
+
+Usage:
+    python benchmarks/calendar_benchmark.py [--start 2019-01-01] [--end 2022-11-01] [--repeat 3]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from electrical_demand.process_data.utils import new_rows, year_calendar
+
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+
+
+def legacy_new_rows(region_dicts, holidays_df, start_date, end_date=None):
+    if end_date is None:
+        end_date = start_date + timedelta(hours=24)
+    end_date_adjusted = end_date + timedelta(days=4)
+    df_list = []
+    for region in region_dicts:
+        datetime_index = pd.date_range(start=start_date, end=end_date_adjusted, freq='60min')[1:]
+        df = pd.DataFrame(columns=["region"], index=datetime_index)
+        df["region"] = region["region"]
+        df["date"] = df.index.date
+        df["date"] = pd.to_datetime(df["date"])
+        df = df.reset_index().merge(holidays_df, how="left", left_on="date", right_on="date").set_index("index")
+        df["day_type"].fillna("working_day", inplace = True)
+        df.drop(columns=["date"], inplace=True)
+        df_list.append(df)
+    dataframe = pd.concat(df_list)
+    dataframe.index.name = "datetime"
+    return dataframe
+
+def load_inputs():
+    with open(DATA_DIR / "regions.json", "r") as f:
+        region_dicts = json.load(f)
+    holidays = pd.read_csv(DATA_DIR / "holidays.csv")
+    holidays["date"] = pd.to_datetime(holidays[["year", "month", "day"]])
+    holidays = holidays.set_index("date").drop(columns=["year", "month", "day"])
+    return region_dicts, holidays
+
+def measure(function, *args, repeat=3, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "rows": len(result),
+        "best_s": min(timings),
+        "mean_s": sum(timings) / len(timings),
+        "peak_memory_mb": peak / 2**20,
+        "result_memory_mb": result.memory_usage(deep=True).sum() / 2**20,
+    }
+
+def run(start_date, end_date, repeat=3):
+    region_dicts, holidays = load_inputs()
+    results = {"start_date": str(start_date), "end_date": str(end_date), "regions": len(region_dicts)}
+    results["legacy"] = measure(legacy_new_rows, region_dicts, holidays, start_date, end_date=end_date, repeat=repeat)
+    year_calendar.cache_clear()
+    results["vectorized_cold"] = measure(new_rows, region_dicts, holidays, start_date, end_date=end_date, repeat=1)
+    results["vectorized_cached"] = measure(new_rows, region_dicts, holidays, start_date, end_date=end_date, repeat=repeat)
+    results["daily_cached"] = measure(new_rows, region_dicts, holidays, end_date, repeat=repeat)
+    legacy = legacy_new_rows(region_dicts, holidays, start_date, end_date=end_date)
+    vectorized = new_rows(region_dicts, holidays, start_date, end_date=end_date)
+    results["equal_output"] = bool(
+        legacy.index.equals(vectorized.index)
+        and legacy[["region", "day_type"]].equals(vectorized[["region", "day_type"]])
+    )
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2019, 1, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2022, 11, 1))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(run(args.start, args.end, args.repeat), indent=4))
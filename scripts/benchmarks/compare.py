@@ -0,0 +1,56 @@
+"""
+Compares two result files of benchmarks/run.py and fails if a case got slower than the threshold.
+
+Usage:
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json [--threshold 1.2]
+"""
+
+import argparse
+import json
+import sys
+
+
+def compare(old, new, threshold):
+    """
+    Returns
+    -------
+    rows : list of tuples
+        (case, old best time, new best time, ratio) of every case present in both results.
+    regressions : list of str
+        Cases whose ratio is greater than threshold.
+    """
+    rows = []
+    regressions = []
+    for name, new_case in new["cases"].items():
+        old_case = old["cases"].get(name)
+        if not old_case or "best_s" not in old_case or "best_s" not in new_case:
+            rows.append((name, old_case and old_case.get("best_s"), new_case.get("best_s"), None))
+            continue
+        ratio = new_case["best_s"] / old_case["best_s"]
+        rows.append((name, old_case["best_s"], new_case["best_s"], ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=1.2, help="maximum allowed new/old time ratio")
+    args = parser.parse_args()
+    with open(args.old, "r") as f:
+        old = json.load(f)
+    with open(args.new, "r") as f:
+        new = json.load(f)
+
+    rows, regressions = compare(old, new, args.threshold)
+    print(f"{'case':<32} {old['commit']:>12} {new['commit']:>12} {'ratio':>8}")
+    for name, old_time, new_time, ratio in rows:
+        old_text = f"{old_time:.4f}" if old_time is not None else "-"
+        new_text = f"{new_time:.4f}" if new_time is not None else "-"
+        ratio_text = f"{ratio:.2f}" if ratio is not None else "-"
+        print(f"{name:<32} {old_text:>12} {new_text:>12} {ratio_text:>8}")
+    if regressions:
+        print("regressions: " + ", ".join(regressions), file=sys.stderr)
+    sys.exit(1 if regressions else 0)
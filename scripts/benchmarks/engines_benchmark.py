@@ -0,0 +1,103 @@
+"""
+Load and query times of the database engines on the multi-year synthetic demand table: SQLite,
+DuckDB (embedded, it needs duckdb_engine) and the Postgres of BENCHMARK_DATABASE_URL if it is set.
+Every engine loads the table with load_to_db one month per transaction, loads it again (every
+row unchanged), and runs the queries of the machine learning process and of the database api.
+
+Usage:
+    python benchmarks/engines_benchmark.py [--quick] [--engines sqlite duckdb postgresql] [--output engines.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+import record_fixtures
+import standins
+from electrical_demand.database.client import DuckDbClient, SqLiteClient
+from electrical_demand.database.models import Base, Demand
+from electrical_demand.process_data.getters import get_demand
+from electrical_demand.process_data.loaders import load_to_db
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+COLUMNS = ["region", "demand", "day_type", "temperature", "temperature_forecast"]
+
+
+def clients(work_dir, engines):
+    if "sqlite" in engines:
+        yield "sqlite", SqLiteClient("sqlite", str(Path(work_dir) / "demand.db"))
+    if "duckdb" in engines:
+        yield "duckdb", DuckDbClient("duckdb", str(Path(work_dir) / "demand.duckdb"))
+    if "postgresql" in engines and os.environ.get("BENCHMARK_DATABASE_URL"):
+        yield "postgresql", standins.local_client(None)
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return time.perf_counter() - start, result
+
+def load(client, demand_table):
+    """Loads the table one month per call of load_to_db. Returns the counts of the load."""
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for _, month in demand_table.groupby([demand_table.index.year, demand_table.index.month]):
+        for outcome, rows in load_to_db(month.copy(), Demand, client, keep_index=True).items():
+            counts[outcome] += rows
+    return counts
+
+def benchmark(client, demand_table, region):
+    engine = client._get_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    start_date = demand_table.index.min().date()
+    end_date = demand_table.index.max().date() + timedelta(days=1)
+    day = end_date - timedelta(days=10)
+    result = {}
+    result["load_s"], result["load"] = timed(lambda: load(client, demand_table))
+    result["reload_s"], result["reload"] = timed(lambda: load(client, demand_table))
+    result["get_demand_region_s"], rows = timed(lambda: len(get_demand(client, region)))
+    result["range_total_s"], _ = timed(lambda: len(client.get_dataframe(Demand.range_query(None, start_date, end_date))))
+    result["day_total_s"], _ = timed(lambda: len(client.get_dataframe(Demand.day_query(None, day))))
+    result["rows"] = len(demand_table)
+    engine.dispose()
+    return result
+
+def run(engines, quick):
+    region_dicts = record_fixtures.load_region_dicts()
+    holidays = pd.read_csv(record_fixtures.DATA_DIR / "holidays.csv")
+    holidays["date"] = pd.to_datetime(holidays[["year", "month", "day"]])
+    holidays = holidays.set_index("date").drop(columns=["year", "month", "day"])
+    start_date = date(2022, 1, 1) if quick else date(2019, 1, 1)
+    demand_table = standins.synthetic_demand_table(region_dicts, holidays, start_date, date(2022, 11, 1))[COLUMNS]
+    # The rows to predict have no demand, a NaN does not fit the integer column of Postgres.
+    demand_table = demand_table[demand_table["demand"].notna()]
+    results = {"start_date": start_date.isoformat(), "engines": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, client in clients(work_dir, engines):
+            try:
+                results["engines"][name] = benchmark(client, demand_table, region_dicts[0]["region"])
+            except Exception as e:
+                results["engines"][name] = {"error": f"{type(e).__name__}: {e}"}
+            print(name, results["engines"][name], file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="use one year of data instead of 2019-2022")
+    parser.add_argument("--engines", nargs="+", choices=["sqlite", "duckdb", "postgresql"], default=["sqlite", "duckdb", "postgresql"])
+    parser.add_argument("--output", type=Path, help="defaults to benchmarks/results/engines.json")
+    args = parser.parse_args()
+
+    results = run(args.engines, args.quick)
+    output = args.output or RESULTS_DIR / "engines.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(output)
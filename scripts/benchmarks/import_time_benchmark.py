@@ -0,0 +1,174 @@
+"""
+Cold-start import benchmark of the Airflow docker task entry points.
+Every task runs in a new container, so the imports of its function body are paid on every run.
+For each task a fresh interpreter is started with `python -X importtime` and the cumulative import
+time of the task imports is compared against import_time_budget.json. The benchmark also fails if
+a task imports a module it must not need (for example scikit-learn in an S3 task).
+
+Usage:
+    python benchmarks/import_time_benchmark.py [--repeat 5] [--tolerance 1.5] [--update]
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BUDGET_PATH = Path(__file__).resolve().parent / "import_time_budget.json"
+
+# Imports of each task function in dags/tasks.py.
+TASK_IMPORTS = {
+    "upgrade_tables": [
+        "from electrical_demand.pipeline.schema import run_migrations",
+    ],
+    "load_reference_data_to_s3": [
+        "from electrical_demand.pipeline.raw_data import load_data_to_S3",
+    ],
+    "load_to_s3": [
+        "from electrical_demand.pipeline.raw_data import load_raw_temp",
+    ],
+    "compact_to_s3": [
+        "import pendulum",
+        "from electrical_demand.pipeline.raw_data import compact_raw_data",
+    ],
+    "load_to_database": [
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Demand",
+        "from electrical_demand.pipeline.database import load_historical_demand_to_database, load_temp_to_database",
+    ],
+    "get_regions": [
+        "from electrical_demand.process_data.getters import get_region_dicts",
+    ],
+    "run_machine_learning": [
+        "from electrical_demand.pipeline.ml import ml_process_region",
+        "from electrical_demand.config import SERIES_STORE_DIR",
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Forecast",
+        "from electrical_demand.series_store import SeriesStore",
+    ],
+    "refresh_series_store": [
+        "from electrical_demand.series_store import refresh_series_store",
+        "from electrical_demand.database.client import ComplexClient",
+    ],
+    "load_new_to_s3": [
+        "from electrical_demand.pipeline.raw_data import load_raw_demand_to_s3, load_raw_temp",
+        "from electrical_demand.process_data.utils import get_new_data_dates",
+    ],
+    "load_new_to_database": [
+        "from electrical_demand.pipeline.database import load_demand_to_database, load_temp_to_database",
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Demand",
+        "from electrical_demand.process_data.utils import get_new_data_dates",
+    ],
+    "verify_ingestion": [
+        "import pendulum",
+        "from electrical_demand.pipeline.verify import verify_ingestion",
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Demand",
+    ],
+    "backfill_gaps": [
+        "import pendulum",
+        "from electrical_demand.pipeline.coverage import backfill_gaps",
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Demand",
+    ],
+    "load_pipelined": [
+        "import pendulum",
+        "from electrical_demand.pipeline.pipelined import pipelined_etl",
+        "from electrical_demand.database.client import ComplexClient",
+        "from electrical_demand.database.models import Demand",
+    ],
+}
+
+# Modules that a task must not import.
+FORBIDDEN_MODULES = {
+    "upgrade_tables": ["sklearn", "s3fs", "pandas", "requests", "alembic"],
+    "load_reference_data_to_s3": ["sklearn", "alembic", "sqlalchemy"],
+    "load_to_s3": ["sklearn", "alembic", "sqlalchemy"],
+    "compact_to_s3": ["sklearn", "alembic", "sqlalchemy"],
+    "load_to_database": ["sklearn", "alembic"],
+    "get_regions": ["sklearn", "alembic", "sqlalchemy", "requests"],
+    "run_machine_learning": ["alembic", "requests"],
+    "refresh_series_store": ["sklearn", "alembic", "requests"],
+    "load_new_to_s3": ["sklearn", "alembic", "sqlalchemy"],
+    "load_new_to_database": ["sklearn", "alembic"],
+    "verify_ingestion": ["sklearn", "alembic"],
+    "backfill_gaps": ["sklearn", "alembic"],
+    "load_pipelined": ["sklearn", "alembic"],
+}
+
+
+def import_time(statements):
+    """
+    Runs the statements in a new interpreter with -X importtime.
+
+    Returns
+    -------
+    total_us : int
+        Sum of the cumulative import time of the top level imports, in microseconds.
+    modules : set of str
+        Every imported module.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "; ".join(statements)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total_us = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules.add(name.strip())
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative)
+    return total_us, modules
+
+def run(repeat=5):
+    results = {}
+    for task_name, statements in TASK_IMPORTS.items():
+        timings = []
+        for _ in range(repeat):
+            total_us, modules = import_time(statements)
+            timings.append(total_us)
+        forbidden = sorted(
+            module for module in modules
+            for prefix in FORBIDDEN_MODULES.get(task_name, [])
+            if module == prefix or module.startswith(prefix + ".")
+        )
+        results[task_name] = {"import_us": min(timings), "modules": len(modules), "forbidden": forbidden}
+    return results
+
+def check(results, budget, tolerance):
+    errors = []
+    for task_name, result in results.items():
+        if result["forbidden"]:
+            errors.append(f"{task_name}: imports forbidden modules {result['forbidden']}")
+        if task_name in budget and result["import_us"] > budget[task_name] * tolerance:
+            errors.append(f"{task_name}: {result['import_us']} us > {budget[task_name]} us x {tolerance}")
+    return errors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed ratio over the budget")
+    parser.add_argument("--update", action="store_true", help="write the current timings as the new budget")
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    print(json.dumps(results, indent=4))
+    if args.update:
+        with open(BUDGET_PATH, "w") as f:
+            json.dump({task_name: result["import_us"] for task_name, result in results.items()}, f, indent=4)
+        sys.exit(0)
+    budget = {}
+    if BUDGET_PATH.exists():
+        with open(BUDGET_PATH, "r") as f:
+            budget = json.load(f)
+    errors = check(results, budget, args.tolerance)
+    for error in errors:
+        print(error, file=sys.stderr)
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,159 @@
+"""
+Load test of the database api. It seeds a local database with the synthetic demand table (a SQLite
+file, or the Postgres of BENCHMARK_DATABASE_URL), serves the api with uvicorn and sends requests
+from an increasing number of concurrent clients. For every concurrency level it reports the
+p50/p95/p99 latency, the requests per second and the failed requests. The results are saved as JSON.
+
+Usage:
+    python benchmarks/load_test.py [--concurrency 1 2 4 8 16 32 64] [--duration 10] [--endpoint region range]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import record_fixtures
+import standins
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def seed_database(work_dir, start_date, end_date):
+    """Creates the tables of a local database and loads the synthetic demand and forecast tables."""
+    region_dicts = record_fixtures.load_region_dicts()
+    holidays = pd.read_csv(record_fixtures.DATA_DIR / "holidays.csv")
+    holidays["date"] = pd.to_datetime(holidays[["year", "month", "day"]])
+    holidays = holidays.set_index("date").drop(columns=["year", "month", "day"])
+    demand_table = standins.synthetic_demand_table(region_dicts, holidays, start_date, end_date)
+    client = standins.local_client(str(Path(work_dir) / "demand.db"))
+    engine = client._get_engine()
+    standins.seed(engine, demand_table)
+    engine.dispose()
+    return [region_dict["region"] for region_dict in region_dicts]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def serve(app, port):
+    """Runs uvicorn in a thread and returns the server once it accepts requests."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+def request_paths(endpoint, regions, start_date, end_date, seed=0):
+    """Endless random request paths of an endpoint."""
+    rng = random.Random(seed)
+    days = (end_date - start_date).days - 1
+    while True:
+        region = rng.choice(regions + ["TOTAL"])
+        day = start_date + timedelta(days=rng.randrange(days))
+        if endpoint == "region":
+            yield f"/get-region/{region}/{day}"
+        else:
+            yield f"/get-range/{region}/{day}/{min(day + timedelta(days=rng.randrange(7, 90)), end_date)}?points=1000"
+
+async def run_level(base_url, paths, concurrency, duration):
+    """
+    Sends requests from concurrency clients during duration seconds.
+
+    Returns
+    -------
+    result : dict
+        Latency percentiles in milliseconds, requests per second and errors.
+    """
+    import httpx
+
+    latencies = []
+    errors = {}
+    deadline = time.perf_counter() + duration
+
+    async def worker(http_client):
+        while time.perf_counter() < deadline:
+            path = next(paths)
+            start = time.perf_counter()
+            try:
+                response = await http_client.get(path)
+                status = response.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http_client:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(http_client) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    result = {"concurrency": concurrency, "requests": len(latencies), "errors": errors, "requests_per_s": len(latencies) / elapsed}
+    if latencies:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result.update({"p50_ms": p50, "p95_ms": p95, "p99_ms": p99})
+    return result
+
+def run(concurrency_levels, duration, endpoints, start_date, end_date):
+    for variable in ("DATABASE_TYPE", "DATABASE_USER", "DATABASE_PASSWORD", "DATABASE_HOST", "DATABASE_NAME"):
+        os.environ.setdefault(variable, "benchmark")
+    from electrical_demand.database_api import api
+    from electrical_demand.database_api.config import DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, REQUEST_TIMEOUT
+
+    results = {"pool_size": DATABASE_POOL_SIZE, "max_overflow": DATABASE_MAX_OVERFLOW, "duration_s": duration, "endpoints": {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        regions = seed_database(work_dir, start_date, end_date)
+        api.client = standins.local_async_client(
+            str(Path(work_dir) / "demand.db"), pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout=DATABASE_POOL_TIMEOUT, statement_timeout=REQUEST_TIMEOUT,
+        )
+        results["database"] = api.client.dialect
+        port = free_port()
+        server, thread = serve(api.app, port)
+        try:
+            for endpoint in endpoints:
+                paths = request_paths(endpoint, regions, start_date, end_date)
+                results["endpoints"][endpoint] = []
+                for concurrency in concurrency_levels:
+                    result = asyncio.run(run_level(f"http://127.0.0.1:{port}", paths, concurrency, duration))
+                    results["endpoints"][endpoint].append(result)
+                    print(endpoint, result, file=sys.stderr)
+        finally:
+            server.should_exit = True
+            thread.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--endpoint", nargs="+", choices=["region", "range"], default=["region", "range"])
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2022, 1, 1))
+    parser.add_argument("--end", type=date.fromisoformat, default=date(2022, 11, 1))
+    parser.add_argument("--output", type=Path, help="defaults to benchmarks/results/load_test.json")
+    args = parser.parse_args()
+
+    results = run(args.concurrency, args.duration, args.endpoint, args.start, args.end)
+    output = args.output or RESULTS_DIR / "load_test.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(output)
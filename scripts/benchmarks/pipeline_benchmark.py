@@ -0,0 +1,145 @@
+"""
+Sequential ETL against the pipelined ETL of electrical_demand.pipeline.pipelined over a range of
+dates. The downloads return the recorded fixtures (with the dates of each day) after a simulated
+network latency, S3 is a local directory and each run has its own SQLite database (or the
+Postgres of BENCHMARK_DATABASE_URL, used by both runs one after the other). The sequential run is
+load_raw_temp, load_raw_demand_to_s3, load_demand_to_database and load_temp_to_database as the
+dags run them. Both runs must leave the same demand table and the same files in the buckets.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py [--days 14] [--latency 0.2] [--download-workers 4] [--output pipeline.json]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import record_fixtures
+import standins
+from electrical_demand.api.api import DemandByDateByRegionApi, ForecastSMNApi, SMNApi
+from electrical_demand.database.models import Base, Demand
+from electrical_demand.pipeline import raw_data
+from electrical_demand.pipeline.database import load_demand_to_database, load_temp_to_database
+from electrical_demand.pipeline.pipelined import pipelined_etl
+from electrical_demand.process_data.utils import daterange
+from electrical_demand.storage import get_storage
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+FIXTURE_DATE = date(2022, 11, 1)
+DEMAND_QUERY = "SELECT datetime, region, demand, day_type, temperature, temperature_forecast FROM demand ORDER BY datetime, region"
+
+
+def install_downloads(latency):
+    """Replaces the downloads of the apis with the fixtures of FIXTURE_DATE moved to the requested date."""
+    forecast_text = record_fixtures.read_text(record_fixtures.forecast_path(FIXTURE_DATE))
+    historical_text = record_fixtures.read_text(record_fixtures.historical_path(FIXTURE_DATE))
+    demand_responses = json.loads(record_fixtures.read_text(record_fixtures.demand_path(FIXTURE_DATE)))
+
+    def move(text, day):
+        next_day = FIXTURE_DATE + timedelta(days=1)
+        return (
+            text.replace(FIXTURE_DATE.strftime("%d%m%Y"), day.strftime("%d%m%Y"))
+            .replace(next_day.isoformat(), (day + timedelta(days=1)).isoformat())
+            .replace(FIXTURE_DATE.isoformat(), day.isoformat())
+        )
+
+    def download_demand(api, demand_date, region_id):
+        # A region has one request per api id, each one much smaller than a temperature file.
+        time.sleep(latency / 10)
+        return move(demand_responses[region_id], demand_date)
+
+    def download_temp(api, temp_date):
+        time.sleep(latency)
+        return move(forecast_text if isinstance(api, ForecastSMNApi) else historical_text, temp_date)
+
+    DemandByDateByRegionApi._download = download_demand
+    SMNApi._download = download_temp
+    SMNApi._download_chunks = lambda api, temp_date: [download_temp(api, temp_date)]
+
+def setup(work_dir, tag):
+    """Uploads the reference files to the general bucket of the run and creates its database."""
+    data_dir = record_fixtures.DATA_DIR
+    raw_data.load_historical_demand = lambda *args, **kwargs: None
+    raw_data.load_data_to_S3(
+        f"general-{tag}", data_dir / "stations.csv", data_dir / "temp_forecast_stations.csv", data_dir / "temp_historical_stations.csv",
+        None, data_dir / "holidays.csv", data_dir / "regions.json",
+    )
+    client = standins.local_client(str(Path(work_dir) / f"{tag}.db"))
+    engine = client._get_engine()
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return client
+
+def buckets(tag):
+    return {"general": f"general-{tag}", "demand": f"demand-{tag}", "temp_forecast": f"temp-forecast-{tag}", "temp_historical": f"temp-historical-{tag}"}
+
+def sequential(client, tag, start_date, end_date):
+    bucket = buckets(tag)
+    raw_data.load_raw_temp(bucket["temp_forecast"], bucket["temp_historical"], bucket["general"], start_date=start_date, end_date=end_date)
+    for day in daterange(start_date, end_date):
+        raw_data.load_raw_demand_to_s3(day, bucket["general"], bucket["demand"])
+    for day in daterange(start_date, end_date):
+        load_demand_to_database(client, Demand, bucket["demand"], bucket["general"], day)
+    load_temp_to_database(client, Demand, bucket["temp_forecast"], bucket["temp_historical"], bucket["general"], start_date=start_date, end_date=end_date)
+
+def same_files(tag, other_tag):
+    storage = get_storage()
+    for dataset in ("demand", "temp_forecast", "temp_historical"):
+        bucket, other_bucket = buckets(tag)[dataset], buckets(other_tag)[dataset]
+        paths = sorted(storage.list(bucket, ""))
+        if paths != sorted(storage.list(other_bucket, "")):
+            return False
+        if any(storage.read_bytes(bucket, path) != storage.read_bytes(other_bucket, path) for path in paths):
+            return False
+    return True
+
+def run(days, latency, download_workers):
+    install_downloads(latency)
+    end_date = FIXTURE_DATE
+    start_date = end_date - timedelta(days=days)
+    results = {"days": days, "latency_s": latency, "download_workers": download_workers}
+    with tempfile.TemporaryDirectory() as work_dir:
+        standins.install_local_s3(str(Path(work_dir) / "s3"))
+
+        client = setup(work_dir, "sequential")
+        start = time.perf_counter()
+        sequential(client, "sequential", start_date, end_date)
+        results["sequential_s"] = time.perf_counter() - start
+        expected = client.get_dataframe(DEMAND_QUERY)
+        client._get_engine().dispose()
+
+        client = setup(work_dir, "pipelined")
+        bucket = buckets("pipelined")
+        start = time.perf_counter()
+        report = pipelined_etl(
+            client, Demand, bucket["general"], bucket["demand"], bucket["temp_forecast"], bucket["temp_historical"], start_date, end_date,
+            download_workers=download_workers,
+        )
+        results["pipelined_s"] = time.perf_counter() - start
+        results["stages"] = report["stages"]
+        results["same_demand_table"] = client.get_dataframe(DEMAND_QUERY).equals(expected)
+        results["same_files"] = same_files("sequential", "pipelined")
+        client._get_engine().dispose()
+    results["speedup"] = results["sequential_s"] / results["pipelined_s"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per temperature file download")
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--output", type=Path, help="defaults to benchmarks/results/pipeline.json")
+    args = parser.parse_args()
+
+    results = run(args.days, args.latency, args.download_workers)
+    print(json.dumps(results, indent=4), file=sys.stderr)
+    output = args.output or RESULTS_DIR / "pipeline.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(output)
@@ -0,0 +1,141 @@
+"""
+Records the SMN and CAMMESA responses used by the offline benchmarks.
+By default the responses of one date are downloaded with the API classes and saved gzipped in
+benchmarks/fixtures. With --synthetic the files are generated in the same format, using the
+station names of the data folder, for environments without access to the APIs.
+
+Usage:
+    python benchmarks/record_fixtures.py [--date 2022-11-01] [--synthetic]
+"""
+
+import argparse
+import gzip
+import json
+import math
+import random
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from electrical_demand.api.api import ForecastSMNApi, HistoricalSNMPApi, DemandByDateByRegionApi, MONTHS_DICT
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+
+SPANISH_MONTHS = {english: spanish for spanish, english in MONTHS_DICT.items()}
+
+
+def forecast_path(fixture_date):
+    return FIXTURES_DIR / ("pron%4d%02d%02d.txt.gz" % (fixture_date.year, fixture_date.month, fixture_date.day))
+
+def historical_path(fixture_date):
+    return FIXTURES_DIR / ("datohorario%4d%02d%02d.txt.gz" % (fixture_date.year, fixture_date.month, fixture_date.day))
+
+def demand_path(fixture_date):
+    return FIXTURES_DIR / ("demanda%4d%02d%02d.json.gz" % (fixture_date.year, fixture_date.month, fixture_date.day))
+
+def read_text(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return f.read()
+
+def write_text(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(text)
+
+def load_region_dicts():
+    with open(DATA_DIR / "regions.json", "r") as f:
+        return json.load(f)
+
+def record(fixture_date):
+    """Downloads the responses of fixture_date from the real APIs."""
+    write_text(forecast_path(fixture_date), ForecastSMNApi(None, None)._download(fixture_date))
+    write_text(historical_path(fixture_date), HistoricalSNMPApi(None, None)._download(fixture_date))
+    demand_api = DemandByDateByRegionApi(None)
+    responses = {}
+    for region_dict in load_region_dicts():
+        for region_id in region_dict["api_ids"]:
+            responses[region_id] = demand_api._download(fixture_date, region_id)
+    write_text(demand_path(fixture_date), json.dumps(responses))
+
+def synthetic_forecast(fixture_date, stations, rng):
+    lines = [
+        "*" * 96,
+        "Producto basado en un modelo de pronóstico numérico del tiempo, ",
+        "por lo tanto puede diferir del pronostico emitido por el SMN",
+        "*" * 96,
+        "",
+    ]
+    first_datetime = datetime(fixture_date.year, fixture_date.month, fixture_date.day)
+    for station in stations:
+        lines += [
+            station,
+            "=" * 96,
+            "    FECHA *          TEMPERATURA      VIENTO      PRECIPITACION(mm)",
+            "                                    (DIR | KM/H)                        ",
+            "=" * 96,
+        ]
+        base = rng.uniform(5, 30)
+        for point in range(40):
+            point_datetime = first_datetime + timedelta(hours=3 * point)
+            month = SPANISH_MONTHS[point_datetime.strftime("%b")]
+            temperature = base + 6 * math.sin((point_datetime.hour - 9) * math.pi / 12) + rng.uniform(-1, 1)
+            lines.append(
+                " %02d/%s/%4d %02dHs.        %4.1f        %2d |  %2d         %3.1f "
+                % (point_datetime.day, month, point_datetime.year, point_datetime.hour, temperature, rng.randint(0, 99), rng.randint(0, 40), rng.uniform(0, 5))
+            )
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+def synthetic_historical(fixture_date, stations, rng):
+    lines = [
+        "FECHA     HORA  TEMP   HUM   PNM    DD    FF     NOMBRE                                             ",
+        "        [HOA]  [ºC]   [%]  [hPa]  [gr] [km/hr]                                                     ",
+    ]
+    for station in stations:
+        base = rng.uniform(5, 30)
+        for hour in range(24):
+            temperature = base + 6 * math.sin((hour - 9) * math.pi / 12) + rng.uniform(-1, 1)
+            lines.append(
+                "%02d%02d%4d%6d%6.1f%5d%8.1f%5d%5d     %s"
+                % (fixture_date.day, fixture_date.month, fixture_date.year, hour, temperature, rng.randint(10, 99), rng.uniform(990, 1030), rng.randint(0, 360), rng.randint(0, 60), station.ljust(51))
+            )
+    return "\n".join(lines) + "\n"
+
+def synthetic_demand(fixture_date, region_ids, rng):
+    responses = {}
+    first_datetime = datetime(fixture_date.year, fixture_date.month, fixture_date.day)
+    for region_id in region_ids:
+        base = rng.uniform(50, 5000)
+        points = []
+        for minutes in range(5, 24 * 60 + 5, 5):
+            point_datetime = first_datetime + timedelta(minutes=minutes)
+            demand = base * (1 + 0.25 * math.sin((point_datetime.hour - 6) * math.pi / 12))
+            point = {"fecha": point_datetime.strftime("%Y-%m-%dT%H:%M:00.000-0300"), "dem": int(demand)}
+            if minutes % 15 == 0:
+                point["temp"] = round(rng.uniform(5, 30), 1)
+            points.append(point)
+        responses[region_id] = json.dumps(points)
+    return responses
+
+def synthesize(fixture_date, seed=0):
+    """Generates the responses of fixture_date in the format of the real APIs."""
+    rng = random.Random(seed)
+    forecast_stations = pd.read_csv(DATA_DIR / "temp_forecast_stations.csv")["station_raw"].dropna()
+    historical_stations = pd.read_csv(DATA_DIR / "stations.csv")["station"].dropna()
+    region_ids = [region_id for region_dict in load_region_dicts() for region_id in region_dict["api_ids"]]
+    write_text(forecast_path(fixture_date), synthetic_forecast(fixture_date, forecast_stations, rng))
+    write_text(historical_path(fixture_date), synthetic_historical(fixture_date, historical_stations, rng))
+    write_text(demand_path(fixture_date), json.dumps(synthetic_demand(fixture_date, region_ids, rng)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--date", type=date.fromisoformat, default=date(2022, 11, 1))
+    parser.add_argument("--synthetic", action="store_true", help="generate the responses instead of downloading them")
+    args = parser.parse_args()
+    if args.synthetic:
+        synthesize(args.date)
+    else:
+        record(args.date)
@@ -0,0 +1,276 @@
+"""
+Offline benchmark suite of the ETL, the machine learning process and the database api.
+It runs without network access: the API responses come from the recorded fixtures
+(see record_fixtures.py), S3 is replaced by a local directory and the database is a local
+SQLite file (or the Postgres of BENCHMARK_DATABASE_URL). The results are saved as JSON so they
+can be compared between commits with compare.py.
+
+Usage:
+    python benchmarks/run.py [--quick] [--repeat 5] [--only forecast_process_data ...] [--output results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+
+import record_fixtures
+import standins
+from electrical_demand.api.api import ForecastSMNApi, HistoricalSNMPApi, DemandByDateByRegionApi, DOWNLOAD_CHUNK_SIZE
+from electrical_demand.database.models import Demand, Forecast
+from electrical_demand.ml.demand_forecast import train_and_predictions
+from electrical_demand.process_data.getters import get_csv_from_s3, get_demand
+from electrical_demand.process_data.loaders import load_df_csv_to_s3, load_to_db
+from electrical_demand.process_data.utils import new_rows, year_calendar
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+FIXTURE_DATE = date(2022, 11, 1)
+CASES = {}
+
+
+def case(function):
+    CASES[function.__name__] = function
+    return function
+
+def chunks(text, size=DOWNLOAD_CHUNK_SIZE):
+    """Splits text like the chunks of a streamed response."""
+    return (text[i:i + size] for i in range(0, len(text), size))
+
+def measure(function, repeat):
+    """
+    Calls function repeat times.
+
+    Returns
+    -------
+    result : dict
+        Best and mean time in seconds and the rows returned by the function.
+    """
+    timings = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = function()
+        timings.append(time.perf_counter() - start)
+    return {"best_s": min(timings), "mean_s": sum(timings) / len(timings), "repeat": repeat, "rows": rows}
+
+
+class Context():
+    """Inputs shared by the benchmark cases. Expensive inputs are built on first use."""
+
+    def __init__(self, work_dir, quick):
+        self.work_dir = Path(work_dir)
+        self.start_date = date(2022, 1, 1) if quick else date(2019, 1, 1)
+        self.end_date = date(2022, 11, 1)
+        self.region_dicts = record_fixtures.load_region_dicts()
+        holidays = pd.read_csv(record_fixtures.DATA_DIR / "holidays.csv")
+        holidays["date"] = pd.to_datetime(holidays[["year", "month", "day"]])
+        self.holidays = holidays.set_index("date").drop(columns=["year", "month", "day"])
+        self.forecast_text = record_fixtures.read_text(record_fixtures.forecast_path(FIXTURE_DATE))
+        self.historical_text = record_fixtures.read_text(record_fixtures.historical_path(FIXTURE_DATE))
+        self.demand_responses = json.loads(record_fixtures.read_text(record_fixtures.demand_path(FIXTURE_DATE)))
+        stations = pd.read_csv(record_fixtures.DATA_DIR / "stations.csv")
+        self.forecast_stations = pd.read_csv(record_fixtures.DATA_DIR / "temp_forecast_stations.csv").merge(stations, how="inner", on="station")
+        self.historical_stations = pd.read_csv(record_fixtures.DATA_DIR / "temp_historical_stations.csv").merge(stations, how="inner", on="station")
+        self.required_stations = [region_dict["station"] for region_dict in self.region_dicts]
+        standins.install_local_s3(str(self.work_dir / "s3"))
+        self._demand_table = None
+        self._client = None
+        self.async_client = None
+        self.loop = None
+
+    @property
+    def demand_table(self):
+        if self._demand_table is None:
+            self._demand_table = standins.synthetic_demand_table(self.region_dicts, self.holidays, self.start_date, self.end_date)
+        return self._demand_table
+
+    @property
+    def client(self):
+        """Local database seeded with the synthetic demand and forecast tables."""
+        if self._client is None:
+            self._client = standins.local_client(str(self.work_dir / "demand.db"))
+            standins.seed(self._client._get_engine(), self.demand_table)
+        return self._client
+
+
+@case
+def forecast_process_data(context, repeat):
+    api = ForecastSMNApi(None, context.forecast_stations)
+    return measure(lambda: len(api._process_data(context.forecast_text, FIXTURE_DATE)), repeat)
+
+@case
+def historical_process_data(context, repeat):
+    api = HistoricalSNMPApi(None, context.historical_stations)
+    return measure(lambda: len(api._process_data(context.historical_text, FIXTURE_DATE)), repeat)
+
+@case
+def forecast_process_data_required_stations(context, repeat):
+    api = ForecastSMNApi(None, context.forecast_stations, stations=context.required_stations)
+    return measure(lambda: len(api._process_data(context.forecast_text, FIXTURE_DATE)), repeat)
+
+@case
+def historical_process_data_required_stations(context, repeat):
+    api = HistoricalSNMPApi(None, context.historical_stations, stations=context.required_stations)
+    return measure(lambda: len(api._process_data(context.historical_text, FIXTURE_DATE)), repeat)
+
+@case
+def forecast_etl_transform(context, repeat):
+    api = ForecastSMNApi(None, context.forecast_stations)
+    api._download = lambda temp_date: context.forecast_text
+    return measure(lambda: len(api.etl(FIXTURE_DATE, save=False, stream=False)), repeat)
+
+@case
+def historical_etl_transform(context, repeat):
+    api = HistoricalSNMPApi(None, context.historical_stations)
+    api._download = lambda temp_date: context.historical_text
+    return measure(lambda: len(api.etl(FIXTURE_DATE, save=False, stream=False)), repeat)
+
+@case
+def forecast_etl_stream(context, repeat):
+    api = ForecastSMNApi(None, context.forecast_stations)
+    api._download_chunks = lambda temp_date: chunks(context.forecast_text)
+    return measure(lambda: len(api.etl(FIXTURE_DATE, save=False)), repeat)
+
+@case
+def historical_etl_stream(context, repeat):
+    api = HistoricalSNMPApi(None, context.historical_stations)
+    api._download_chunks = lambda temp_date: chunks(context.historical_text)
+    return measure(lambda: len(api.etl(FIXTURE_DATE, save=False)), repeat)
+
+@case
+def demand_to_df(context, repeat):
+    api = DemandByDateByRegionApi(None)
+    api._download = lambda demand_date, region_id: context.demand_responses[region_id]
+    return measure(lambda: len(api.etl(FIXTURE_DATE, context.region_dicts, save=False)), repeat)
+
+@case
+def new_rows_multi_year_cold(context, repeat):
+    def run():
+        year_calendar.cache_clear()
+        return len(new_rows(context.region_dicts, context.holidays, context.start_date, end_date=context.end_date))
+    return measure(run, repeat)
+
+@case
+def new_rows_daily(context, repeat):
+    return measure(lambda: len(new_rows(context.region_dicts, context.holidays, context.end_date)), repeat)
+
+@case
+def s3_csv_roundtrip(context, repeat):
+    api = ForecastSMNApi(None, context.forecast_stations)
+    api._download = lambda temp_date: context.forecast_text
+    dataframe = api.etl(FIXTURE_DATE, save=False, stream=False)
+    def run():
+        load_df_csv_to_s3(dataframe, "benchmark-bucket", "csv/year=2022/month=11/01.csv")
+        return len(get_csv_from_s3("benchmark-bucket", "csv/year=2022/month=11/01.csv", index_col="datetime", parse_dates=True))
+    return measure(run, repeat)
+
+@case
+def load_to_db_month(context, repeat):
+    month = context.demand_table.loc["2022-10-01":"2022-10-31", ["region", "demand", "day_type", "temperature"]]
+    client = context.client
+    def run():
+        load_to_db(month.copy(), Demand, client, keep_index=True)
+        return len(month)
+    return measure(run, repeat)
+
+@case
+def load_forecast_month(context, repeat):
+    month = context.demand_table.loc["2022-10-01":"2022-10-31", ["region", "temperature_forecast"]].rename(columns={"temperature_forecast": "demand_forecast"})
+    month["issued_at"] = datetime(2022, 11, 1)
+    client = context.client
+    runs = iter(range(repeat))
+    def run():
+        load_to_db(month.assign(run_id=f"benchmark-{next(runs)}"), Forecast, client, keep_index=True)
+        return len(month)
+    return measure(run, repeat)
+
+@case
+def train_and_predictions_region(context, repeat):
+    dataset = get_demand(context.client, context.region_dicts[0]["region"])
+    dataset.drop(columns=["region"], inplace=True)
+    return measure(lambda: len(train_and_predictions(dataset.copy())), repeat)
+
+def endpoint_client(context):
+    """Asyncio client of the database of the context for the database api, with the event loop that runs it."""
+    for variable in ("DATABASE_TYPE", "DATABASE_USER", "DATABASE_PASSWORD", "DATABASE_HOST", "DATABASE_NAME"):
+        os.environ.setdefault(variable, "benchmark")
+    from electrical_demand.database_api import api
+
+    context.client
+    if context.async_client is None:
+        context.async_client = standins.local_async_client(str(context.work_dir / "demand.db"))
+        context.loop = asyncio.new_event_loop()
+    api.client = context.async_client
+    return api, context.loop
+
+@case
+def get_region_endpoint(context, repeat):
+    api, loop = endpoint_client(context)
+    day = context.end_date - timedelta(days=10)
+    return measure(lambda: len(json.loads(loop.run_until_complete(api.get_region(context.region_dicts[0]["region"], day))["data"])["hour"]), repeat)
+
+@case
+def get_range_endpoint(context, repeat):
+    api, loop = endpoint_client(context)
+    region = context.region_dicts[0]["region"]
+    return measure(lambda: loop.run_until_complete(api.get_range(region, context.start_date, context.end_date, points=1000, method="lttb"))["rows"], repeat)
+
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run(cases, repeat, quick, verbose=False):
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "quick": quick,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        context = Context(work_dir, quick)
+        results["database"] = standins.local_client(str(Path(work_dir) / "demand.db")).dialect
+        for name in cases:
+            try:
+                results["cases"][name] = CASES[name](context, repeat)
+            except Exception as e:
+                if verbose:
+                    traceback.print_exc()
+                results["cases"][name] = {"error": f"{type(e).__name__}: {e}"}
+            print(name, results["cases"][name], file=sys.stderr)
+        if context.loop is not None:
+            context.loop.run_until_complete(context.async_client.dispose())
+            context.loop.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="use one year of data instead of 2019-2022")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--output", type=Path, help="defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--verbose", action="store_true", help="print the traceback of the failed cases")
+    args = parser.parse_args()
+
+    results = run(args.only, args.repeat, args.quick, args.verbose)
+    output = args.output or RESULTS_DIR / f"{results['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(output)
@@ -13,4 +13,11 @@ TEMP_HISTORICAL_BUCKET_NAME=dconfig("TEMP_HISTORICAL_BUCKET_NAME")
 GENERAL_BUCKET_NAME=dconfig("GENERAL_BUCKET_NAME")
 DEMAND_BUCKET_NAME=dconfig("DEMAND_BUCKET_NAME")
 DATABASE_STRING = f"{DATABASE_TYPE}://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
-DEMAND_DOCKER_IMAGE=dconfig("DEMAND_DOCKER_IMAGE")
\ No newline at end of file
+DEMAND_DOCKER_IMAGE=dconfig("DEMAND_DOCKER_IMAGE")
+BACKFILL_POOL=dconfig("BACKFILL_POOL", default="demand_backfill")
+BACKFILL_RETRIES=dconfig("BACKFILL_RETRIES", default=2, cast=int)
+METRICS_ENABLED=dconfig("METRICS_ENABLED", default=False, cast=bool)
+STORAGE_CACHE_ENABLED=dconfig("STORAGE_CACHE_ENABLED", default=False, cast=bool)
+STORAGE_CACHE_MAX_BYTES=dconfig("STORAGE_CACHE_MAX_BYTES", default=2 * 1024**3, cast=int)
+SERIES_STORE_ENABLED=dconfig("SERIES_STORE_ENABLED", default=False, cast=bool)
+PROFILING_ENABLED=dconfig("PROFILING_ENABLED", default=False, cast=bool)
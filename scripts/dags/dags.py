@@ -2,7 +2,7 @@ from airflow.decorators import dag
 from datetime import timedelta, date
 import pendulum
 from config import DATABASE_STRING, DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD, TEMP_FORECAST_BUCKET_NAME, TEMP_HISTORICAL_BUCKET_NAME, GENERAL_BUCKET_NAME, DEMAND_BUCKET_NAME
-from tasks import upgrade_tables, load_to_s3, load_to_database, run_machine_learning, load_new_to_s3, load_new_to_database
+from tasks import upgrade_tables, split_in_months, load_reference_data_to_s3, load_to_s3, compact_to_s3, load_to_database, get_regions, run_machine_learning, load_new_to_s3, load_new_to_database, verify_ingestion, backfill_gaps, load_pipelined, refresh_series_store
 
 @dag(
     schedule=None,
@@ -13,11 +13,16 @@ from tasks import upgrade_tables, load_to_s3, load_to_database, run_machine_lear
 def data_preparation_dag(database_string, database_type, database_name, database_host, database_user, database_password, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
 
     upgrade_tables_r = upgrade_tables(database_string)
-    load_to_s3_r = load_to_s3(general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
-    load_to_database_r = load_to_database(database_type, database_name, database_host, database_user, database_password, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
-    run_machine_learning_r = run_machine_learning(database_type, database_name, database_host, database_user, database_password, general_bucket)
+    months = split_in_months(start_date, end_date)
+    load_reference_data_to_s3_r = load_reference_data_to_s3(general_bucket)
+    load_to_s3_r = load_to_s3.partial(general_bucket=general_bucket, temp_forecast_bucket=temp_forecast_bucket, temp_historical_bucket=temp_historical_bucket).expand_kwargs(months)
+    compact_to_s3_r = compact_to_s3.partial(buckets=[temp_forecast_bucket, temp_historical_bucket]).expand_kwargs(months)
+    load_to_database_r = load_to_database.partial(database_type=database_type, database_name=database_name, database_host=database_host, database_user=database_user, database_password=database_password, general_bucket=general_bucket, temp_forecast_bucket=temp_forecast_bucket, temp_historical_bucket=temp_historical_bucket, first_date=start_date).expand_kwargs(months)
+    refresh_series_store_r = refresh_series_store(database_type, database_name, database_host, database_user, database_password)
+    regions = get_regions(general_bucket)
+    run_machine_learning_r = run_machine_learning.partial(database_type=database_type, database_name=database_name, database_host=database_host, database_user=database_user, database_password=database_password, run_id="{{ run_id }}").expand(region=regions)
 
-    upgrade_tables_r >> load_to_s3_r >> load_to_database_r >> run_machine_learning_r
+    upgrade_tables_r >> load_reference_data_to_s3_r >> load_to_s3_r >> compact_to_s3_r >> load_to_database_r >> refresh_series_store_r >> regions >> run_machine_learning_r
 
 @dag(
     schedule=timedelta(days=1),
@@ -29,10 +34,43 @@ def new_data_dag(database_string, database_type, database_name, database_host, d
 
     upgrade_tables_r = upgrade_tables(database_string)
     load_new_to_s3_r = load_new_to_s3(general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, "{{ ds }}")
+    compact_to_s3_r = compact_to_s3([demand_bucket, temp_forecast_bucket, temp_historical_bucket], current_date="{{ ds }}")
     load_new_to_database_r = load_new_to_database(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, "{{ ds }}")
-    run_machine_learning_r = run_machine_learning(database_type, database_name, database_host, database_user, database_password, general_bucket)
+    refresh_series_store_r = refresh_series_store(database_type, database_name, database_host, database_user, database_password)
+    regions = get_regions(general_bucket)
+    run_machine_learning_r = run_machine_learning.partial(database_type=database_type, database_name=database_name, database_host=database_host, database_user=database_user, database_password=database_password, run_id="{{ run_id }}").expand(region=regions)
 
-    upgrade_tables_r >> load_new_to_s3_r >> load_new_to_database_r >> run_machine_learning_r
+    upgrade_tables_r >> load_new_to_s3_r >> compact_to_s3_r >> load_new_to_database_r >> refresh_series_store_r >> regions >> run_machine_learning_r
+
+@dag(
+    schedule=None,
+    start_date=pendulum.datetime(2022, 11, 1, 1, 0, 0, tz="America/Argentina/Buenos_Aires"),
+    catchup=False,
+)
+def verify_ingestion_dag(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, repair=False):
+
+    verify_ingestion(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, repair)
+
+@dag(
+    schedule=None,
+    start_date=pendulum.datetime(2022, 11, 1, 1, 0, 0, tz="America/Argentina/Buenos_Aires"),
+    catchup=False,
+)
+def backfill_gaps_dag(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, dry_run=False):
+
+    backfill_gaps(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, dry_run)
+
+@dag(
+    schedule=None,
+    start_date=pendulum.datetime(2022, 11, 1, 1, 0, 0, tz="America/Argentina/Buenos_Aires"),
+    catchup=False,
+)
+def pipelined_backfill_dag(database_string, database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
+
+    upgrade_tables_r = upgrade_tables(database_string)
+    load_pipelined_r = load_pipelined(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
+
+    upgrade_tables_r >> load_pipelined_r
 
 
 start_date = date(2019,1,1)
@@ -49,4 +87,7 @@ database_user = DATABASE_USER
 database_password = DATABASE_PASSWORD
 
 data_preparation_dag(database_string, database_type, database_name, database_host, database_user, database_password, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
-new_data_dag(database_string, database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket)
\ No newline at end of file
+new_data_dag(database_string, database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket)
+verify_ingestion_dag(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
+backfill_gaps_dag(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
+pipelined_backfill_dag(database_string, database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date)
@@ -1,31 +1,77 @@
 from airflow.decorators import task
 from docker.types import Mount
-from config import PROJECT_DIR, DEMAND_DOCKER_IMAGE
+from datetime import timedelta
+import pendulum
+from config import PROJECT_DIR, DEMAND_DOCKER_IMAGE, BACKFILL_POOL, BACKFILL_RETRIES, METRICS_ENABLED, STORAGE_CACHE_ENABLED, STORAGE_CACHE_MAX_BYTES, SERIES_STORE_ENABLED, PROFILING_ENABLED
+
+TASK_ENVIRONMENT = {}
+TASK_MOUNTS = []
+# Stage metrics of each task are written to PROJECT_DIR/metrics/<run_id>/<task>.json and .prom
+if METRICS_ENABLED:
+    TASK_ENVIRONMENT.update({
+        "METRICS_DIR": "/root/metrics",
+        "METRICS_RUN_ID": "{{ run_id }}",
+        "METRICS_TASK": "{{ ti.task_id }}.{{ ti.map_index }}",
+    })
+    TASK_MOUNTS.append(Mount(source=f"{PROJECT_DIR}/metrics", target="/root/metrics", type="bind"))
+# Files read from S3 are cached in PROJECT_DIR/storage_cache and shared by every task
+if STORAGE_CACHE_ENABLED:
+    TASK_ENVIRONMENT.update({
+        "STORAGE_CACHE_DIR": "/root/storage_cache",
+        "STORAGE_CACHE_MAX_BYTES": str(STORAGE_CACHE_MAX_BYTES),
+    })
+    TASK_MOUNTS.append(Mount(source=f"{PROJECT_DIR}/storage_cache", target="/root/storage_cache", type="bind"))
+# The hourly series of the demand table are kept in PROJECT_DIR/series_store and read by the machine learning tasks
+if SERIES_STORE_ENABLED:
+    TASK_ENVIRONMENT.update({
+        "SERIES_STORE_DIR": "/root/series_store",
+    })
+    TASK_MOUNTS.append(Mount(source=f"{PROJECT_DIR}/series_store", target="/root/series_store", type="bind"))
+# Each task is profiled with cProfile and tracemalloc to PROJECT_DIR/profiles/<logical date>/<task>.pstats, .txt and .allocations.json
+if PROFILING_ENABLED:
+    TASK_ENVIRONMENT.update({
+        "PROFILE_DIR": "/root/profiles",
+        "PROFILE_TASK": "{{ ti.task_id }}.{{ ti.map_index }}",
+        "PROFILE_DATE": "{{ ds }}",
+    })
+    TASK_MOUNTS.append(Mount(source=f"{PROJECT_DIR}/profiles", target="/root/profiles", type="bind"))
+
+@task
+def split_in_months(start_date, end_date):
+    """
+    Splits the [start_date, end_date) range in month-sized units. Each unit is a dict with
+    "start_date" and "end_date" as ISO strings so it can be used with expand_kwargs.
+    """
+    start_date = pendulum.parse(str(start_date)).date()
+    end_date = pendulum.parse(str(end_date)).date()
+    months = []
+    unit_start = start_date
+    while unit_start < end_date:
+        unit_end = min(unit_start.add(months=1).start_of("month"), end_date)
+        months.append({"start_date": unit_start.isoformat(), "end_date": unit_end.isoformat()})
+        unit_start = unit_end
+    return months
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
-    mounts=[
-        Mount(
-            source=f"{PROJECT_DIR}/versions",
-            target="/usr/local/lib/python3.8/site-packages/electrical_demand/migrations/versions",
-            type="bind",
-        ),
-    ],
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
 )
 def upgrade_tables(database_string):
-    from electrical_demand.dags_functions import run_migrations
+    from electrical_demand.pipeline.schema import run_migrations
     run_migrations(database_string)
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
     mounts=[
         Mount(source=f"{PROJECT_DIR}/data", target="/root/data", type="bind"),
-    ],
+    ] + TASK_MOUNTS,
 )
-def load_to_s3(general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
-    from electrical_demand.dags_functions import load_data_to_S3, load_raw_temp
+def load_reference_data_to_s3(general_bucket):
+    from electrical_demand.pipeline.raw_data import load_data_to_S3
     
     stations_file_path = "root/data/stations.csv"
     temp_forecast_stations_file_path = "root/data/temp_forecast_stations.csv"
@@ -35,63 +81,213 @@ def load_to_s3(general_bucket, temp_forecast_bucket, temp_historical_bucket, sta
     regions_dict_file_path = "root/data/regions.json"
 
     load_data_to_S3(general_bucket, stations_file_path, temp_forecast_stations_file_path, temp_historical_stations_file_path, historical_demand_file_path, holidays_file_path, regions_dict_file_path)
-    load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=start_date, end_date=end_date)
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+    pool=BACKFILL_POOL,
+    retries=BACKFILL_RETRIES,
+    retry_delay=timedelta(minutes=5),
+)
+def load_to_s3(general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
+    from datetime import date
+    from electrical_demand.pipeline.raw_data import load_raw_temp
+
+    load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=date.fromisoformat(start_date), end_date=date.fromisoformat(end_date))
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+    pool=BACKFILL_POOL,
+    retries=BACKFILL_RETRIES,
+    retry_delay=timedelta(minutes=5),
+)
+def compact_to_s3(buckets, current_date=None, start_date=None, end_date=None):
+    import pendulum
+    from electrical_demand.pipeline.raw_data import compact_raw_data
+
+    parse_date = lambda value: pendulum.parse(str(value)).date() if value else None
+    compact_raw_data(buckets, current_date=parse_date(current_date), start_date=parse_date(start_date), end_date=parse_date(end_date))
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+    pool=BACKFILL_POOL,
+    retries=BACKFILL_RETRIES,
+    retry_delay=timedelta(minutes=5),
 )
-def load_to_database(database_type, database_name, database_host, database_user, database_password, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
+def load_to_database(database_type, database_name, database_host, database_user, database_password, general_bucket, temp_forecast_bucket, temp_historical_bucket, first_date, start_date, end_date):
+    import pendulum
+    from datetime import date
     from electrical_demand.database.client import ComplexClient
     from electrical_demand.database.models import Demand
-    from electrical_demand.dags_functions import load_historical_demand_to_database, load_temp_to_database
+    from electrical_demand.pipeline.database import load_historical_demand_to_database, load_temp_to_database
     
     demand_table = Demand
     client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
+    start_date = date.fromisoformat(start_date)
+    end_date = date.fromisoformat(end_date)
+    # Only the first unit of the backfill has no placeholder row for its first datetime.
+    delete_first_datetime = start_date == pendulum.parse(str(first_date)).date()
 
-    load_historical_demand_to_database(client, demand_table, general_bucket, start_date, end_date)
-    load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=start_date, end_date=end_date, delete_first_datetime=True)
+    # Rows inserted, updated and unchanged by each load
+    return {
+        "historical_demand": load_historical_demand_to_database(client, demand_table, general_bucket, start_date, end_date),
+        "temperature": load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=start_date, end_date=end_date, delete_first_datetime=delete_first_datetime),
+    }
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
 )
-def run_machine_learning(database_type, database_name, database_host, database_user, database_password, general_bucket):
-    from electrical_demand.dags_functions import ml_process
+def get_regions(general_bucket):
+    from electrical_demand.process_data.getters import get_region_dicts
+
+    return [region_dict["region"] for region_dict in get_region_dicts(general_bucket)]
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+    retries=BACKFILL_RETRIES,
+    retry_delay=timedelta(minutes=5),
+)
+def run_machine_learning(database_type, database_name, database_host, database_user, database_password, region, run_id):
+    from electrical_demand.pipeline.ml import ml_process_region
+    from electrical_demand.config import SERIES_STORE_DIR
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Forecast
+    from electrical_demand.series_store import SeriesStore
+
+    client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
+    forecast_table = Forecast
+    store = SeriesStore(SERIES_STORE_DIR) if SERIES_STORE_DIR else None
+    # The database is queried until the store is built by refresh_series_store
+    if store is not None and not store.exists():
+        store = None
+
+    ml_process_region(client, forecast_table, region, run_id, store=store)
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+)
+def refresh_series_store(database_type, database_name, database_host, database_user, database_password):
+    from electrical_demand.series_store import refresh_series_store as refresh
     from electrical_demand.database.client import ComplexClient
-    from electrical_demand.database.models import Demand
 
     client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
-    demand_table = Demand
 
-    ml_process(client, general_bucket, demand_table)
+    # Days read from the database, None if the store is not enabled
+    return refresh(client)
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
 )
 def load_new_to_s3(general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, current_date):
-    from electrical_demand.dags_functions import load_raw_demand_to_s3, load_raw_temp
-    from electrical_demand.process_data.utils import get_new_data_date
+    from electrical_demand.pipeline.raw_data import load_raw_demand_to_s3, load_raw_temp
+    from electrical_demand.process_data.utils import get_new_data_dates
 
-    new_data_date = get_new_data_date(current_date)
-    load_raw_demand_to_s3(new_data_date, general_bucket, demand_bucket)
-    load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, date=new_data_date)
+    # The previous dates are downloaded again only if they had no data yet.
+    new_data_dates = get_new_data_dates(current_date)
+    for new_data_date in new_data_dates:
+        load_raw_demand_to_s3(new_data_date, general_bucket, demand_bucket)
+    load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=new_data_dates[0], end_date=new_data_dates[-1].add(days=1))
 
 @task.docker(
     image=DEMAND_DOCKER_IMAGE,
     mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
 )
 def load_new_to_database(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, current_date):
-    from electrical_demand.dags_functions import load_demand_to_database, load_temp_to_database
+    from electrical_demand.pipeline.database import load_demand_to_database, load_temp_to_database
     from electrical_demand.database.client import ComplexClient
     from electrical_demand.database.models import Demand
-    from electrical_demand.process_data.utils import get_new_data_date
+    from electrical_demand.process_data.utils import get_new_data_dates
 
     client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
     demand_table = Demand
-    new_data_date = get_new_data_date(current_date)
+    # The previous dates are loaded again only if they got new data.
+    new_data_dates = get_new_data_dates(current_date)
+
+    # Rows inserted, updated and unchanged by each load
+    return {
+        "demand": [load_demand_to_database(client, demand_table, demand_bucket, general_bucket, new_data_date) for new_data_date in new_data_dates],
+        "temperature": load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, start_date=new_data_dates[0], end_date=new_data_dates[-1].add(days=1)),
+    }
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+)
+def verify_ingestion(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, repair):
+    import pendulum
+    from electrical_demand.pipeline.verify import verify_ingestion as verify
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Demand
 
-    load_demand_to_database(client, demand_table, demand_bucket, general_bucket, new_data_date)
-    load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, date=new_data_date)
+    client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
+    demand_table = Demand
+    dataset_buckets = {
+        "temp_forecast": temp_forecast_bucket,
+        "temp_historical": temp_historical_bucket,
+        "demand": demand_bucket,
+        "historical_demand": general_bucket,
+    }
+
+    return verify(client, demand_table, general_bucket, dataset_buckets, pendulum.parse(str(start_date)).date(), pendulum.parse(str(end_date)).date(), repair=repair)
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+)
+def backfill_gaps(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, dry_run):
+    import pendulum
+    from electrical_demand.pipeline.coverage import backfill_gaps as backfill
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Demand
+
+    client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
+    demand_table = Demand
+
+    return backfill(client, demand_table, general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, pendulum.parse(str(start_date)).date(), pendulum.parse(str(end_date)).date(), dry_run=dry_run)
+
+@task.docker(
+    image=DEMAND_DOCKER_IMAGE,
+    mount_tmp_dir=False,
+    environment=TASK_ENVIRONMENT,
+    mounts=TASK_MOUNTS,
+    pool=BACKFILL_POOL,
+    retries=BACKFILL_RETRIES,
+    retry_delay=timedelta(minutes=5),
+)
+def load_pipelined(database_type, database_name, database_host, database_user, database_password, demand_bucket, general_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date):
+    import pendulum
+    from electrical_demand.pipeline.pipelined import pipelined_etl
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Demand
+
+    client = ComplexClient(database_type, database_name, database_host, database_user, database_password)
+    demand_table = Demand
 
+    # Dates and rows per dataset, wall time and utilization of every stage
+    return pipelined_etl(client, demand_table, general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, pendulum.parse(str(start_date)).date(), pendulum.parse(str(end_date)).date())
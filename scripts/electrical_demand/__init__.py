@@ -0,0 +1,6 @@
+from electrical_demand.config import PROFILE_DIR, PROFILE_TASK
+
+# The Airflow tasks are profiled from their first import of the package until they exit
+if PROFILE_DIR and PROFILE_TASK:
+    from electrical_demand.profiling import profile_process
+    profile_process()
@@ -5,17 +5,32 @@ appropriate keywords to get the data as a dataframe and load it to S3.
 """
 
 import requests
+import numpy as np
 import pandas as pd
 import json
 from datetime import datetime
-from electrical_demand.process_data.loaders import load_df_csv_to_s3
-from electrical_demand.logger import get_logger
+from electrical_demand.process_data.loaders import load_df_csv_to_s3, drop_compacted_month
+from electrical_demand.logger import get_logger, log_context
+from electrical_demand.instrumentation import span, text_nbytes, timed
+from electrical_demand.process_data.manifest import checksum, SourceChecksum
 
+# orjson is used when it is installed, it decodes the demand responses several times faster than json.
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 
+# BaseApi
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# SMNApi
+STREAM_DATAFRAME_ROWS = 20000
+
 # HistoricalSNMPApi
 FILTER_ROWS = [" ", "F"]
 HISTORICAL_STATIONS = ["CORDOBA AERO"]
+HISTORICAL_BATCH_SIZE = 1000
 
 # ForecastSMNApi
 POSITION_FIRST_STATION = 5
@@ -40,6 +55,30 @@ MONTHS_DICT = {
     "DIC": "Dec"
 }
 
+def iter_lines(chunks, source_checksum=None):
+    """
+    Yields the lines of a text received in chunks, as str.splitlines does with the whole text.
+    The last line of a chunk is kept until the next chunk, so a line or a "\\r\\n" split between
+    two chunks is yielded once.
+
+    Parameters
+    ----------
+    chunks : iterable of str
+        Chunks of the text.
+    source_checksum : SourceChecksum, optional
+        If given, every chunk is added to it.
+    """
+    pending = ""
+    for chunk in chunks:
+        if source_checksum is not None:
+            source_checksum.update(chunk)
+        lines = (pending + chunk).splitlines(keepends=True)
+        pending = lines.pop() if lines else ""
+        for line in lines:
+            yield line.splitlines()[0]
+    if pending:
+        yield pending.splitlines()[0]
+
 class BaseApi():
     """
     Abstract class used to call different APIs.
@@ -65,12 +104,16 @@ class BaseApi():
         Return the api url with the keywords provided.
     _download(*args, **kwargs)
         Return the text response of the api call
+    _download_chunks(*args, **kwargs)
+        Yields the text response of the api call in chunks while it is downloaded
     _process_data(*args, **kwargs)
         Process the data and return a list of dicts
     _to_df(*args, **kwargs)
         Process the list of dicts and return a Pandas dataframe
     etl(*args, **kwargs)
         Run the whole process and upload the data as a csv to S3
+    _save(dataframe, date)
+        Upload the dataframe of a date as a csv to S3
     _get_file_path(date, file_type)
         Returns the specific file path where the data is stored in the bucket
 
@@ -127,6 +170,7 @@ class BaseApi():
             Returns a specific postfix url for a given api call
         """
 
+    @timed(nbytes=text_nbytes)
     def _download(self, *args, **kwargs):
         """
         Call the api with the given arguments and returns the raw data as an string.
@@ -151,6 +195,35 @@ class BaseApi():
         except requests.exceptions.RequestException as e:
             self.logger.error(str(e))
 
+    def _download_chunks(self, *args, **kwargs):
+        """
+        Call the api with the given arguments and yields the raw data in chunks while it is downloaded.
+        The chunks are decoded with the encoding of the response, as requests does for the whole text.
+        Download errors are logged and raised.
+
+        Parameters
+        ----------
+        *args :
+            The args parameters are specific of each inherited class.
+            See the docstring of each for a detailed list of arguments.
+        **kwargs :
+            The kwargs parameters are specific of each inherited class.
+            See the docstring of each for a detailed list of arguments.
+
+        Yields
+        ------
+        chunk : string
+            Part of the response
+        """
+        try:
+            with requests.get(self._get_url(*args, **kwargs), stream=True) as response:
+                if response.encoding is None:
+                    response.encoding = "utf-8"
+                yield from response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE, decode_unicode=True)
+        except requests.exceptions.RequestException as e:
+            self.logger.error(str(e))
+            raise
+
     def _process_data(self, *args, **kwargs):
         """
         It receives the raw text data and returns as a list of dicts.
@@ -209,6 +282,23 @@ class BaseApi():
             Returns the processed data as pandas dataframe
         """
 
+    def _save(self, dataframe, date):
+        """
+        Loads the dataframe of a date as a csv to the S3 bucket. The compacted file of its month is
+        deleted, so the readers use the daily files until the month is compacted again.
+
+        Returns
+        -------
+        csv_path : string
+            Path of the csv file in the bucket, None if the dataframe is empty and nothing was written.
+        """
+        if dataframe.empty:
+            return None
+        csv_path = self._get_file_path(date, "csv")
+        load_df_csv_to_s3(dataframe, self.bucket, csv_path, index=True)
+        drop_compacted_month(self.bucket, date)
+        return csv_path
+
     def _get_file_path(self, date, file_type):
         """
         Gets the specific file path where the data is stored in the bucket.
@@ -255,6 +345,7 @@ class DemandByDateByRegionApi(CammesaApi):
         url_postfix = "ObtieneDemandaYTemperaturaRegionByFecha?fecha=%4d-%02d-%02d&id_region=%s" % (demand_date.year, demand_date.month, demand_date.day, region_id)
         return url_postfix
 
+    @timed(rows=len)
     def _process_data(self, text_data):
         """
         It receives the raw text data and returns as a list of dicts.
@@ -269,39 +360,79 @@ class DemandByDateByRegionApi(CammesaApi):
         dict_data : list of dicts
             Returns the processed data as a list of dicts
         """
-        dict_data = json.loads(text_data)
+        dict_data = json_loads(text_data)
         return dict_data
 
-    def _to_df(self, dict_data, region_name):
+    @timed(rows=len)
+    def _to_df(self, dict_data_by_region):
         """
-        It receives the data as a list of dicts and returns a Pandas dataframe.
-        The 'temp' field is droped.
+        It receives the data of every api id as lists of dicts and returns one Pandas dataframe
+        with the hourly rows of all of them. The fields are read into flat arrays and the
+        timestamps of the whole batch are parsed at once. The 'temp' field is droped.
 
         Parameters
         ----------
-        *args :
-            The args parameters are specific of each inherited class.
-            See the docstring of each for a detailed list of arguments.
-        **kwargs :
-            The kwargs parameters are specific of each inherited class.
-            See the docstring of each for a detailed list of arguments.
+        dict_data_by_region : list of tuples
+            (region name, list of dicts) of every api id.
 
         Returns
         -------
         dataframe : Pandas dataframe
-            Returns the processed data as pandas dataframe
+            Returns the demand and the region indexed by datetime
         """
-        dataframe = pd.DataFrame(dict_data)
-        dataframe["fecha"] = pd.to_datetime(dataframe["fecha"])
-        dataframe = dataframe[dataframe["fecha"].dt.minute == 0]
-        dataframe["fecha"] = dataframe["fecha"].dt.tz_localize(None)
-        dataframe.drop(columns=["temp"], inplace=True, errors="ignore")
-        dataframe.rename(columns={"fecha": "datetime", "dem": "demand"}, inplace=True)
-        dataframe.set_index("datetime", inplace=True)
-        dataframe["region"] = region_name
+        region_names = sorted({region_name for region_name, _ in dict_data_by_region})
+        region_codes = {region_name: code for code, region_name in enumerate(region_names)}
+        codes = np.repeat(
+            np.array([region_codes[region_name] for region_name, _ in dict_data_by_region], dtype=np.intp),
+            [len(dict_data) for _, dict_data in dict_data_by_region],
+        )
+        fechas = [item["fecha"] for _, dict_data in dict_data_by_region for item in dict_data]
+        # Same dtype as a dataframe of the dicts: int64, or float64 if a demand is missing
+        demand = pd.Series([item.get("dem") for _, dict_data in dict_data_by_region for item in dict_data]).to_numpy()
+        datetimes = pd.DatetimeIndex(pd.to_datetime(fechas))
+        if datetimes.tz is not None:
+            datetimes = datetimes.tz_localize(None)
+        hourly = datetimes.minute == 0
+        dataframe = pd.DataFrame(
+            {"demand": demand[hourly], "region": np.array(region_names, dtype=object)[codes[hourly]]},
+            index=pd.DatetimeIndex(datetimes[hourly], name="datetime"),
+        )
         return dataframe
-    
-    def etl(self, demand_date, region_dicts, save=True):
+
+    def _download_regions(self, demand_date, region_dicts):
+        """
+        Downloads the data of every api id of every region.
+
+        Returns
+        -------
+        text_data_by_region : list of tuples
+            (region name, raw text data) of every api id.
+        """
+        text_data_by_region = []
+        for region_dict in region_dicts:
+            with log_context(date=demand_date, region=region_dict["region"], stage="demand_etl"):
+                for region_id in region_dict["api_ids"]:
+                    text_data_by_region.append((region_dict["region"], self._download(demand_date, region_id)))
+        return text_data_by_region
+
+    def _transform(self, text_data_by_region, demand_date):
+        """
+        Processes the data downloaded by _download_regions.
+
+        Returns
+        -------
+        dataframe : Pandas series
+            Demand indexed by datetime and region, the demand of the api ids of a region is summed.
+        """
+        dict_data_by_region = []
+        for region_name, text_data in text_data_by_region:
+            with log_context(date=demand_date, region=region_name, stage="demand_etl"):
+                dict_data_by_region.append((region_name, self._process_data(text_data)))
+        with log_context(date=demand_date, stage="demand_etl"):
+            dataframe = self._to_df(dict_data_by_region)
+        return dataframe.groupby(by=["datetime", "region"])["demand"].sum()
+
+    def etl(self, demand_date, region_dicts, save=True, manifest=None):
         """
         Calls the _download, _process_data and _to_df methods. It is the only one method exposed.
         It loads the pandas dataframe as a csv to the S3 bucket.
@@ -314,46 +445,157 @@ class DemandByDateByRegionApi(CammesaApi):
             list of dicts with all regions and corresponding region ids
         save : boolean
             if True the dataframe is save in the bucket as a csv
+        manifest : IngestionManifest, optional
+            If given, the data is only processed when it changed since it was recorded and
+            the manifest is updated.
         Returns
         -------
         dataframe : Pandas dataframe
-            Returns the processed data as pandas dataframe
+            Returns the processed data as pandas dataframe, None if the manifest shows the data did not change
         """
-        list_df = []
-        for region_dict in region_dicts:
-            for region_id in region_dict["api_ids"]:
-                text_data = self._download(demand_date, region_id)
-                dict_data = self._process_data(text_data)
-                list_df.append(self._to_df(dict_data, region_dict["region"]))
-        dataframe = pd.concat(list_df)
-        dataframe = dataframe.groupby(by=["datetime", "region"])["demand"].sum()
-        if save and not dataframe.empty:
-            csv_path = self._get_file_path(demand_date, "csv")
-            load_df_csv_to_s3(dataframe, self.bucket, csv_path, index=True)
+        text_data_by_region = self._download_regions(demand_date, region_dicts)
+        texts = [text_data for _, text_data in text_data_by_region]
+        if manifest is not None and not manifest.source_changed(demand_date, checksum(texts)):
+            return None
+        dataframe = self._transform(text_data_by_region, demand_date)
+        csv_path = self._save(dataframe, demand_date) if save else None
+        if manifest is not None:
+            manifest.record_object(demand_date, checksum(texts), len(dataframe), self.bucket, csv_path)
         return dataframe
 
 class SMNApi(BaseApi):
-    def __init__(self, bucket, stations_df):
+    """
+    Abstract class of the SMN temperature files.
+    The names of the stations in the files are mapped to the columns of stations_df with
+    station_index, a dict built once, and the parsers skip the stations that are not in the
+    allow-list before their datetime and temperature are decoded.
+    ...
+
+    Attributes
+    ----------
+    station_index : dict
+        Columns of stations_df of every station of the file, {station_raw: {"station": ..., "region": ...}}.
+    allowed_stations : set of str or None
+        Names in the file of the stations that are processed, None to process all of them.
+    """
+    def __init__(self, bucket, stations_df, stations=None):
+        """
+        Parameters
+        ----------
+        bucket : string
+            S3 bucket where the data is loaded.
+        stations_df : Pandas dataframe
+            Stations of the file, with the station_raw column (name in the file) and the station column.
+        stations : list of str, optional
+            Allow-list of station names. If given, the other stations of the file are skipped.
+        """
         super().__init__(bucket)
         self.stations_df = stations_df
+        self.station_index = {}
+        self._unknown_station = {"station": "ERROR"}
+        if stations_df is not None:
+            self.station_index = stations_df.set_index("station_raw").to_dict("index")
+            self._unknown_station = {column: None for column in stations_df.columns if column != "station_raw"}
+            self._unknown_station["station"] = "ERROR"
+        self.allowed_stations = None
+        if stations is not None:
+            stations = set(stations)
+            self.allowed_stations = {station_raw for station_raw, columns in self.station_index.items() if columns["station"] in stations}
         self.url_prefix = "https://ssl.smn.gob.ar/dpd/descarga_opendata.php?file="
-   
+
+    def _is_allowed(self, station_raw):
+        return self.allowed_stations is None or station_raw in self.allowed_stations
+
+    def _station_columns(self, station_raw):
+        """Returns the columns of stations_df of the station, with station "ERROR" if it is unknown."""
+        return self.station_index.get(station_raw, self._unknown_station)
+
+    def _iter_batches(self, lines, temp_date):
+        """
+        It receives the lines of the raw text data and yields the records as lists of dicts.
+        The lines can be a generator, so the data is processed while it is downloaded.
+
+        Parameters
+        ----------
+        lines : iterable of str
+            Lines of the raw text data.
+        temp_date : datetime.date
+            Date of the file.
+
+        Yields
+        ------
+        batch : list of dicts
+            Records of a part of the file.
+        """
+
+    @timed(rows=len)
+    def _process_data(self, text_file, temp_date):
+        return [record for batch in self._iter_batches(text_file.splitlines(), temp_date) for record in batch]
+
+    @timed(rows=len)
     def _to_df(self, dict_data):
         dataframe = pd.DataFrame(dict_data)
         if not dataframe.empty:
-            dataframe = dataframe.merge(self.stations_df, how="left", on="station_raw")
-            dataframe.drop(columns=["station_raw"], inplace=True)
-            dataframe.fillna(value={"station": "ERROR"}, inplace=True)
             dataframe.set_index("datetime", inplace=True)
         return dataframe
 
-    def etl(self, temp_date, save=True):
-        text_data = self._download(temp_date)
-        dict_data = self._process_data(text_data, temp_date)
-        dataframe = self._to_df(dict_data)
-        if save and not dataframe.empty:
-            csv_path = self._get_file_path(temp_date, "csv")
-            load_df_csv_to_s3(dataframe, self.bucket, csv_path, index=True)
+    def _transform(self, text_data, temp_date):
+        """Processes the raw text data of the file of temp_date and returns it as a Pandas dataframe."""
+        return self._to_df(self._process_data(text_data, temp_date))
+
+    def _stream(self, temp_date):
+        """
+        Downloads the file of temp_date and processes every batch of records while the rest of
+        the file is downloaded. The raw text is never kept in memory and the records are converted
+        to dataframes every STREAM_DATAFRAME_ROWS records.
+
+        Returns
+        -------
+        dataframe : Pandas dataframe
+            Processed data.
+        source_checksum : str
+            Checksum of the raw text data.
+        """
+        source_checksum = SourceChecksum()
+        with span(f"{self.__class__.__name__}._stream") as stage:
+            lines = iter_lines(self._download_chunks(temp_date), source_checksum)
+            list_df = []
+            records = []
+            for batch in self._iter_batches(lines, temp_date):
+                records.extend(batch)
+                if len(records) >= STREAM_DATAFRAME_ROWS:
+                    list_df.append(self._to_df(records))
+                    records = []
+            if records or not list_df:
+                list_df.append(self._to_df(records))
+            # The parser stops at the first error, the rest of the file is still part of the checksum.
+            for _ in lines:
+                pass
+            dataframe = pd.concat(list_df) if len(list_df) > 1 else list_df[0]
+            stage.add(rows=len(dataframe))
+        return dataframe, source_checksum.hexdigest()
+
+    def etl(self, temp_date, save=True, manifest=None, stream=True):
+        """
+        Downloads and processes the file of temp_date and loads it as a csv to the S3 bucket.
+        If manifest is given, the file is only loaded when it changed since it was recorded
+        (None is returned otherwise) and the manifest is updated.
+        With stream the file is processed while it is downloaded.
+        """
+        with log_context(date=temp_date, stage=self.__class__.__name__):
+            dataframe = None
+            if stream:
+                dataframe, source_checksum = self._stream(temp_date)
+            else:
+                text_data = self._download(temp_date)
+                source_checksum = checksum(text_data)
+            if manifest is not None and not manifest.source_changed(temp_date, source_checksum):
+                return None
+            if dataframe is None:
+                dataframe = self._transform(text_data, temp_date)
+            csv_path = self._save(dataframe, temp_date) if save else None
+            if manifest is not None:
+                manifest.record_object(temp_date, source_checksum, len(dataframe), self.bucket, csv_path)
         return dataframe
     
 
@@ -362,39 +604,48 @@ class ForecastSMNApi(SMNApi):
     def _get_url_postfix(self, temp_date):
         return "pron5d/pron%4d%02d%02d.txt" % (temp_date.year, temp_date.month, temp_date.day,)
 
-    def _process_data(self, text_file, temp_date):
-        for i, _ in enumerate(text_file.splitlines()):
-            pass
-        station_positions = range(POSITION_FIRST_STATION, i+1, HEADER_LINES + TOTAL_DATA_POINTS + LOWER_LINES + 1)
-        data_positions = []
-        for j in station_positions:
-            data_positions = data_positions + list(range(j+HEADER_LINES+1, j+TOTAL_DATA_POINTS+POSITION_FIRST_STATION))
-        temp_forecast = [] #{"station_name": {"datetime": temperature}}
+    def _iter_batches(self, lines, temp_date):
+        """
+        The file has a block of LINES_BETWEEN_STATIONS lines per station, so the position of every
+        line in its block tells if it is the station name or a data point. Each batch has the data
+        points of one station. The blocks of the stations that are not allowed are skipped.
+        """
+        batch = []
         current_station = None
-        current_datetime = None
-        current_temperature = None
-        current_dict = {}
-        try:
-            for i, line in enumerate(text_file.splitlines()):
+        skip_station = False
+        for i, line in enumerate(lines):
+            try:
                 if line.strip() == "FORECAST NOT AVAILABLE":
                     self.logger.error(f"forecast - file_date: {temp_date} - FORECAST NOT AVAILABLE")
                     break
-                if i in station_positions:
-                    current_station = line.rstrip()
-                current_dict["station_raw"] = current_station
-                if i in data_positions:
+                if i < POSITION_FIRST_STATION:
+                    continue
+                position = (i - POSITION_FIRST_STATION) % LINES_BETWEEN_STATIONS
+                if position == 0:
+                    if batch:
+                        yield batch
+                        batch = []
+                    station_raw = line.rstrip()
+                    skip_station = not self._is_allowed(station_raw)
+                    current_station = self._station_columns(station_raw)
+                elif skip_station:
+                    continue
+                elif HEADER_LINES < position < TOTAL_DATA_POINTS + POSITION_FIRST_STATION:
                     current_datetime = line[1:15]
                     current_datetime = current_datetime[:3] + MONTHS_DICT[current_datetime[3:6]] + current_datetime[6:]
                     current_datetime = datetime.strptime(current_datetime, "%d/%b/%Y %H")
                     current_temperature = line[26:30].lstrip()
-                    current_dict["datetime"] = str(current_datetime)
-                    current_dict["temperature_forecast"] = current_temperature
-                    current_dict["file_date"] = str(temp_date)
-                    temp_forecast.append(current_dict)
-                    current_dict = {}
-        except Exception as e:
-            self.logger.error(str(e))
-        return temp_forecast
+                    batch.append({
+                        "datetime": str(current_datetime),
+                        "temperature_forecast": current_temperature,
+                        "file_date": str(temp_date),
+                        **current_station,
+                    })
+            except Exception as e:
+                self.logger.error(str(e))
+                break
+        if batch:
+            yield batch
 
 
 class HistoricalSNMPApi(SMNApi):
@@ -402,24 +653,35 @@ class HistoricalSNMPApi(SMNApi):
     def _get_url_postfix(self, temp_date):
         return "observaciones/datohorario%4d%02d%02d.txt" % (temp_date.year, temp_date.month, temp_date.day,)
   
-    def _process_data(self, text_file, temp_date):
-        temp_historical = [] #[{"station": "", "datetime": "", "temperature: ""}]
-        try:
-            for i, line in enumerate(text_file.splitlines()):
-                current_dict = {}
+    def _iter_batches(self, lines, temp_date):
+        """
+        Each batch has up to HISTORICAL_BATCH_SIZE records. The lines of the stations that are not
+        allowed are skipped.
+        """
+        batch = []
+        for line in lines:
+            try:
                 if line[0] in FILTER_ROWS:
                     continue
                 current_station = line[48:].rstrip()
+                if not self._is_allowed(current_station):
+                    continue
                 current_datetime = line[:8] + " " + line[12:14]
                 current_datetime = datetime.strptime(current_datetime, "%d%m%Y %H")
                 if current_datetime.date() != temp_date:
                     self.logger.error(f"historical - file_date: {temp_date} - station: {current_station} - current_datetime: {current_datetime}")
                 current_temperature = line[15:20].strip()
-                current_dict["station_raw"] = current_station
-                current_dict["datetime"] = str(current_datetime)
-                current_dict["temperature"] = current_temperature
-                current_dict["file_date"] = str(temp_date)
-                temp_historical.append(current_dict)
-        except Exception as e:
-            self.logger.error(str(e))
-        return temp_historical
\ No newline at end of file
+                batch.append({
+                    "datetime": str(current_datetime),
+                    "temperature": current_temperature,
+                    "file_date": str(temp_date),
+                    **self._station_columns(current_station),
+                })
+            except Exception as e:
+                self.logger.error(str(e))
+                break
+            if len(batch) == HISTORICAL_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
\ No newline at end of file
@@ -0,0 +1,36 @@
+from decouple import AutoConfig
+
+dconfig = AutoConfig()
+
+METRICS_DIR = dconfig("METRICS_DIR", default="")
+METRICS_RUN_ID = dconfig("METRICS_RUN_ID", default="manual")
+METRICS_TASK = dconfig("METRICS_TASK", default="task")
+
+STORAGE_BACKEND = dconfig("STORAGE_BACKEND", default="s3")
+STORAGE_ROOT = dconfig("STORAGE_ROOT", default="")
+STORAGE_CACHE_DIR = dconfig("STORAGE_CACHE_DIR", default="")
+STORAGE_CACHE_MAX_BYTES = dconfig("STORAGE_CACHE_MAX_BYTES", default=2 * 1024**3, cast=int)
+# Concurrent uploads of Storage.upload_files and part size of the S3 multipart uploads
+STORAGE_UPLOAD_WORKERS = dconfig("STORAGE_UPLOAD_WORKERS", default=8, cast=int)
+STORAGE_MULTIPART_CHUNK_BYTES = dconfig("STORAGE_MULTIPART_CHUNK_BYTES", default=50 * 1024**2, cast=int)
+# Pipelined ETL: items waiting between two stages and concurrent downloads
+PIPELINE_QUEUE_SIZE = dconfig("PIPELINE_QUEUE_SIZE", default=4, cast=int)
+PIPELINE_DOWNLOAD_WORKERS = dconfig("PIPELINE_DOWNLOAD_WORKERS", default=4, cast=int)
+# Chunked load of the historical demand: days per chunk (0 for calendar months), rows per
+# transaction and resident memory in MiB above which the transactions are made smaller (0 for no limit)
+HISTORICAL_LOAD_CHUNK_DAYS = dconfig("HISTORICAL_LOAD_CHUNK_DAYS", default=0, cast=int)
+HISTORICAL_LOAD_BATCH_ROWS = dconfig("HISTORICAL_LOAD_BATCH_ROWS", default=50000, cast=int)
+HISTORICAL_LOAD_MAX_RSS_MB = dconfig("HISTORICAL_LOAD_MAX_RSS_MB", default=0, cast=int)
+# Memory-mapped series of the demand table, disabled if empty, and last days read again by every refresh
+SERIES_STORE_DIR = dconfig("SERIES_STORE_DIR", default="")
+SERIES_STORE_REFRESH_DAYS = dconfig("SERIES_STORE_REFRESH_DAYS", default=7, cast=int)
+# Profiling with cProfile and tracemalloc, disabled if PROFILE_DIR is empty: task and logical date
+# of the profile of the whole process, fraction of the /get-region requests of the api profiled
+# and lines reported in the top allocations
+PROFILE_DIR = dconfig("PROFILE_DIR", default="")
+PROFILE_TASK = dconfig("PROFILE_TASK", default="")
+PROFILE_DATE = dconfig("PROFILE_DATE", default="manual")
+PROFILE_API_SAMPLE_RATE = dconfig("PROFILE_API_SAMPLE_RATE", default=0.0, cast=float)
+PROFILE_TOP_ALLOCATIONS = dconfig("PROFILE_TOP_ALLOCATIONS", default=25, cast=int)
+# Days after a date during which the date is downloaded again if it had no data
+MANIFEST_EMPTY_RETRY_DAYS = dconfig("MANIFEST_EMPTY_RETRY_DAYS", default=3, cast=int)
@@ -3,4 +3,6 @@ from decouple import AutoConfig
 dconfig = AutoConfig()
 
 DATABASE_API_PORT = dconfig("DATABASE_API_PORT")
-DATABASE_API_CONTAINER_NAME = dconfig("DATABASE_API_CONTAINER_NAME")
\ No newline at end of file
+DATABASE_API_CONTAINER_NAME = dconfig("DATABASE_API_CONTAINER_NAME")
+DASHBOARD_CHART_WIDTH = dconfig("DASHBOARD_CHART_WIDTH", default=800, cast=int)
+RANGE_METHOD = dconfig("RANGE_METHOD", default="lttb")
\ No newline at end of file
@@ -1,8 +1,8 @@
 import streamlit as st
-from electrical_demand.dashboard.utils import get_data, line_plot
+from electrical_demand.dashboard.utils import get_data, line_plot, get_range_data, range_plot
 from electrical_demand.process_data.utils import daterange
 from datetime import date, timedelta
-from electrical_demand.dashboard.config import DATABASE_API_CONTAINER_NAME, DATABASE_API_PORT
+from electrical_demand.dashboard.config import DATABASE_API_CONTAINER_NAME, DATABASE_API_PORT, DASHBOARD_CHART_WIDTH, RANGE_METHOD
 
 start_date = date(2019,1,1)
 end_date = date(2022,12,31)
@@ -24,13 +24,29 @@ def main():
 
     yesterday = date.today() - timedelta(days = 1)
 
-    option = st.date_input(
-        "Date",
-        yesterday)
+    view = st.sidebar.radio("View", ("Day", "Range"))
 
-    data = get_data(api_url, data_to_show, option)
+    if view == "Day":
+        option = st.date_input(
+            "Date",
+            yesterday)
 
-    line_plot(data, "Electrical demand")
+        data = get_data(api_url, data_to_show, option)
+
+        line_plot(data, "Electrical demand")
+    else:
+        selected = st.date_input(
+            "Dates",
+            (yesterday - timedelta(days=90), yesterday),
+            min_value=start_date,
+            max_value=end_date)
+        # The range is not complete while the user is choosing the second date.
+        if len(selected) < 2:
+            return
+
+        data = get_range_data(api_url, data_to_show, selected[0], selected[1], DASHBOARD_CHART_WIDTH, RANGE_METHOD)
+
+        range_plot(data, "Electrical demand", DASHBOARD_CHART_WIDTH)
 
 if __name__ == "__main__":
 
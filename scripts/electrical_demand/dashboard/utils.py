@@ -11,6 +11,17 @@ def get_data(api_url, region, day):
     logger.info("get data: " + str(data))
     return data
 
+def get_range_data(api_url, region, start, end, width, method="lttb"):
+    """
+    Gets the demand from start to end downsampled by the database api to the chart width: one
+    point per pixel with lttb or the minimum and maximum of every two pixels with minmax.
+    """
+    logger.info(f"region: {region}; start: {start}; end: {end}; width: {width}")
+    response = requests.get(api_url + f"/get-range/{region}/{start}/{end}", params={"points": width, "method": method}).json()
+    data = pd.read_json(response["data"], convert_dates=["datetime"])
+    logger.info("get range data: " + str(len(data)) + " points")
+    return data
+
 def line_plot(data, title):
     logger.info("data raw: " + str(data))
     data = data.rename(columns={"demand": "demand_real"})
@@ -23,3 +34,13 @@ def line_plot(data, title):
     ).properties(title=title)
     st.altair_chart(chart, use_container_width=True)
     return 0
+
+def range_plot(data, title, width):
+    data = data.replace({"series": {"demand": "demand_real"}}).rename(columns={"series": "demand_type", "value": "MW"})
+    chart = alt.Chart(data).mark_line().encode(
+        x=alt.X('datetime:T'),
+        y=alt.Y('MW:Q'),
+        color=alt.Color("demand_type:N")
+    ).properties(title=title, width=width)
+    st.altair_chart(chart, use_container_width=False)
+    return 0
\ No newline at end of file
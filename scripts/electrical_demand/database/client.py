@@ -47,7 +47,7 @@ class SqlClient():
         """
         Parameters
         ----------
-        dialect : {"sqlite", "postgresql"}
+        dialect : {"sqlite", "postgresql", "duckdb"}
             Database dialect.
         database_name : str
             Database name.
@@ -118,4 +118,123 @@ class SqLiteClient(SqlClient):
         db_uri = f"{self.dialect}:///{self.database_name}"
         if not self._engine:
             self._engine = create_engine(db_uri)
-        return self._engine
\ No newline at end of file
+        return self._engine
+
+
+class DuckDbClient(SqlClient):
+    """Client of an embedded DuckDB file, for local machine learning and backtests. It needs duckdb_engine."""
+
+    def _get_engine(self):
+        db_uri = f"{self.dialect}:///{self.database_name}"
+        if not self._engine:
+            self._engine = create_engine(db_uri)
+        return self._engine
+
+
+class AsyncSqlClient(SqlClient):
+    """
+    Abstract class used as an asyncio client of a database, for the database api.
+    The engine has a bounded connection pool: at most pool_size + max_overflow connections are
+    opened and a query waits up to pool_timeout seconds for a free connection.
+    ...
+
+    Attributes
+    ----------
+    pool_size : int
+        Connections kept open.
+    max_overflow : int
+        Connections opened over pool_size when every connection is in use.
+    pool_timeout : float
+        Seconds to wait for a connection of the pool.
+    statement_timeout : float or None
+        Seconds after which the database cancels a query (only PostgreSQL).
+    ...
+    Methods
+    -------
+    get_dataframe(query)
+        Return a table as a Pandas dataframe. It is a coroutine.
+    dispose()
+        Closes the connections of the pool. It is a coroutine.
+    """
+
+    ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+    def __init__(
+        self, dialect, database_name, host=None, user=None, password=None, driver=None,
+        pool_size=5, max_overflow=5, pool_timeout=5, statement_timeout=None,
+    ):
+        super().__init__(dialect, database_name, host, user, password, driver or self.ASYNC_DRIVERS.get(dialect))
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.statement_timeout = statement_timeout
+
+    def _engine_options(self):
+        """Keywords of create_async_engine with the pool configuration."""
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+        options = {
+            "poolclass": AsyncAdaptedQueuePool,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_pre_ping": True,
+        }
+        if self.statement_timeout and self.driver == "asyncpg":
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(int(self.statement_timeout * 1000))}}
+        return options
+
+    def get_session(self):
+        raise NotImplementedError("AsyncSqlClient only supports get_dataframe")
+
+    async def get_dataframe(self, query, index_col=None, parse_dates=None):
+        """
+        Parameters
+        ----------
+        query : SQLAlchemy selectable or str
+            Query to send to the database.
+
+        Returns
+        -------
+        df : Pandas dataframe
+            Result of the query as a Pandas dataframe
+        """
+        from sqlalchemy import text
+
+        if not self._engine:
+            self._engine = self._get_engine()
+        if isinstance(query, str):
+            query = text(query)
+        async with self._engine.connect() as connection:
+            result = await connection.execute(query)
+            dataframe = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        for column in parse_dates or []:
+            dataframe[column] = pd.to_datetime(dataframe[column])
+        if index_col is not None:
+            dataframe.set_index(index_col, inplace=True)
+        return dataframe
+
+    async def dispose(self):
+        if self._engine:
+            await self._engine.dispose()
+            self._engine = None
+
+
+class AsyncComplexClient(AsyncSqlClient):
+    def _get_engine(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        db_uri = f"{self.dialect}+{self.driver}://{self.user}:{self.password}@{self.host}/{self.database_name}"
+        if not self._engine:
+            self._engine = create_async_engine(db_uri, **self._engine_options())
+        return self._engine
+
+
+class AsyncSqLiteClient(AsyncSqlClient):
+    def _get_engine(self):
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        db_uri = f"{self.dialect}+{self.driver}:///{self.database_name}"
+        if not self._engine:
+            self._engine = create_async_engine(db_uri, **self._engine_options())
+        return self._engine
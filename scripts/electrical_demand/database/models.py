@@ -6,17 +6,92 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    Date,
     DateTime,
     Float,
     Identity,
+    Index,
     UniqueConstraint,
 )
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn, DDL
+from sqlalchemy import event, select, delete, func, and_, or_, literal_column, cast, extract, text
+from contextlib import contextmanager
+from datetime import timedelta
 
 Base = declarative_base()
 
+# Dialects with a bulk upsert. DuckDB (duckdb_engine) compiles the statements like PostgreSQL.
+UPSERT_DIALECTS = ("postgresql", "sqlite", "duckdb")
+
+
+def dialect_name(session):
+    name = session.get_bind().dialect.name
+    if name not in UPSERT_DIALECTS:
+        raise NotImplementedError(f"There is no upsert for the {name} dialect")
+    return name
+
+def insert(session, table):
+    """Returns the INSERT ... ON CONFLICT construct of the dialect of the session."""
+    if dialect_name(session) == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+def sql_value(value):
+    """Returns the value as read back from the database, NaN is stored as NULL."""
+    return None if isinstance(value, float) and value != value else value
+
+@contextmanager
+def duckdb_rows(session, name, rows):
+    """Registers a list of dicts as a DuckDB view of the connection of the session, so it can be read with SQL without binding parameters."""
+    import pandas as pd
+
+    connection = session.connection()
+    connection.connection.register(name, pd.DataFrame(rows, columns=list(rows[0].keys())))
+    try:
+        yield connection
+    finally:
+        connection.connection.unregister(name)
+
+def duckdb_upsert(table, source, columns, keys, update_columns, only_changed=False, increment_columns=()):
+    """
+    Returns an INSERT ... SELECT ... ON CONFLICT statement that upserts the rows of source into table.
+    The value of the increment_columns of a row is added to the row already in table, and with
+    only_changed a row is also updated when it has an increment.
+    """
+    if update_columns or increment_columns:
+        conflict = "DO UPDATE SET " + ", ".join(
+            [f"{column} = excluded.{column}" for column in update_columns]
+            + [f"{column} = {table}.{column} + excluded.{column}" for column in increment_columns]
+        )
+        if only_changed:
+            conflict += " WHERE " + " OR ".join(
+                [f"{table}.{column} IS DISTINCT FROM excluded.{column}" for column in update_columns]
+                + [f"excluded.{column} <> 0" for column in increment_columns]
+            )
+    else:
+        conflict = "DO NOTHING"
+    return (
+        f"INSERT INTO {table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {source} "
+        f"ON CONFLICT ({', '.join(keys)}) {conflict}"
+    )
+
+@compiles(Float, "duckdb")
+def _duckdb_float(element, compiler, **kw):
+    """FLOAT is a 4 byte REAL in DuckDB and a double in PostgreSQL."""
+    return "DOUBLE"
+
+@compiles(CreateColumn, "duckdb")
+def _duckdb_identity_column(element, compiler, **kw):
+    """DuckDB has no identity columns, they take the next value of a sequence instead."""
+    column = element.element
+    if column.identity is None:
+        return compiler.visit_create_column(element, **kw)
+    return f"{column.name} {compiler.type_compiler.process(column.type)} DEFAULT nextval('{column.table.name}_{column.name}_seq')"
+
+
 class Demand(Base):
     """Demand data model."""
 
@@ -25,18 +100,21 @@ class Demand(Base):
     datetime = Column(DateTime, nullable=False)
     region = Column(String, nullable=False)
     demand = Column(Integer)
-    demand_forecast = Column(Integer)
     day_type = Column(String)
     temperature = Column(Float)
     temperature_forecast = Column(Float)
     __table_args__ = (
         UniqueConstraint(datetime, region, name="one_value_per_datetime_per_region"),
     )
+    KEYS = ("datetime", "region")
 
     @staticmethod
     def insert(session, demand):
         """
         Insert or update demand rows in the database.
+        Existing rows are only updated when at least one of the given values is different,
+        so loading the same data again does not rewrite any row. The coverage of the days and
+        regions with inserted or updated rows is refreshed in the same session.
 
         Parameters
         ----------
@@ -44,15 +122,117 @@ class Demand(Base):
             Session in which the insert or update is committed.
         demand : list of dicts
             Demand to insert or update in the database as a list of dicts. All dicts must have the same keys.
+
+        Returns
+        -------
+        counts : dict
+            Number of rows "inserted", "updated" and "unchanged".
         """
-        stmt = insert(Demand).values(demand)
-        keys = demand[0].keys()
-        update_dict = {c.name: c for c in stmt.excluded if c.name in keys}
-        update_stmt = stmt.on_conflict_do_update(
-            constraint="one_value_per_datetime_per_region",
-            set_=update_dict,
+        keys = [key for key in demand[0].keys() if key not in Demand.KEYS]
+        counts, changed = {
+            "postgresql": Demand._upsert_postgresql,
+            "sqlite": Demand._upsert_sqlite,
+            "duckdb": Demand._upsert_duckdb,
+        }[dialect_name(session)](session, demand, keys)
+        # The masks of the days without changed rows are the same
+        cells = {(datetime_.date(), region) for datetime_, region in changed}
+        if cells:
+            days = [day for day, _ in cells]
+            Coverage.refresh(session, min(days), max(days) + timedelta(days=1), {region for _, region in cells}, changed=cells)
+        return counts
+
+    @staticmethod
+    def _changed(table, excluded, keys):
+        return or_(*[table.c[key].is_distinct_from(excluded[key]) for key in keys])
+
+    @staticmethod
+    def _upsert_postgresql(session, demand, keys):
+        """
+        One multi-row upsert. RETURNING gives the changed rows (inserted or updated) and tells the
+        inserted rows from the updated ones.
+        """
+        stmt = postgresql.insert(Demand).values(demand)
+        if keys:
+            update_stmt = stmt.on_conflict_do_update(
+                constraint="one_value_per_datetime_per_region",
+                set_={key: stmt.excluded[key] for key in keys},
+                where=Demand._changed(Demand.__table__, stmt.excluded, keys),
+            )
+        else:
+            update_stmt = stmt.on_conflict_do_nothing(constraint="one_value_per_datetime_per_region")
+        # xmax is 0 for the rows inserted by the statement. The rows skipped by the where clause are not returned.
+        returned = session.execute(update_stmt.returning(Demand.datetime, Demand.region, literal_column("xmax = 0").label("inserted"))).all()
+        inserted = sum(row.inserted for row in returned)
+        return {
+            "inserted": inserted,
+            "updated": len(returned) - inserted,
+            "unchanged": len(demand) - len(returned),
+        }, [(row.datetime, row.region) for row in returned]
+
+    @staticmethod
+    def _existing_rows(session, demand, keys):
+        """Returns the values of the rows of the range of demand already in the table, {(datetime, region): values}."""
+        datetimes = [row["datetime"] for row in demand]
+        stmt = select(Demand.datetime, Demand.region, *[getattr(Demand, key) for key in keys]).where(
+            Demand.datetime >= min(datetimes),
+            Demand.datetime <= max(datetimes),
+            Demand.region.in_({row["region"] for row in demand}),
         )
-        session.execute(update_stmt)
+        return {(datetime_, region): tuple(values) for datetime_, region, *values in session.execute(stmt)}
+
+    @staticmethod
+    def _upsert_sqlite(session, demand, keys):
+        """
+        One upsert statement executed for every row (executemany), since a multi-row statement
+        would exceed the number of parameters of SQLite. There is no RETURNING, the rows of the
+        range are read before the upsert and compared with the given ones.
+        """
+        stmt = sqlite.insert(Demand)
+        if keys:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(Demand.KEYS),
+                set_={key: stmt.excluded[key] for key in keys},
+                where=Demand._changed(Demand.__table__, stmt.excluded, keys),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(Demand.KEYS))
+        existing = Demand._existing_rows(session, demand, keys)
+        inserted = []
+        updated = []
+        for row in demand:
+            key = (row["datetime"], row["region"])
+            if key not in existing:
+                inserted.append(key)
+            elif existing[key] != tuple(sql_value(row[column]) for column in keys):
+                updated.append(key)
+        session.execute(stmt, demand)
+        return {
+            "inserted": len(inserted),
+            "updated": len(updated),
+            "unchanged": len(demand) - len(inserted) - len(updated),
+        }, inserted + updated
+
+    @staticmethod
+    def _upsert_duckdb(session, demand, keys):
+        """
+        One INSERT ... SELECT from the rows registered as a dataframe. The changed rows are found
+        with a join before the upsert, since the rowcount of DuckDB also counts the rows skipped
+        by the where clause.
+        """
+        with duckdb_rows(session, "demand_rows", demand) as connection:
+            on = " AND ".join(f"demand.{key} = demand_rows.{key}" for key in Demand.KEYS)
+            changed = " OR ".join(f"demand.{key} IS DISTINCT FROM demand_rows.{key}" for key in keys) or "FALSE"
+            rows = connection.execute(text(
+                f"SELECT demand_rows.datetime, demand_rows.region, demand.id IS NULL AS inserted "
+                f"FROM demand_rows LEFT JOIN demand ON {on} WHERE demand.id IS NULL OR {changed}"
+            )).all()
+            connection.execute(text(duckdb_upsert("demand", "demand_rows", list(demand[0].keys()), Demand.KEYS, keys, only_changed=True)))
+        inserted = sum(row.inserted for row in rows)
+        return {
+            "inserted": inserted,
+            "updated": len(rows) - inserted,
+            "unchanged": len(demand) - len(rows),
+        }, [(row.datetime, row.region) for row in rows]
 
     @staticmethod
     def select_query(region):
@@ -65,4 +245,339 @@ class Demand(Base):
             SQL query to select the demand data for a given region
         """
         stmt = select(Demand).where(Demand.region == region)
-        return stmt
\ No newline at end of file
+        return stmt
+
+    @staticmethod
+    def series_query(start_date, end_date):
+        """
+        Returns the query needed to get the values of every region and hour of a range of days.
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        """
+        return select(
+            Demand.datetime, Demand.region, Demand.demand, Demand.day_type, Demand.temperature, Demand.temperature_forecast,
+        ).where(Demand.datetime >= start_date, Demand.datetime < end_date)
+
+    @staticmethod
+    def count_by_day_query(column, start_date, end_date):
+        """
+        Returns the query needed to count the non null values of a column per day.
+
+        Parameters
+        ----------
+        column : string
+            Column name, for example "temperature".
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        """
+        day = func.date(Demand.datetime).label("day")
+        stmt = (
+            select(day, func.count(getattr(Demand, column)).label("rows"))
+            .where(Demand.datetime >= start_date, Demand.datetime < end_date)
+            .group_by(day)
+        )
+        return stmt
+
+    @staticmethod
+    def with_forecast_query(region, start_date, end_date):
+        """
+        Returns the query needed to get the demand of a range of days with the latest forecast of
+        every hour, as a subquery with the datetime, region, demand and demand_forecast columns.
+
+        Parameters
+        ----------
+        region : string or None
+            Region name. If None all the regions are selected.
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        """
+        regions = None if region is None else [region]
+        latest = Forecast.latest_query(start_date, end_date, regions).subquery()
+        stmt = (
+            select(Demand.datetime, Demand.region, Demand.demand, latest.c.demand_forecast)
+            .outerjoin(latest, and_(latest.c.region == Demand.region, latest.c.datetime == Demand.datetime))
+            .where(Demand.datetime >= start_date, Demand.datetime < end_date)
+        )
+        if region is not None:
+            stmt = stmt.where(Demand.region == region)
+        return stmt.subquery()
+
+    @staticmethod
+    def range_query(region, start_date, end_date):
+        """
+        Returns the query needed to get the hourly demand and demand forecast of a range of days.
+
+        Parameters
+        ----------
+        region : string or None
+            Region name. If None the demand of all the regions is added up.
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        """
+        demand = Demand.with_forecast_query(region, start_date, end_date)
+        if region is None:
+            stmt = select(
+                demand.c.datetime,
+                func.sum(demand.c.demand).label("demand"),
+                func.sum(demand.c.demand_forecast).label("demand_forecast"),
+            ).group_by(demand.c.datetime)
+        else:
+            stmt = select(demand.c.datetime, demand.c.demand, demand.c.demand_forecast)
+        return stmt.order_by(demand.c.datetime)
+
+    @staticmethod
+    def day_query(region, day):
+        """
+        Returns the query needed to get the demand and demand forecast of every hour of a day.
+        The day is filtered as a datetime range, so the index of datetime is used.
+
+        Parameters
+        ----------
+        region : string or None
+            Region name. If None the demand of all the regions is added up.
+        day : datetime.date
+            Day.
+        """
+        demand = Demand.with_forecast_query(region, day, day + timedelta(days=1))
+        hour = cast(extract("hour", demand.c.datetime), Integer).label("hour")
+        if region is None:
+            stmt = select(
+                hour,
+                func.sum(demand.c.demand).label("demand"),
+                func.sum(demand.c.demand_forecast).label("demand_forecast"),
+            ).group_by(hour)
+        else:
+            stmt = select(hour, demand.c.demand, demand.c.demand_forecast)
+        return stmt.order_by(hour)
+
+
+class Forecast(Base):
+    """
+    Demand forecasts. The table is append-only across runs: every run of the machine learning
+    process inserts its forecasts with a new run_id, so the forecasts of earlier runs are kept, a
+    run that is retried replaces only its own rows and the demand table is never written by the
+    predictions. The index on region, datetime and issued_at serves the latest forecast of every
+    hour.
+    """
+
+    __tablename__ = "forecast"
+    run_id = Column(String, primary_key=True)
+    region = Column(String, primary_key=True)
+    datetime = Column(DateTime, primary_key=True)
+    issued_at = Column(DateTime, nullable=False)
+    demand_forecast = Column(Float)
+    __table_args__ = (
+        Index("ix_forecast_latest", "region", "datetime", "issued_at"),
+    )
+
+    KEYS = ("run_id", "region", "datetime")
+
+    @staticmethod
+    def insert(session, forecast):
+        """
+        Inserts forecast rows in one executemany, or one INSERT ... SELECT in DuckDB. A row of a
+        run that is already in the table is replaced, so a retried or cleared task that runs again
+        with the same run_id overwrites its forecasts instead of failing.
+
+        Parameters
+        ----------
+        session : SQLAlchemy session
+            Session in which the insert is committed.
+        forecast : list of dicts
+            Forecast rows with the run_id, issued_at, region, datetime and demand_forecast keys.
+
+        Returns
+        -------
+        counts : dict
+            Number of rows "inserted" and "updated".
+        """
+        datetimes = [row["datetime"] for row in forecast]
+        existing = session.execute(select(func.count()).select_from(Forecast).where(
+            Forecast.run_id.in_({row["run_id"] for row in forecast}),
+            Forecast.region.in_({row["region"] for row in forecast}),
+            Forecast.datetime >= min(datetimes),
+            Forecast.datetime <= max(datetimes),
+        )).scalar()
+        update_columns = [column for column in forecast[0].keys() if column not in Forecast.KEYS]
+        if dialect_name(session) == "duckdb":
+            # DuckDB cannot update a column of an index in an upsert, nor insert a key deleted in
+            # the same transaction, so a row already in the table keeps its issued_at.
+            update_columns = [column for column in update_columns if column != "issued_at"]
+            with duckdb_rows(session, "forecast_rows", forecast) as connection:
+                connection.execute(text(duckdb_upsert("forecast", "forecast_rows", list(forecast[0].keys()), Forecast.KEYS, update_columns)))
+        else:
+            stmt = insert(session, Forecast)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(Forecast.KEYS),
+                set_={column: stmt.excluded[column] for column in update_columns},
+            )
+            session.execute(stmt, forecast)
+        return {"inserted": len(forecast) - existing, "updated": existing}
+
+    @staticmethod
+    def issued_after_query(issued_at=None):
+        """
+        Returns the query needed to get the first and last datetime and the last issued_at of the
+        forecasts issued after issued_at, of every forecast if it is None.
+        """
+        stmt = select(func.min(Forecast.datetime).label("start"), func.max(Forecast.datetime).label("end"), func.max(Forecast.issued_at).label("issued_at"))
+        if issued_at is not None:
+            stmt = stmt.where(Forecast.issued_at > issued_at)
+        return stmt
+
+    @staticmethod
+    def latest_query(start_date, end_date, regions=None):
+        """
+        Returns the query needed to get the latest forecast of every hour of a range of days.
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        regions : list of str, optional
+            Regions to select. All the regions if not given.
+        """
+        issued = select(
+            Forecast.region,
+            Forecast.datetime,
+            func.max(Forecast.issued_at).label("issued_at"),
+        ).where(Forecast.datetime >= start_date, Forecast.datetime < end_date)
+        if regions is not None:
+            issued = issued.where(Forecast.region.in_(list(regions)))
+        issued = issued.group_by(Forecast.region, Forecast.datetime).subquery()
+        stmt = select(
+            Forecast.region,
+            Forecast.datetime,
+            Forecast.demand_forecast,
+            Forecast.run_id,
+            Forecast.issued_at,
+        ).join(issued, and_(
+            Forecast.region == issued.c.region,
+            Forecast.datetime == issued.c.datetime,
+            Forecast.issued_at == issued.c.issued_at,
+        ))
+        return stmt
+
+
+class Coverage(Base):
+    """
+    Coverage of the demand table. For every day and region each column keeps a 24 bit mask with
+    the hours that have a value of the column in the demand table: bit h is set if the value of
+    hour h is not null, so FULL_DAY means the day is complete. The version of a day and region
+    is incremented every time rows of the day are inserted or updated, even when the masks stay
+    the same, so a reader can tell which days changed since it last read them.
+    """
+
+    __tablename__ = "coverage"
+    day = Column(Date, primary_key=True)
+    region = Column(String, primary_key=True)
+    demand = Column(Integer, nullable=False)
+    temperature = Column(Integer, nullable=False)
+    temperature_forecast = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, server_default="0")
+
+    COLUMNS = ("demand", "temperature", "temperature_forecast")
+    FULL_DAY = 2**24 - 1
+
+    @staticmethod
+    def refresh(session, start_date, end_date, regions=None, changed=True):
+        """
+        Computes again the coverage of the days in [start_date, end_date) from the demand table.
+
+        Parameters
+        ----------
+        session : SQLAlchemy session
+            Session in which the coverage is updated.
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        regions : iterable of str, optional
+            Regions to refresh. All the regions if not given.
+        changed : boolean or set of tuples
+            (day, region) cells whose rows were inserted or updated, their version is incremented.
+            True for every cell and False for none.
+
+        Returns
+        -------
+        cells : int
+            Number of (day, region) cells computed. Only the cells with different masks or a
+            version to increment are written.
+        """
+        stmt = select(Demand.datetime, Demand.region, *[getattr(Demand, column).isnot(None) for column in Coverage.COLUMNS])
+        stmt = stmt.where(Demand.datetime >= start_date, Demand.datetime < end_date)
+        if regions is not None:
+            stmt = stmt.where(Demand.region.in_(list(regions)))
+        masks = {}
+        for datetime_, region, *filled in session.execute(stmt):
+            cell = masks.setdefault((datetime_.date(), region), [0] * len(Coverage.COLUMNS))
+            bit = 1 << datetime_.hour
+            for i, is_filled in enumerate(filled):
+                if is_filled:
+                    cell[i] |= bit
+        if not masks:
+            return 0
+        # The version of a row is its increment, a new cell starts with it
+        coverage = [
+            dict(day=day, region=region, version=int(changed if isinstance(changed, bool) else (day, region) in changed), **dict(zip(Coverage.COLUMNS, cell)))
+            for (day, region), cell in masks.items()
+        ]
+        dialect = dialect_name(session)
+        if dialect == "duckdb":
+            with duckdb_rows(session, "coverage_rows", coverage) as connection:
+                connection.execute(text(duckdb_upsert(
+                    "coverage", "coverage_rows", list(coverage[0].keys()), ("day", "region"), Coverage.COLUMNS, only_changed=True, increment_columns=("version",),
+                )))
+            return len(coverage)
+        stmt = insert(session, Coverage)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["day", "region"],
+            set_={
+                **{column: stmt.excluded[column] for column in Coverage.COLUMNS},
+                "version": Coverage.__table__.c.version + stmt.excluded.version,
+            },
+            where=or_(Demand._changed(Coverage.__table__, stmt.excluded, Coverage.COLUMNS), stmt.excluded.version != 0),
+        )
+        if dialect == "postgresql":
+            session.execute(stmt.values(coverage))
+        else:
+            # executemany, a multi-row statement can exceed the number of parameters of SQLite
+            session.execute(stmt, coverage)
+        return len(coverage)
+
+    @staticmethod
+    def select_query(start_date, end_date, regions=None):
+        """
+        Returns the query needed to get the coverage of the days in [start_date, end_date).
+
+        Parameters
+        ----------
+        start_date : datetime.date
+            First day.
+        end_date : datetime.date
+            Day after the last day.
+        regions : list of str, optional
+            Regions to select. All the regions if not given.
+        """
+        stmt = select(Coverage).where(Coverage.day >= start_date, Coverage.day < end_date)
+        if regions is not None:
+            stmt = stmt.where(Coverage.region.in_(list(regions)))
+        return stmt
+
+
+# The sequences of the identity columns in DuckDB
+event.listen(Demand.__table__, "before_create", DDL("CREATE SEQUENCE IF NOT EXISTS demand_id_seq CYCLE").execute_if(dialect="duckdb"))
+event.listen(Demand.__table__, "after_drop", DDL("DROP SEQUENCE IF EXISTS demand_id_seq").execute_if(dialect="duckdb"))
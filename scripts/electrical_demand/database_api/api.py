@@ -1,30 +1,80 @@
-from fastapi import FastAPI
-import os
-from electrical_demand.database.client import ComplexClient
-from electrical_demand.database_api.config import DATABASE_TYPE, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_NAME
+from fastapi import FastAPI, HTTPException, Query
+import asyncio
+from datetime import date, timedelta
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from starlette.concurrency import run_in_threadpool
+from electrical_demand.database.client import AsyncComplexClient
+from electrical_demand.database.models import Demand
+from electrical_demand.database_api.config import (
+    DATABASE_TYPE, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_NAME, RANGE_MAX_POINTS,
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT, REQUEST_TIMEOUT,
+)
+from electrical_demand.database_api.downsampling import downsample
 from electrical_demand.logger import get_logger
+from electrical_demand.config import PROFILE_DIR, PROFILE_API_SAMPLE_RATE
+from electrical_demand import profiling
 logger = get_logger("api", "INFO")
 
 app = FastAPI()
-current_path = os.path.dirname(__file__)
-client = ComplexClient(DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD)
+client = AsyncComplexClient(
+    DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD,
+    pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW, pool_timeout=DATABASE_POOL_TIMEOUT, statement_timeout=REQUEST_TIMEOUT,
+)
+
+async def with_timeout(coroutine):
+    """
+    Awaits a database coroutine for at most REQUEST_TIMEOUT seconds. A request that does not get a
+    connection of the pool in time fails with 503 and a request that takes too long with 504.
+    """
+    try:
+        return await asyncio.wait_for(coroutine, REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.error(f"request timeout after {REQUEST_TIMEOUT} s")
+        raise HTTPException(status_code=504, detail="The database did not answer in time")
+    except PoolTimeoutError:
+        logger.error(f"no database connection available after {DATABASE_POOL_TIMEOUT} s")
+        raise HTTPException(status_code=503, detail="The database is busy")
+
+if PROFILE_DIR and PROFILE_API_SAMPLE_RATE > 0:
+    @app.middleware("http")
+    async def profile_get_region(request, call_next):
+        """
+        Profiles a PROFILE_API_SAMPLE_RATE fraction of the /get-region requests. The profile covers
+        the event loop while the request runs, so requests served at the same time appear in it too.
+        """
+        if not request.url.path.startswith("/get-region/"):
+            return await call_next(request)
+        profiler = profiling.sample_request()
+        if profiler is None:
+            return await call_next(request)
+        try:
+            return await call_next(request)
+        finally:
+            profiler.stop()
+            # The artifacts are written outside the event loop, after the response
+            name = "get-region." + ".".join(request.url.path.split("/")[2:4])
+            asyncio.get_running_loop().run_in_executor(None, profiling.write_request, profiler, name)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await client.dispose()
 
 @app.get("/get-region/{region}/{day}")
-def get_region(region, day):
-    logger.info("region: " + region + "; day: " + day)
-    if region == "TOTAL":
-        query_path = "total.sql"
-    else:
-        query_path = "regions.sql"
-    # region = region.replace("_", " ")
-    # day = day.replace("_", " ")
-    with open(current_path + "/api_queries/" + query_path, "r") as file:
-        query = file.read()
-        if region == "TOTAL":
-            query = query.format(day=day)
-        else:
-            query = query.format(region=region, day=day)
-            print(query)
-        data = client.get_dataframe(query)
-    logger.info("data: " + data.to_json())
-    return {"data": data.to_json()}
\ No newline at end of file
+async def get_region(region, day: date):
+    logger.info(f"region: {region}; day: {day}")
+    query = Demand.day_query(None if region == "TOTAL" else region, day)
+    data = await with_timeout(client.get_dataframe(query))
+    return {"data": data.to_json()}
+
+@app.get("/get-range/{region}/{start}/{end}")
+async def get_range(region, start: date, end: date, points: int = Query(1000, ge=3, le=RANGE_MAX_POINTS), method: str = Query("lttb", regex="^(lttb|minmax)$")):
+    """
+    Returns the hourly demand and demand forecast from start to end, both included, downsampled
+    to at most points per series, so the size of the response does not depend on the range.
+    """
+    logger.info(f"region: {region}; start: {start}; end: {end}; points: {points}; method: {method}")
+    query = Demand.range_query(None if region == "TOTAL" else region, start, end + timedelta(days=1))
+    data = await with_timeout(client.get_dataframe(query, index_col="datetime", parse_dates=["datetime"]))
+    # The downsampling is CPU bound, so it runs outside the event loop.
+    data = await run_in_threadpool(downsample, data, points, method)
+    return {"data": data.to_json(date_format="iso"), "rows": len(data)}
@@ -1,3 +0,0 @@
-SELECT EXTRACT(HOUR FROM datetime) AS hour, demand, demand_forecast
-FROM demand
-WHERE region = '{region}' and  DATE(datetime) = '{day}';
\ No newline at end of file
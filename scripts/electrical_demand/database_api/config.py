@@ -6,4 +6,14 @@ DATABASE_TYPE = dconfig("DATABASE_TYPE")
 DATABASE_USER = dconfig("DATABASE_USER")
 DATABASE_PASSWORD = dconfig("DATABASE_PASSWORD")
 DATABASE_HOST = dconfig("DATABASE_HOST")
-DATABASE_NAME = dconfig("DATABASE_NAME")
\ No newline at end of file
+DATABASE_NAME = dconfig("DATABASE_NAME")
+
+RANGE_MAX_POINTS = dconfig("RANGE_MAX_POINTS", default=5000, cast=int)
+
+# Bounded connection pool of the api: at most DATABASE_POOL_SIZE + DATABASE_MAX_OVERFLOW connections,
+# a request waits DATABASE_POOL_TIMEOUT seconds for one before failing with 503.
+DATABASE_POOL_SIZE = dconfig("DATABASE_POOL_SIZE", default=5, cast=int)
+DATABASE_MAX_OVERFLOW = dconfig("DATABASE_MAX_OVERFLOW", default=5, cast=int)
+DATABASE_POOL_TIMEOUT = dconfig("DATABASE_POOL_TIMEOUT", default=5, cast=float)
+# Seconds after which a request fails with 504. The database cancels the query too (PostgreSQL).
+REQUEST_TIMEOUT = dconfig("REQUEST_TIMEOUT", default=10, cast=float)
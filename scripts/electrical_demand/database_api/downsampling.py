@@ -0,0 +1,110 @@
+"""
+This module provides the downsampling of the time series returned by the database api, so a
+range of any length can be plotted with a bounded number of points.
+"""
+
+import numpy as np
+import pandas as pd
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets. The first and last points are kept and the other points are
+    split in points - 2 buckets. From every bucket it keeps the point that forms the largest
+    triangle with the point kept from the previous bucket and the mean of the next bucket.
+
+    Parameters
+    ----------
+    x : numpy array
+        Increasing x values as floats.
+    y : numpy array
+        y values, without nulls.
+    points : int
+        Number of points to keep.
+
+    Returns
+    -------
+    indices : numpy array
+        Sorted indices of the points kept.
+    """
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:max(points, 1)])
+    edges = np.linspace(1, n - 1, points - 1).astype(int)
+    indices = np.empty(points, dtype=int)
+    indices[0] = 0
+    indices[-1] = n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        indices[i + 1] = previous
+    return indices
+
+def min_max(x, y, points):
+    """
+    Splits the points in points // 2 buckets of consecutive points and keeps the minimum and the
+    maximum of every bucket, so the peaks of the series are never lost.
+
+    Parameters
+    ----------
+    x : numpy array
+        Increasing x values, they are not used and are only part of the signature of lttb.
+    y : numpy array
+        y values, without nulls.
+    points : int
+        Maximum number of points to keep.
+
+    Returns
+    -------
+    indices : numpy array
+        Sorted indices of the points kept.
+    """
+    n = len(y)
+    if points >= n:
+        return np.arange(n)
+    buckets = max(points // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype(int)
+    bucket = np.repeat(np.arange(buckets), np.diff(edges))
+    # Sorted by bucket and then by value, the first point of every bucket is its minimum and the last one its maximum.
+    order = np.lexsort((y, bucket))
+    return np.unique(np.concatenate([order[edges[:-1]], order[edges[1:] - 1]]))
+
+def downsample(dataframe, points, method="lttb"):
+    """
+    Downsamples every column of a time series.
+
+    Parameters
+    ----------
+    dataframe : Pandas dataframe
+        Numeric columns indexed by datetime.
+    points : int
+        Maximum number of points of every column.
+    method : {"lttb", "minmax"}
+        Downsampling method.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe
+        Long format dataframe with the datetime, series and value columns.
+    """
+    function = {"lttb": lttb, "minmax": min_max}[method]
+    list_df = []
+    for column in dataframe.columns:
+        series = dataframe[column].dropna()
+        if series.empty:
+            continue
+        x = series.index.values.astype("datetime64[s]").astype(np.float64)
+        indices = function(x, series.values.astype(np.float64), points)
+        list_df.append(pd.DataFrame({"datetime": series.index[indices], "series": column, "value": series.values[indices]}))
+    if not list_df:
+        return pd.DataFrame(columns=["datetime", "series", "value"])
+    return pd.concat(list_df, ignore_index=True)
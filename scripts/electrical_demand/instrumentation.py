@@ -0,0 +1,271 @@
+"""
+Lightweight timing and throughput instrumentation of the ETL stages.
+Stages are measured with the span context manager or the timed decorator. Each stage records the
+number of calls, the duration, the rows processed and the bytes moved. The results can be exported
+as Prometheus text format metrics or as a JSON summary.
+
+Instrumentation is disabled unless the METRICS_DIR environment variable is set or enable() is
+called. When it is disabled a span is a shared no-op object and a timed function only pays one
+flag check. When METRICS_DIR is set the metrics are written at exit to
+METRICS_DIR/<METRICS_RUN_ID>/<METRICS_TASK>.json and .prom.
+"""
+
+import atexit
+import functools
+import json
+import threading
+import time
+from pathlib import Path
+from electrical_demand.config import METRICS_DIR, METRICS_RUN_ID, METRICS_TASK
+
+_enabled = bool(METRICS_DIR)
+_lock = threading.Lock()
+_stages = {}
+
+
+class Span():
+    """
+    Measures one execution of a stage. Rows and bytes can be set or added while the span is open.
+
+    Attributes
+    ----------
+    stage : str
+        Stage name.
+    rows : int
+        Rows processed.
+    nbytes : int
+        Bytes moved.
+    """
+
+    def __init__(self, stage, rows=0, nbytes=0):
+        self.stage = stage
+        self.rows = rows
+        self.nbytes = nbytes
+        self._start = None
+
+    def add(self, rows=0, nbytes=0):
+        self.rows += rows
+        self.nbytes += nbytes
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        record(self.stage, time.perf_counter() - self._start, self.rows, self.nbytes, failed=exc_type is not None)
+        return False
+
+
+class _NullSpan():
+    """Span used when the instrumentation is disabled."""
+
+    rows = 0
+    nbytes = 0
+
+    def add(self, rows=0, nbytes=0):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    with _lock:
+        _stages.clear()
+
+def record(stage, seconds, rows=0, nbytes=0, failed=False):
+    """
+    Adds one execution to the stage totals.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name.
+    seconds : float
+        Duration of the execution.
+    rows : int, optional
+        Rows processed.
+    nbytes : int, optional
+        Bytes moved.
+    failed : bool, optional
+        True if the execution raised an exception.
+    """
+    with _lock:
+        totals = _stages.setdefault(stage, {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0, "bytes": 0})
+        totals["calls"] += 1
+        totals["errors"] += int(failed)
+        totals["seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], seconds)
+        totals["rows"] += int(rows)
+        totals["bytes"] += int(nbytes)
+
+def span(stage, rows=0, nbytes=0):
+    """
+    Returns a context manager that measures a stage.
+
+    Parameters
+    ----------
+    stage : str
+        Stage name.
+    rows : int, optional
+        Rows processed, if already known.
+    nbytes : int, optional
+        Bytes moved, if already known.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(stage, rows, nbytes)
+
+def timed(stage=None, rows=None, nbytes=None):
+    """
+    Decorator that measures every call of a function as a stage.
+
+    Parameters
+    ----------
+    stage : str, optional
+        Stage name. Defaults to the qualified name of the function.
+    rows : callable, optional
+        Function applied to the result to get the rows processed.
+    nbytes : callable, optional
+        Function applied to the result to get the bytes moved.
+    """
+    def decorator(function):
+        stage_name = stage or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(stage_name) as current_span:
+                result = function(*args, **kwargs)
+                if result is not None:
+                    current_span.rows = rows(result) if rows else 0
+                    current_span.nbytes = nbytes(result) if nbytes else 0
+            return result
+        return wrapper
+    return decorator
+
+def text_nbytes(text):
+    """Returns the size of a text encoded as utf-8, for the nbytes of timed."""
+    return len(text.encode("utf-8"))
+
+def summary():
+    """
+    Returns
+    -------
+    summary : dict
+        Totals per stage, including the throughput in rows and bytes per second.
+    """
+    with _lock:
+        stages = {stage: dict(totals) for stage, totals in _stages.items()}
+    for totals in stages.values():
+        seconds = totals["seconds"]
+        totals["rows_per_second"] = totals["rows"] / seconds if seconds else 0.0
+        totals["bytes_per_second"] = totals["bytes"] / seconds if seconds else 0.0
+    return stages
+
+def to_prometheus(labels=None):
+    """
+    Returns the stage totals in Prometheus text exposition format.
+
+    Parameters
+    ----------
+    labels : dict, optional
+        Extra labels added to every sample, for example the run id and the task.
+    """
+    metrics = [
+        ("electrical_demand_stage_calls_total", "counter", "Executions of the stage.", "calls"),
+        ("electrical_demand_stage_errors_total", "counter", "Executions of the stage that raised an exception.", "errors"),
+        ("electrical_demand_stage_seconds_total", "counter", "Time spent in the stage.", "seconds"),
+        ("electrical_demand_stage_max_seconds", "gauge", "Longest execution of the stage.", "max_seconds"),
+        ("electrical_demand_stage_rows_total", "counter", "Rows processed by the stage.", "rows"),
+        ("electrical_demand_stage_bytes_total", "counter", "Bytes moved by the stage.", "bytes"),
+    ]
+    stages = summary()
+    extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+    lines = []
+    for name, metric_type, help_text, key in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for stage, totals in sorted(stages.items()):
+            lines.append(f'{name}{{stage="{stage}"{extra}}} {totals[key]}')
+    return "\n".join(lines) + "\n"
+
+def export(directory, run_id, task):
+    """
+    Writes the JSON summary and the Prometheus metrics of the process to directory/run_id/task.json and .prom.
+
+    Returns
+    -------
+    json_path : pathlib.Path
+        Path of the JSON summary.
+    """
+    run_dir = Path(directory) / run_id.replace(":", "_").replace("+", "_")
+    run_dir.mkdir(parents=True, exist_ok=True)
+    labels = {"run_id": run_id, "task": task}
+    json_path = run_dir / f"{task}.json"
+    with open(json_path, "w") as f:
+        json.dump({**labels, "stages": summary()}, f, indent=4)
+    with open(run_dir / f"{task}.prom", "w") as f:
+        f.write(to_prometheus(labels))
+    return json_path
+
+def merge_run(run_dir):
+    """
+    Merges the JSON summaries of every task of a DAG run into run_dir/summary.json.
+
+    Parameters
+    ----------
+    run_dir : str or pathlib.Path
+        Directory of the DAG run, as written by export.
+
+    Returns
+    -------
+    stages : dict
+        Totals per stage of the whole run.
+    """
+    run_dir = Path(run_dir)
+    stages = {}
+    for task_path in sorted(run_dir.glob("*.json")):
+        if task_path.name == "summary.json":
+            continue
+        with open(task_path, "r") as f:
+            task_summary = json.load(f)
+        for stage, totals in task_summary["stages"].items():
+            merged = stages.setdefault(stage, {"calls": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0, "bytes": 0})
+            for key in ("calls", "errors", "seconds", "rows", "bytes"):
+                merged[key] += totals[key]
+            merged["max_seconds"] = max(merged["max_seconds"], totals["max_seconds"])
+    with open(run_dir / "summary.json", "w") as f:
+        json.dump(stages, f, indent=4)
+    return stages
+
+def _export_at_exit():
+    if _stages:
+        export(METRICS_DIR, METRICS_RUN_ID, METRICS_TASK)
+
+
+if METRICS_DIR:
+    atexit.register(_export_at_exit)
+
+
+if __name__ == "__main__":
+    import sys
+    print(json.dumps(merge_run(sys.argv[1]), indent=4))
@@ -1,8 +1,116 @@
+"""
+Logging backend of the package. The file handler is created only once per process and it runs
+in a background thread behind a queue, so logging never blocks the caller on disk. Every line is
+written as a JSON object with the date, region and stage of the current log context.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+
+LOG_FILE = "logging.log"
+CONTEXT_FIELDS = ("date", "region", "stage")
+
+_log_context = contextvars.ContextVar("log_context", default={})
+_queue_handler = None
+_queue_handler_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a log record as a JSON line including the context fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that keeps the message and the traceback of a record apart. The default
+    prepare formats the whole record into its message and drops the traceback.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        # The traceback is rendered in the caller thread, the record must not keep its frames alive
+        if record.exc_info:
+            record.exc_text = JsonFormatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    """Adds the fields of the current log context to the record. Explicit extra fields take precedence."""
+
+    def filter(self, record):
+        for field, value in _log_context.get().items():
+            if getattr(record, field, None) is None:
+                setattr(record, field, value)
+        return True
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Context manager that adds fields (date, region, stage) to every log line written inside it.
+
+    Parameters
+    ----------
+    **fields :
+        Fields to add. They are merged with the fields of the enclosing context.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+def _get_queue_handler():
+    """
+    Returns the queue handler of the process. The first call creates the file handler and
+    starts the listener thread that writes the queued records.
+    """
+    global _queue_handler
+    if _queue_handler is not None:
+        return _queue_handler
+    with _queue_handler_lock:
+        if _queue_handler is not None:
+            return _queue_handler
+        log_queue = queue.SimpleQueue()
+        file_handler = logging.FileHandler(LOG_FILE)
+        file_handler.setFormatter(JsonFormatter())
+        listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _queue_handler = _QueueHandler(log_queue)
+        _queue_handler.addFilter(ContextFilter())
+        return _queue_handler
 
 def get_logger(name, level="ERROR"):
     """
     Function to get a Python logger. It can be used for different objects to share the same logger.
+    It can be called many times with the same name: the queue handler is only attached once.
 
     Parameters
     ----------
@@ -18,8 +126,7 @@ def get_logger(name, level="ERROR"):
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    formatter = logging.Formatter("%(asctime)s:%(levelname)s:%(name)s:%(message)s")
-    file_handler = logging.FileHandler("logging.log")
-    file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
-    return logger
\ No newline at end of file
+    queue_handler = _get_queue_handler()
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+    return logger
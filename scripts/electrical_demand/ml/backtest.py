@@ -0,0 +1,50 @@
+"""
+Backtests of the demand model on the series store. For every cutoff the model is trained with
+the hours before the cutoff and predicts the following hours, which are compared with the demand
+of the store. The datasets are slices of the memory-mapped series, so a backtest with many
+cutoffs does not query the database.
+"""
+
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from electrical_demand.ml.demand_forecast import train_and_predictions
+
+HORIZON = timedelta(days=4)
+
+
+def backtest_region(store, region, cutoffs, horizon=HORIZON):
+    """
+    Parameters
+    ----------
+    store : electrical_demand.series_store.SeriesStore
+        Series store.
+    region : str
+        Region name.
+    cutoffs : list of datetime-like
+        First hour predicted by each run.
+    horizon : datetime.timedelta
+        Hours predicted after each cutoff.
+
+    Returns
+    -------
+    results : Pandas dataframe
+        One row per cutoff with the hours predicted, the mean absolute error and the mean
+        absolute percentage error.
+    """
+    results = []
+    for cutoff in cutoffs:
+        cutoff = pd.Timestamp(cutoff)
+        dataset = store.frame(region, end=cutoff + horizon)
+        actual = dataset.loc[dataset.index >= cutoff, "demand"].copy()
+        # The hours from the cutoff are the ones to predict, as the rows without demand of the table.
+        dataset.loc[dataset.index >= cutoff, "demand"] = np.nan
+        predictions = train_and_predictions(dataset)["demand_forecast"].reindex(actual.index)
+        errors = (predictions - actual).abs()[actual.notna()]
+        results.append({
+            "cutoff": cutoff,
+            "hours": len(errors),
+            "mae": errors.mean(),
+            "mape": (errors / actual[actual.notna()]).mean(),
+        })
+    return pd.DataFrame(results)
@@ -8,9 +8,11 @@ from sklearn.model_selection import cross_validate
 from sklearn.kernel_approximation import Nystroem
 from sklearn.linear_model import RidgeCV
 import numpy as np
+from electrical_demand.instrumentation import timed
 
 def train_and_predictions(dataset):
-    dataset.drop(columns=["id", "demand_forecast"], inplace=True)
+    # The datasets of the series store have no id
+    dataset.drop(columns=["id"], inplace=True, errors="ignore")
     dataset['month'] = dataset.index.month
     dataset['hour'] = dataset.index.hour
     dataset["weekday"] = dataset.index.weekday
@@ -26,6 +28,7 @@ def train_and_predictions(dataset):
     predictions = predict(predict_dataset, model, max_demand)
     return predictions
 
+@timed()
 def train_model(dataset):
     X = dataset.drop("demand", axis="columns")
     y = dataset["demand"]
@@ -89,6 +92,7 @@ def evaluate(model, X, y, cv):
             f"Root Mean Squared Error: {rmse.mean():.3f} +/- {rmse.std():.3f}"
             )
 
+@timed(rows=len)
 def predict(dataset, model, max_demand):
     dataset["demand_forecast"] = dataset[["day_type", "temperature", "month", "hour", "weekday"]].apply(
         lambda s: model.predict(pd.DataFrame([s]))[0], axis=1
@@ -0,0 +1,177 @@
+"""
+Gaps of the demand table and their backfill.
+The coverage table keeps, for every day and region, a bit mask of the hours with a value of each
+column. It is refreshed by every insert of the demand table, so the missing (region, hour) cells
+of a range are found without reading the demand table and only the days with gaps are
+downloaded and loaded again.
+
+    python -m electrical_demand.pipeline.coverage gaps --start 2022-01-01 --end 2022-02-01
+"""
+
+from datetime import timedelta
+import pandas as pd
+from electrical_demand.database.models import Coverage
+from electrical_demand.pipeline.database import load_demand_to_database, load_temp_to_database
+from electrical_demand.pipeline.raw_data import load_raw_demand_to_s3, load_raw_temp
+from electrical_demand.process_data.getters import get_region_dicts
+from electrical_demand.process_data.utils import daterange
+from electrical_demand.logger import get_logger
+
+# Columns that can be backfilled from the raw data
+BACKFILL_COLUMNS = ("demand", "temperature", "temperature_forecast")
+HOURS = 24
+
+
+def missing_hours(mask):
+    """Returns the hours that are not set in a coverage mask."""
+    return [hour for hour in range(HOURS) if not mask >> hour & 1]
+
+def rebuild_coverage(client, start_date, end_date):
+    """
+    Computes the coverage of [start_date, end_date) from the demand table, one month per transaction.
+    The coverage is kept up to date by the inserts, this is only needed to repair it.
+
+    Returns
+    -------
+    cells : int
+        Number of (day, region) rows updated.
+    """
+    cells = 0
+    fn_session = client.get_session()
+    month_start = start_date
+    while month_start < end_date:
+        month_end = min((month_start.replace(day=1) + timedelta(days=32)).replace(day=1), end_date)
+        with fn_session() as session:
+            cells += Coverage.refresh(session, month_start, month_end)
+            session.commit()
+        month_start = month_end
+    return cells
+
+def find_gaps(client, regions, start_date, end_date, columns=BACKFILL_COLUMNS):
+    """
+    Finds the hours without value of the columns in [start_date, end_date).
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    regions : list of str
+        Regions to check. A region without coverage in a day misses the whole day.
+    start_date : datetime.date
+        First day.
+    end_date : datetime.date
+        Day after the last day.
+    columns : tuple of str
+        Columns of the demand table to check.
+
+    Returns
+    -------
+    gaps : Pandas dataframe
+        One row per day, region and column with missing hours: day, region, column,
+        missing_hours (count) and hours (list of the missing hours).
+    """
+    coverage = client.get_dataframe(Coverage.select_query(start_date, end_date, regions))
+    masks = {(pd.Timestamp(day).date(), region): row for day, region, row in zip(coverage["day"], coverage["region"], coverage[list(columns)].to_dict("records"))}
+    gaps = []
+    for day in daterange(start_date, end_date):
+        for region in regions:
+            row = masks.get((day, region), {})
+            for column in columns:
+                mask = int(row.get(column, 0))
+                if mask != Coverage.FULL_DAY:
+                    hours = missing_hours(mask)
+                    gaps.append({"day": day, "region": region, "column": column, "missing_hours": len(hours), "hours": hours})
+    return pd.DataFrame(gaps, columns=["day", "region", "column", "missing_hours", "hours"])
+
+def days_to_backfill(gaps):
+    """
+    Returns the dates of the raw files that have the missing values.
+
+    Returns
+    -------
+    days : dict
+        Sorted dates to download again, {"demand": [...], "temperature": [...]}.
+    """
+    days = {"demand": set(), "temperature": set()}
+    for row in gaps.itertuples():
+        if row.column == "demand":
+            # The demand file of a date has the hours from 01:00 to 00:00 of the next day.
+            if any(hour > 0 for hour in row.hours):
+                days["demand"].add(row.day)
+            if 0 in row.hours:
+                days["demand"].add(row.day - timedelta(days=1))
+        else:
+            days["temperature"].add(row.day)
+    return {dataset: sorted(dataset_days) for dataset, dataset_days in days.items()}
+
+def backfill_gaps(client, demand_table, general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, columns=BACKFILL_COLUMNS, dry_run=False):
+    """
+    Downloads and loads again only the days of [start_date, end_date) with gaps.
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    demand_table : SQAlchemy _DeclarativeBase
+        Demand table model.
+    start_date : datetime.date
+        First day.
+    end_date : datetime.date
+        Day after the last day.
+    columns : tuple of str
+        Columns to backfill.
+    dry_run : boolean
+        If True the days are only reported.
+
+    Returns
+    -------
+    report : dict
+        Days backfilled per dataset and missing cells before and after the backfill.
+    """
+    logger = get_logger(backfill_gaps.__name__, level="INFO")
+    regions = [region_dict["region"] for region_dict in get_region_dicts(general_bucket)]
+    gaps = find_gaps(client, regions, start_date, end_date, columns)
+    days = days_to_backfill(gaps)
+    report = {"days": {dataset: [day.isoformat() for day in dataset_days] for dataset, dataset_days in days.items()}, "missing_before": int(gaps["missing_hours"].sum())}
+    logger.info(f"backfill_gaps - {report}")
+    if dry_run:
+        return report
+    for day in days["demand"]:
+        load_raw_demand_to_s3(day, general_bucket, demand_bucket, force=True)
+        load_demand_to_database(client, demand_table, demand_bucket, general_bucket, day, force=True)
+    for day in days["temperature"]:
+        load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, date=day, force=True)
+        load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, date=day, force=True)
+    report["missing_after"] = int(find_gaps(client, regions, start_date, end_date, columns)["missing_hours"].sum())
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Demand
+    from electrical_demand.database_api.config import DATABASE_TYPE, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Gaps of the demand table.")
+    parser.add_argument("command", choices=["gaps", "rebuild", "backfill"])
+    parser.add_argument("--start", type=lambda value: pd.Timestamp(value).date(), required=True)
+    parser.add_argument("--end", type=lambda value: pd.Timestamp(value).date(), required=True, help="day after the last day")
+    parser.add_argument("--columns", nargs="+", choices=Coverage.COLUMNS, default=list(BACKFILL_COLUMNS))
+    parser.add_argument("--general-bucket")
+    parser.add_argument("--demand-bucket")
+    parser.add_argument("--temp-forecast-bucket")
+    parser.add_argument("--temp-historical-bucket")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.command != "rebuild" and args.general_bucket is None:
+        parser.error("--general-bucket is needed to read the regions")
+    client = ComplexClient(DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD)
+    if args.command == "rebuild":
+        print(rebuild_coverage(client, args.start, args.end), "cells")
+    elif args.command == "gaps":
+        regions = [region_dict["region"] for region_dict in get_region_dicts(args.general_bucket)]
+        gaps = find_gaps(client, regions, args.start, args.end, tuple(args.columns))
+        print(gaps.to_string(index=False) if not gaps.empty else "no gaps")
+    else:
+        print(backfill_gaps(client, Demand, args.general_bucket, args.demand_bucket, args.temp_forecast_bucket, args.temp_historical_bucket, args.start, args.end, tuple(args.columns), args.dry_run))
@@ -0,0 +1,168 @@
+from electrical_demand.config import HISTORICAL_LOAD_CHUNK_DAYS, HISTORICAL_LOAD_BATCH_ROWS, HISTORICAL_LOAD_MAX_RSS_MB
+from electrical_demand.process_data.loaders import load_to_db, current_rss_mib, peak_rss_mib
+from electrical_demand.process_data.utils import build_calendar, daterange, new_rows
+from electrical_demand.process_data.getters import get_csv_from_s3, get_csv_path, get_daily_from_s3, get_region_dicts, get_historical_demand, HISTORICAL_DEMAND_PATH
+from electrical_demand.process_data.manifest import IngestionManifest
+from electrical_demand.storage import get_storage
+from collections import Counter
+from datetime import timedelta, datetime
+import time
+import pandas as pd
+from electrical_demand.logger import get_logger, log_context
+
+# Smallest transaction of the chunked historical demand load
+MIN_BATCH_ROWS = 1000
+
+def temp_rows(temp, stations_to_demand, datetime_to_delete=None):
+    """Returns the rows of a daily temperature file to load to the demand table: the stations of the regions, without the station and file_date columns."""
+    if datetime_to_delete is not None:
+        temp = temp[temp.index != datetime_to_delete]
+    temp = temp[temp["station"].isin(stations_to_demand)]
+    return temp.drop(columns=["station", "file_date"])
+
+def date_chunks(start_date, end_date, days=HISTORICAL_LOAD_CHUNK_DAYS):
+    """
+    Splits [start_date, end_date) in consecutive [chunk_start, chunk_end) ranges of days days,
+    or of calendar months if days is 0.
+    """
+    chunk_start = start_date
+    while chunk_start < end_date:
+        if days:
+            chunk_end = chunk_start + timedelta(days=days)
+        else:
+            chunk_end = (chunk_start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunk_end = min(chunk_end, end_date)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+def load_historical_demand_to_database(client, demand_table, general_bucket, start_date, end_date, force=False, chunk_days=HISTORICAL_LOAD_CHUNK_DAYS, batch_rows=HISTORICAL_LOAD_BATCH_ROWS, max_rss_mb=HISTORICAL_LOAD_MAX_RSS_MB):
+    """
+    Loads the calendar rows and the historical demand of [start_date, end_date) chunk by chunk,
+    so the memory used does not depend on the length of the range. Each chunk only reads its row
+    groups of the historical demand file, its rows are inserted batch_rows at a time with one
+    transaction per batch and its dates are recorded in the manifest once it is loaded, so an
+    interrupted load resumes from the first chunk that was not finished.
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    demand_table : SQAlchemy _DeclarativeBase
+        Demand table model.
+    start_date : datetime.date
+        First day.
+    end_date : datetime.date
+        Day after the last day.
+    force : boolean
+        If True the chunks already loaded are loaded again.
+    chunk_days : int
+        Days per chunk, 0 for calendar months.
+    batch_rows : int
+        Rows per transaction.
+    max_rss_mb : int
+        Resident memory in MiB. When a chunk ends above it, the batches of the next chunks are
+        halved. 0 for no limit.
+
+    Returns
+    -------
+    counts : dict
+        Number of rows "inserted", "updated" and "unchanged".
+    """
+    logger = get_logger(load_historical_demand_to_database.__name__, level="INFO")
+    manifest = IngestionManifest(general_bucket, "historical_demand")
+    # Every date of the range is loaded from the same file, so a chunk is loaded again only
+    # when the file changed since it was loaded.
+    version = get_storage().version(general_bucket, HISTORICAL_DEMAND_PATH)
+    counts = Counter()
+    region_dicts = None
+
+    with manifest:
+        for chunk_start, chunk_end in date_chunks(start_date, end_date, chunk_days):
+            dates = list(daterange(chunk_start, chunk_end))
+            if not force and all((manifest.get(date) or {}).get("db_version") == version for date in dates):
+                continue
+            if region_dicts is None:
+                region_dicts = get_region_dicts(general_bucket)
+                holidays = get_csv_from_s3(general_bucket, "holidays.csv", index_col="date", parse_dates=True)
+
+            start = time.perf_counter()
+            # The hours of the chunk, (chunk_start, chunk_end]. The last chunk also has the hours
+            # after end_date that new_rows adds for the forecasts.
+            if chunk_end == end_date:
+                rows_to_add = new_rows(region_dicts, holidays, chunk_start, end_date=chunk_end)
+            else:
+                rows_to_add = build_calendar([region_dict["region"] for region_dict in region_dicts], holidays, chunk_start, chunk_end)
+            counts.update(load_to_db(rows_to_add, demand_table, client, keep_index=True, batch_rows=batch_rows))
+            del rows_to_add
+
+            historical_demand = get_historical_demand(general_bucket, chunk_start, chunk_end)
+            counts.update(load_to_db(historical_demand, demand_table, client, keep_index=True, batch_rows=batch_rows))
+            rows_by_date = (historical_demand.index - pd.Timedelta(hours=1)).normalize().value_counts()
+            rows = len(historical_demand)
+            del historical_demand
+
+            for date in dates:
+                manifest.update(date, bucket=general_bucket, object=HISTORICAL_DEMAND_PATH, object_version=version, db_version=version, db_rows=int(rows_by_date.get(pd.Timestamp(date), 0)))
+            rss = current_rss_mib()
+            logger.info(
+                f"load_historical_demand_to_database - {chunk_start} to {chunk_end}: {rows} rows in {time.perf_counter() - start:.2f} s, "
+                f"batches of {batch_rows} rows, RSS {rss:.0f} MiB, peak RSS {peak_rss_mib():.0f} MiB"
+            )
+            if max_rss_mb and rss > max_rss_mb and batch_rows > MIN_BATCH_ROWS:
+                batch_rows = max(batch_rows // 2, MIN_BATCH_ROWS)
+                logger.warning(f"load_historical_demand_to_database - RSS {rss:.0f} MiB above {max_rss_mb} MiB, batches of {batch_rows} rows from now on")
+    return dict(counts)
+
+def load_demand_to_database(client, demand_table, demand_bucket, general_bucket, date, force=False):
+    counts = Counter()
+    region_dicts = get_region_dicts(general_bucket)
+
+    holidays = get_csv_from_s3(general_bucket, "holidays.csv", index_col="date", parse_dates=True)
+    rows_to_add = new_rows(region_dicts, holidays, date)
+    counts.update(load_to_db(rows_to_add, demand_table, client, keep_index=True))
+
+    with IngestionManifest(general_bucket, "demand") as manifest:
+        if not force and not manifest.needs_db_load(date):
+            return dict(counts)
+
+        csv_path = get_csv_path(date)
+
+        demand = get_daily_from_s3(demand_bucket, date)
+        if demand is not None:
+            counts.update(load_to_db(demand, demand_table, client, keep_index=True))
+            manifest.record_db_load(date, demand_bucket, csv_path, len(demand))
+    return dict(counts)
+
+def load_temp_to_database(client, demand_table, temp_forecast_bucket, temp_historical_bucket, general_bucket, date=None, start_date=None, end_date=None, delete_first_datetime=False, force=False):
+    region_dicts = get_region_dicts(general_bucket)
+    stations_to_demand = [region_dict["station"] for region_dict in region_dicts]
+    forecast_manifest = IngestionManifest(general_bucket, "temp_forecast")
+    historical_manifest = IngestionManifest(general_bucket, "temp_historical")
+    counts = Counter()
+
+    if delete_first_datetime:
+        datetime_to_delete = datetime(start_date.year, start_date.month, start_date.day)
+    
+    if date != None:
+        start_date = date
+        end_date = date + timedelta(days=1)
+
+    with forecast_manifest, historical_manifest:
+        for date in daterange(start_date, end_date):
+            with log_context(date=date, stage="load_temp_to_database"):
+                csv_path = get_csv_path(date)
+
+                if force or historical_manifest.needs_db_load(date):
+                    temp_historical = get_daily_from_s3(temp_historical_bucket, date)
+                    if temp_historical is not None:
+                        temp_historical = temp_rows(temp_historical, stations_to_demand, datetime_to_delete if delete_first_datetime else None)
+                        counts.update(load_to_db(temp_historical, demand_table, client, keep_index=True))
+                        historical_manifest.record_db_load(date, temp_historical_bucket, csv_path, len(temp_historical))
+
+                if force or forecast_manifest.needs_db_load(date):
+                    temp_forecast = get_daily_from_s3(temp_forecast_bucket, date)
+                    if temp_forecast is not None:
+                        temp_forecast = temp_rows(temp_forecast, stations_to_demand, datetime_to_delete if delete_first_datetime else None)
+                        counts.update(load_to_db(temp_forecast, demand_table, client, keep_index=True))
+                        forecast_manifest.record_db_load(date, temp_forecast_bucket, csv_path, len(temp_forecast))
+    return dict(counts)
@@ -0,0 +1,42 @@
+import uuid
+from datetime import datetime
+from electrical_demand.process_data.loaders import load_to_db
+from electrical_demand.process_data.getters import get_demand, get_region_dicts
+from electrical_demand.ml.demand_forecast import train_and_predictions
+from electrical_demand.logger import log_context
+
+def ml_process(client, general_bucket, forecast_table, run_id=None, store=None):
+    run_id = run_id or uuid.uuid4().hex
+    region_dicts = get_region_dicts(general_bucket)
+    for region_dict in region_dicts:
+        ml_process_region(client, forecast_table, region_dict["region"], run_id, store=store)
+
+def ml_process_region(client, forecast_table, region, run_id=None, store=None):
+    """
+    Trains the model of a region and appends its predictions to the forecast table.
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    forecast_table : SQAlchemy _DeclarativeBase
+        Forecast table model.
+    region : str
+        Region name.
+    run_id : str, optional
+        Identifier shared by the forecasts of every region of a run. A new one if not given.
+    store : electrical_demand.series_store.SeriesStore, optional
+        If given, the dataset is read from the store instead of the database.
+    """
+    with log_context(region=region, stage="ml_process"):
+        if store is not None:
+            dataset = store.frame(region)
+        else:
+            dataset = get_demand(client, region)
+            dataset.drop(columns=["region"], inplace=True)
+        predictions = train_and_predictions(dataset)
+        predictions["region"] = region
+        predictions["run_id"] = run_id or uuid.uuid4().hex
+        # In UTC, the column has no time zone
+        predictions["issued_at"] = datetime.utcnow()
+        load_to_db(predictions, forecast_table, client, keep_index=True)
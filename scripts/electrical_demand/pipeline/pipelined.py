@@ -0,0 +1,214 @@
+"""
+Pipelined ETL of the daily datasets (demand, temp_forecast and temp_historical). The dates of a
+range are downloaded, parsed, written to the buckets and loaded to the database by concurrent
+stages connected by bounded queues (see electrical_demand.pipelining), so during a backfill the
+network, the CPU and the database work at the same time. The database is loaded from the parsed
+dataframes, the csv files are not read back from the buckets.
+
+The ingestion manifests are used as in load_raw_temp, load_raw_demand_to_s3 and the loads of
+pipeline.database: dates already downloaded are not downloaded again, and the ones not loaded to
+the database yet are read from their bucket and only go through the load stage.
+
+    python -m electrical_demand.pipeline.pipelined --start 2022-01-01 --end 2022-02-01 --general-bucket ...
+"""
+
+import threading
+from collections import Counter
+from datetime import datetime
+import pandas as pd
+from electrical_demand.api.api import ForecastSMNApi, HistoricalSNMPApi, DemandByDateByRegionApi
+from electrical_demand.config import PIPELINE_QUEUE_SIZE, PIPELINE_DOWNLOAD_WORKERS
+from electrical_demand.logger import get_logger, log_context
+from electrical_demand.pipeline.database import temp_rows
+from electrical_demand.pipelining import Stage, run_pipeline
+from electrical_demand.process_data.getters import get_csv_from_s3, get_csv_path, get_daily_from_s3, get_region_dicts
+from electrical_demand.process_data.loaders import load_to_db
+from electrical_demand.process_data.manifest import IngestionManifest, checksum
+from electrical_demand.process_data.utils import daterange, new_rows
+
+DATASETS = ("demand", "temp_forecast", "temp_historical")
+TEMPERATURE_COLUMNS = {"temp_forecast": "temperature_forecast", "temp_historical": "temperature"}
+
+
+def to_db_rows(dataset, dataframe):
+    """
+    Converts a dataframe returned by the _transform method of the api of the dataset to the rows
+    its csv file has once it is read back, the ones loaded by pipeline.database.
+    """
+    if dataset == "demand":
+        return dataframe.reset_index(level="region")
+    dataframe = dataframe.copy()
+    dataframe.index = pd.to_datetime(dataframe.index)
+    dataframe.index.name = "datetime"
+    column = TEMPERATURE_COLUMNS[dataset]
+    dataframe[column] = pd.to_numeric(dataframe[column], errors="coerce")
+    return dataframe
+
+def pipelined_etl(client, demand_table, general_bucket, demand_bucket, temp_forecast_bucket, temp_historical_bucket, start_date, end_date, datasets=DATASETS, load=True, force=False, delete_first_datetime=False, download_workers=PIPELINE_DOWNLOAD_WORKERS, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Downloads the dates of [start_date, end_date) of the datasets, writes them to their buckets
+    and loads them to the database with the stages download -> parse -> store -> load.
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    demand_table : SQAlchemy _DeclarativeBase
+        Demand table model.
+    start_date : datetime.date
+        First day.
+    end_date : datetime.date
+        Day after the last day.
+    datasets : tuple of str
+        Datasets to process, some of DATASETS.
+    load : boolean
+        If False the dates are only written to the buckets.
+    force : boolean
+        If True every date is downloaded again, only the ones whose file changed are written and loaded.
+    delete_first_datetime : boolean
+        If True the temperatures of the first datetime of start_date are not loaded, it has no
+        row of the calendar.
+    download_workers : int
+        Concurrent downloads.
+    queue_size : int
+        Maximum number of dates waiting in front of each stage.
+
+    Returns
+    -------
+    report : dict
+        Dates processed and rows "inserted", "updated" and "unchanged" per dataset, the wall
+        time and the time and utilization of every stage.
+    """
+    logger = get_logger(pipelined_etl.__name__, level="INFO")
+    region_dicts = get_region_dicts(general_bucket)
+    stations_to_demand = [region_dict["station"] for region_dict in region_dicts]
+    apis = {}
+    if "demand" in datasets:
+        apis["demand"] = DemandByDateByRegionApi(demand_bucket)
+    if "temp_forecast" in datasets or "temp_historical" in datasets:
+        stations = get_csv_from_s3(general_bucket, "stations.csv")
+        if "temp_forecast" in datasets:
+            temp_forecast_stations = get_csv_from_s3(general_bucket, "temp_forecast_stations.csv").merge(stations, how="inner", on="station")
+            apis["temp_forecast"] = ForecastSMNApi(temp_forecast_bucket, temp_forecast_stations, stations=stations_to_demand)
+        if "temp_historical" in datasets:
+            temp_historical_stations = get_csv_from_s3(general_bucket, "temp_historical_stations.csv").merge(stations, how="inner", on="station")
+            apis["temp_historical"] = HistoricalSNMPApi(temp_historical_bucket, temp_historical_stations, stations=stations_to_demand)
+    manifests = {dataset: IngestionManifest(general_bucket, dataset) for dataset in datasets}
+    # The manifests are read and written by every stage
+    manifest_lock = threading.Lock()
+    datetime_to_delete = datetime(start_date.year, start_date.month, start_date.day) if delete_first_datetime else None
+
+    if load:
+        holidays = get_csv_from_s3(general_bucket, "holidays.csv", index_col="date", parse_dates=True)
+        load_to_db(new_rows(region_dicts, holidays, start_date, end_date=end_date), demand_table, client, keep_index=True)
+
+    def jobs():
+        for date in daterange(start_date, end_date):
+            for dataset in datasets:
+                with manifest_lock:
+                    download = force or manifests[dataset].needs_download(date)
+                    from_bucket = not download and load and manifests[dataset].needs_db_load(date)
+                if download or from_bucket:
+                    yield {"dataset": dataset, "date": date, "from_bucket": from_bucket}
+
+    def download(job):
+        dataset, date, api = job["dataset"], job["date"], apis[job["dataset"]]
+        with log_context(date=date, stage=f"pipelined_{dataset}"):
+            if not job["from_bucket"]:
+                if dataset == "demand":
+                    job["raw"] = api._download_regions(date, region_dicts)
+                    source_checksum = checksum([text_data for _, text_data in job["raw"]])
+                else:
+                    job["raw"] = api._download(date)
+                    source_checksum = checksum(job["raw"])
+                with manifest_lock:
+                    changed = manifests[dataset].source_changed(date, source_checksum)
+                    job["from_bucket"] = not changed and load and manifests[dataset].needs_db_load(date)
+                if changed:
+                    job["source_checksum"] = source_checksum
+                    return job
+                job.pop("raw")
+            if job["from_bucket"]:
+                dataframe = get_daily_from_s3(api.bucket, date)
+                if dataframe is not None:
+                    job["rows"] = dataframe
+                    job["csv_path"] = get_csv_path(date)
+                    return job
+        return None
+
+    def parse(job):
+        if "raw" in job:
+            with log_context(date=job["date"], stage=f"pipelined_{job['dataset']}"):
+                job["dataframe"] = apis[job["dataset"]]._transform(job.pop("raw"), job["date"])
+        return job
+
+    def store(job):
+        if "dataframe" in job:
+            dataset, date, api = job["dataset"], job["date"], apis[job["dataset"]]
+            dataframe = job.pop("dataframe")
+            job["csv_path"] = api._save(dataframe, date)
+            with manifest_lock:
+                manifests[dataset].record_object(date, job["source_checksum"], len(dataframe), api.bucket, job["csv_path"])
+            if load and job["csv_path"] is not None:
+                job["rows"] = to_db_rows(dataset, dataframe)
+        return job
+
+    def load_rows(job):
+        dataset, date = job["dataset"], job["date"]
+        rows = job.pop("rows", None)
+        job["counts"] = Counter()
+        if rows is not None:
+            if dataset != "demand":
+                rows = temp_rows(rows, stations_to_demand, datetime_to_delete)
+            job["counts"] = load_to_db(rows, demand_table, client, keep_index=True)
+            with manifest_lock:
+                manifests[dataset].record_db_load(date, apis[dataset].bucket, job["csv_path"], len(rows))
+        return job
+
+    stages = [Stage("download", download, workers=download_workers), Stage("parse", parse), Stage("store", store)]
+    if load:
+        stages.append(Stage("load", load_rows))
+    try:
+        results, pipeline_report = run_pipeline(jobs(), stages, queue_size=queue_size)
+    finally:
+        with manifest_lock:
+            for manifest in manifests.values():
+                manifest.flush()
+
+    report = {"dates": {dataset: 0 for dataset in datasets}, "counts": {dataset: Counter() for dataset in datasets}}
+    for job in results:
+        report["dates"][job["dataset"]] += 1
+        report["counts"][job["dataset"]].update(job.get("counts", {}))
+    report["counts"] = {dataset: dict(counts) for dataset, counts in report["counts"].items()}
+    report.update(pipeline_report)
+    logger.info(f"pipelined_etl - {report}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database.models import Demand
+    from electrical_demand.database_api.config import DATABASE_TYPE, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Pipelined ETL of the daily datasets.")
+    parser.add_argument("--start", type=lambda value: pd.Timestamp(value).date(), required=True)
+    parser.add_argument("--end", type=lambda value: pd.Timestamp(value).date(), required=True, help="day after the last day")
+    parser.add_argument("--datasets", nargs="+", choices=DATASETS, default=list(DATASETS))
+    parser.add_argument("--general-bucket", required=True)
+    parser.add_argument("--demand-bucket")
+    parser.add_argument("--temp-forecast-bucket")
+    parser.add_argument("--temp-historical-bucket")
+    parser.add_argument("--no-load", action="store_true", help="only write the dates to the buckets")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--download-workers", type=int, default=PIPELINE_DOWNLOAD_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=PIPELINE_QUEUE_SIZE)
+    args = parser.parse_args()
+
+    client = ComplexClient(DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD)
+    report = pipelined_etl(
+        client, Demand, args.general_bucket, args.demand_bucket, args.temp_forecast_bucket, args.temp_historical_bucket, args.start, args.end,
+        datasets=tuple(args.datasets), load=not args.no_load, force=args.force, download_workers=args.download_workers, queue_size=args.queue_size,
+    )
+    print(json.dumps(report, indent=4, default=str))
@@ -0,0 +1,113 @@
+from electrical_demand.api.api import ForecastSMNApi, HistoricalSNMPApi, DemandByDateByRegionApi
+from electrical_demand.process_data.loaders import load_historical_demand, process_holidays, load_files_to_s3, compact_month
+from electrical_demand.process_data.utils import daterange
+from electrical_demand.process_data.getters import get_csv_from_s3, get_region_dicts, get_month_path, HISTORICAL_DEMAND_PATH
+from electrical_demand.process_data.manifest import IngestionManifest
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, date as date_type
+from electrical_demand.storage import get_storage
+
+DAILY_PATH_PATTERN = re.compile(r"csv/year=(\d{4})/month=(\d{2})/")
+
+def load_data_to_S3(general_bucket, stations_file_path, temp_forecast_stations_file_path, temp_historical_stations_file_path, historical_demand_file_path, holidays_file_path, regions_dict_file_path):
+
+    # The conversion of the historical demand workbook runs while the other files are uploaded
+    # together, the unchanged ones are skipped.
+    with tempfile.TemporaryDirectory() as work_dir, ThreadPoolExecutor(max_workers=1) as executor:
+        historical_demand = executor.submit(load_historical_demand, historical_demand_file_path, general_bucket, HISTORICAL_DEMAND_PATH)
+        holidays_path = os.path.join(work_dir, "holidays.csv")
+        process_holidays(holidays_file_path).to_csv(holidays_path, index=True)
+        load_files_to_s3({
+            "stations.csv": stations_file_path,
+            "temp_forecast_stations.csv": temp_forecast_stations_file_path,
+            "temp_historical_stations.csv": temp_historical_stations_file_path,
+            "holidays.csv": holidays_path,
+            "region_dicts.json": regions_dict_file_path,
+        }, general_bucket)
+        historical_demand.result()
+
+def load_raw_temp(temp_forecast_bucket, temp_historical_bucket, general_bucket, date=None, start_date=None, end_date=None, force=False):
+
+    forecast_manifest = IngestionManifest(general_bucket, "temp_forecast")
+    historical_manifest = IngestionManifest(general_bucket, "temp_historical")
+
+    if date != None:
+        start_date = date
+        end_date = date + timedelta(days=1)
+
+    # Dates already in the manifest are skipped. With force every date is downloaded again
+    # and only the ones whose file changed are processed and uploaded.
+    dates = [
+        date for date in daterange(start_date, end_date)
+        if force or forecast_manifest.needs_download(date) or historical_manifest.needs_download(date)
+    ]
+    if not dates:
+        return
+
+    stations = get_csv_from_s3(general_bucket, "stations.csv")
+
+    temp_historical_stations = get_csv_from_s3(general_bucket, "temp_historical_stations.csv")
+    temp_historical_stations = temp_historical_stations.merge(stations, how="inner", on="station")
+    temp_forecast_stations = get_csv_from_s3(general_bucket, "temp_forecast_stations.csv")
+    temp_forecast_stations = temp_forecast_stations.merge(stations, how="inner", on="station")
+
+    # Only the stations of the regions are parsed and uploaded.
+    stations_to_demand = [region_dict["station"] for region_dict in get_region_dicts(general_bucket)]
+
+    forecast_api = ForecastSMNApi(temp_forecast_bucket, temp_forecast_stations, stations=stations_to_demand)
+    historical_api = HistoricalSNMPApi(temp_historical_bucket, temp_historical_stations, stations=stations_to_demand)
+
+    with forecast_manifest, historical_manifest:
+        for date in dates:
+            if force or forecast_manifest.needs_download(date):
+                forecast_api.etl(date, manifest=forecast_manifest)
+            if force or historical_manifest.needs_download(date):
+                historical_api.etl(date, manifest=historical_manifest)
+
+def load_raw_demand_to_s3(date, general_bucket, demand_bucket, force=False):
+
+    manifest = IngestionManifest(general_bucket, "demand")
+    if not force and not manifest.needs_download(date):
+        return
+
+    region_dicts = get_region_dicts(general_bucket)
+
+    cammessa_api = DemandByDateByRegionApi(demand_bucket)
+    with manifest:
+        cammessa_api.etl(date, region_dicts, manifest=manifest)
+
+def compact_raw_data(buckets, current_date=None, start_date=None, end_date=None, force=False):
+    """
+    Compacts the daily csv files of every finished month of the buckets into one parquet file per month.
+    The month of current_date and the following ones are not compacted, their readers use the daily files.
+
+    Parameters
+    ----------
+    buckets : list of str
+        Buckets of the datasets.
+    current_date : datetime.date, optional
+        Current date. Defaults to today.
+    start_date : datetime.date, optional
+        If given, only the months from the month of start_date are compacted.
+    end_date : datetime.date, optional
+        If given, only the months before end_date are compacted.
+    force : boolean
+        If True the months already compacted are compacted again.
+    """
+    storage = get_storage()
+    current_date = current_date or date_type.today()
+    current_month = (current_date.year, current_date.month)
+    for bucket in buckets:
+        months = sorted({tuple(map(int, DAILY_PATH_PATTERN.match(path).groups())) for path in storage.list(bucket, "csv/year=")})
+        for year, month in months:
+            if (year, month) >= current_month:
+                continue
+            if start_date is not None and (year, month) < (start_date.year, start_date.month):
+                continue
+            if end_date is not None and date_type(year, month, 1) >= end_date:
+                continue
+            if force or not storage.exists(bucket, get_month_path(year, month)):
+                compact_month(bucket, year, month)
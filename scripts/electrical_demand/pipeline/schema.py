@@ -0,0 +1,171 @@
+"""
+Database schema migrations.
+The migration scripts are generated at development time and shipped in migrations/versions, together
+with versions/schema.json, the head revision and the fingerprint of the models it was generated from:
+
+    python -m electrical_demand.pipeline.schema revision -m "message" --url postgresql://...
+
+At run time run_migrations checks that the models match the fingerprint and compares the revision of
+the database with the head revision. Alembic is only imported when the database is behind.
+"""
+
+import ast
+import hashlib
+import json
+import re
+from pathlib import Path
+
+MIGRATIONS_DIR = Path(__file__).parent.parent / "migrations"
+VERSIONS_DIR = MIGRATIONS_DIR / "versions"
+SCHEMA_FILE = VERSIONS_DIR / "schema.json"
+REVISION_PATTERN = re.compile(r"^(revision|down_revision) = (.+)$", re.MULTILINE)
+
+
+def schema_fingerprint():
+    """
+    Returns the sha256 of the DDL of the models compiled for PostgreSQL. It changes with any change
+    of a table, column, type, constraint or index.
+    """
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.schema import CreateIndex, CreateTable
+    from electrical_demand.database.models import Base
+
+    dialect = postgresql.dialect()
+    statements = []
+    for table in Base.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)))
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            statements.append(str(CreateIndex(index).compile(dialect=dialect)))
+    ddl = "\n".join(line.strip() for statement in statements for line in statement.splitlines() if line.strip())
+    return hashlib.sha256(ddl.encode("utf-8")).hexdigest()
+
+def shipped_revisions():
+    """
+    Reads the revision identifiers of the migration scripts without importing alembic.
+
+    Returns
+    -------
+    revisions : dict
+        Down revisions of every revision, {revision: tuple of down revisions}.
+    """
+    revisions = {}
+    for script in VERSIONS_DIR.glob("*.py"):
+        identifiers = dict(REVISION_PATTERN.findall(script.read_text()))
+        down_revision = ast.literal_eval(identifiers["down_revision"])
+        if down_revision is None:
+            down_revision = ()
+        elif isinstance(down_revision, str):
+            down_revision = (down_revision,)
+        revisions[ast.literal_eval(identifiers["revision"])] = tuple(down_revision)
+    return revisions
+
+def head_revisions(revisions=None):
+    revisions = revisions if revisions is not None else shipped_revisions()
+    down_revisions = {down for downs in revisions.values() for down in downs}
+    return set(revisions) - down_revisions
+
+def database_revisions(engine):
+    """Returns the revisions stored in the alembic_version table of the database."""
+    from sqlalchemy import inspect, text
+
+    with engine.connect() as connection:
+        if not inspect(connection).has_table("alembic_version"):
+            return set()
+        return {row[0] for row in connection.execute(text("SELECT version_num FROM alembic_version"))}
+
+def _alembic_config(dsn):
+    from alembic.config import Config
+
+    alembic_cfg = Config()
+    alembic_cfg.set_main_option("script_location", str(MIGRATIONS_DIR))
+    alembic_cfg.set_main_option("sqlalchemy.url", dsn)
+    return alembic_cfg
+
+def run_migrations(dsn):
+    """
+    Upgrades the database to the head revision of the shipped migration scripts.
+    Nothing is done when the database is already at the head revision.
+
+    Parameters
+    ----------
+    dsn : script
+        SQLAlchemy script connection to a database
+
+    Returns
+    -------
+    upgraded : bool
+        True if alembic upgraded the database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    from electrical_demand.logger import get_logger
+
+    logger = get_logger(run_migrations.__name__)
+    with open(SCHEMA_FILE, "r") as f:
+        schema = json.load(f)
+    if schema["fingerprint"] != schema_fingerprint():
+        raise RuntimeError(
+            "The database models changed after the last migration script. "
+            "Generate one with: python -m electrical_demand.pipeline.schema revision -m <message> --url <development database>"
+        )
+    revisions = shipped_revisions()
+    heads = head_revisions(revisions)
+    engine = create_engine(dsn, poolclass=NullPool)
+    current = database_revisions(engine)
+    if current == heads:
+        return False
+
+    from alembic import command
+
+    alembic_cfg = _alembic_config(dsn)
+    if current - set(revisions):
+        # The migration scripts used to be generated at run time, so databases created then have
+        # revisions that are not shipped. Their schema is the one of the first shipped revision.
+        base = next(revision for revision, down_revisions in revisions.items() if not down_revisions)
+        logger.error(f"run_migrations - unknown revisions {sorted(current)}, stamping {base}")
+        command.stamp(alembic_cfg, base, purge=True)
+    command.upgrade(alembic_cfg, "head")
+    return True
+
+def generate_revision(dsn, message):
+    """
+    Generates a migration script from the changes of the models and updates versions/schema.json.
+    It is meant to be run at development time against a development database.
+
+    Parameters
+    ----------
+    dsn : str
+        SQLAlchemy connection string of the development database.
+    message : str
+        Description of the change.
+    """
+    from alembic import command
+
+    alembic_cfg = _alembic_config(dsn)
+    command.upgrade(alembic_cfg, "head")
+    command.revision(alembic_cfg, message=message, autogenerate=True)
+    write_schema_file()
+
+def write_schema_file():
+    heads = sorted(head_revisions())
+    with open(SCHEMA_FILE, "w") as f:
+        json.dump({"head": heads[0] if len(heads) == 1 else heads, "fingerprint": schema_fingerprint()}, f, indent=4)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Development tools of the database migrations.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    revision_parser = subparsers.add_parser("revision", help="generate a migration script from the changes of the models")
+    revision_parser.add_argument("-m", "--message", required=True)
+    revision_parser.add_argument("--url", required=True, help="SQLAlchemy url of the development database")
+    check_parser = subparsers.add_parser("check", help="upgrade a database if it is behind the head revision")
+    check_parser.add_argument("--url", required=True)
+    args = parser.parse_args()
+
+    if args.command == "revision":
+        generate_revision(args.url, args.message)
+    else:
+        print("upgraded" if run_migrations(args.url) else "up to date")
@@ -0,0 +1,79 @@
+from electrical_demand.process_data.manifest import IngestionManifest
+from electrical_demand.process_data.utils import daterange
+from electrical_demand.storage import get_storage
+from electrical_demand.logger import get_logger
+
+# dataset: column of the demand table filled by the dataset
+DATASET_COLUMNS = {
+    "temp_forecast": "temperature_forecast",
+    "temp_historical": "temperature",
+    "demand": "demand",
+    "historical_demand": "demand",
+}
+
+def verify_ingestion(client, demand_table, general_bucket, dataset_buckets, start_date, end_date, repair=False):
+    """
+    Compares the ingestion manifest with the buckets and the database for every date in [start_date, end_date).
+
+    Parameters
+    ----------
+    client : stock.database Client
+        Database client.
+    demand_table : SQAlchemy _DeclarativeBase
+        Demand table model.
+    general_bucket : str
+        Bucket where the manifest is stored.
+    dataset_buckets : dict
+        Bucket of each dataset to verify, {"temp_forecast": bucket, ...}.
+    start_date : datetime.date
+        First date.
+    end_date : datetime.date
+        Date after the last date.
+    repair : boolean
+        If True the manifest is fixed so the next run downloads the dates missing in the bucket
+        and loads again the dates missing in the database or changed in the bucket.
+
+    Returns
+    -------
+    report : dict
+        Dates with problems per dataset: {dataset: {"missing_in_s3": [...], "changed_in_s3": [...],
+        "missing_in_db": [...], "untracked": [...]}}.
+    """
+    logger = get_logger(verify_ingestion.__name__, level="INFO")
+    storage = get_storage()
+    versions = {}
+    report = {}
+    for dataset, bucket in dataset_buckets.items():
+        with IngestionManifest(general_bucket, dataset) as manifest:
+            rows_by_day = client.get_dataframe(demand_table.count_by_day_query(DATASET_COLUMNS[dataset], start_date, end_date))
+            rows_by_day = {str(day)[:10]: rows for day, rows in zip(rows_by_day["day"], rows_by_day["rows"])}
+            stored = set(storage.list(bucket, "csv/")) if dataset != "historical_demand" else set()
+            problems = {"missing_in_s3": [], "changed_in_s3": [], "missing_in_db": [], "untracked": []}
+            for date in daterange(start_date, end_date):
+                day = date.isoformat()
+                entry = manifest.get(date)
+                if entry is None:
+                    if "csv/year=%4d/month=%02d/%02d.csv" % (date.year, date.month, date.day) in stored:
+                        problems["untracked"].append(day)
+                    continue
+                if entry.get("object") is not None:
+                    if not storage.exists(entry["bucket"], entry["object"]):
+                        problems["missing_in_s3"].append(day)
+                        if repair:
+                            manifest.remove(date)
+                        continue
+                    key = (entry["bucket"], entry["object"])
+                    if key not in versions:
+                        versions[key] = storage.version(*key)
+                    version = versions[key]
+                    if version != entry.get("object_version"):
+                        problems["changed_in_s3"].append(day)
+                        if repair:
+                            manifest.update(date, object_version=version)
+                if entry.get("db_version") is not None and entry.get("db_rows") and not rows_by_day.get(day):
+                    problems["missing_in_db"].append(day)
+                    if repair:
+                        manifest.update(date, db_version=None)
+        report[dataset] = problems
+        logger.info(f"verify_ingestion - {dataset}: " + ", ".join(f"{problem}: {len(days)}" for problem, days in problems.items()))
+    return report
@@ -0,0 +1,188 @@
+"""
+Runs a sequence of stages concurrently, each one in its own threads, connected by bounded queues.
+A stage takes the items of the previous one and its output is the input of the next one. When a
+queue is full the stage that feeds it waits (backpressure), so the items in memory are bounded by
+the queue sizes and the whole run is limited by the slowest stage instead of the sum of the stages.
+
+For every stage the time spent working, waiting for input and waiting for space in the next queue
+is measured. The utilization (working time over the available worker time) tells which stage is
+the bottleneck: it is close to 1 for the slowest stage and the others wait for it.
+"""
+
+import queue
+import threading
+import time
+from electrical_demand.config import PIPELINE_QUEUE_SIZE
+from electrical_demand.instrumentation import is_enabled, record
+
+# Seconds between checks of the stop flag while a stage waits on a queue
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class Stage():
+    """
+    Stage of a pipeline.
+    ...
+
+    Attributes
+    ----------
+    name : str
+        Stage name, also the name of its instrumentation stage "pipeline.<name>".
+    function : callable
+        Called with every input item. It returns the output item, or None to drop the item.
+    workers : int
+        Number of threads of the stage.
+    """
+
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = workers
+
+
+class _StageStats():
+    """Totals of the threads of one stage."""
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.items_in = 0
+        self.items_out = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+        self.running = stage.workers
+        self.lock = threading.Lock()
+
+    def report(self, seconds):
+        available = seconds * self.stage.workers
+        return {
+            "workers": self.stage.workers,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_s": self.busy,
+            "waiting_input_s": self.waiting_input,
+            "waiting_output_s": self.waiting_output,
+            "utilization": self.busy / available if available else 0.0,
+        }
+
+
+def run_pipeline(items, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Runs the stages over the items. The first exception of any stage stops every stage and is raised.
+
+    Parameters
+    ----------
+    items : iterable
+        Inputs of the first stage. It is consumed by its own thread, so it can be a generator.
+    stages : list of Stage
+        Stages in order.
+    queue_size : int
+        Maximum number of items waiting in front of each stage.
+
+    Returns
+    -------
+    results : list
+        Outputs of the last stage, in completion order.
+    report : dict
+        {"seconds": wall time, "items": outputs, "stages": {name: totals and utilization}}.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    stats = [_StageStats(stage) for stage in stages]
+    results = []
+    errors = []
+    stop = threading.Event()
+
+    def put(target, item):
+        """Puts the item in the queue, returns False if the pipeline stopped while waiting for space."""
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(source):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def feed():
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+            put(queues[0], _DONE)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def work(index):
+        stage, stage_stats = stages[index], stats[index]
+        source = queues[index]
+        target = queues[index + 1] if index + 1 < len(stages) else None
+        try:
+            while True:
+                start = time.perf_counter()
+                item = get(source)
+                waited = time.perf_counter() - start
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                output = stage.function(item)
+                busy = time.perf_counter() - start
+                blocked = 0.0
+                if output is not None:
+                    if target is None:
+                        results.append(output)
+                    else:
+                        start = time.perf_counter()
+                        if not put(target, output):
+                            break
+                        blocked = time.perf_counter() - start
+                with stage_stats.lock:
+                    stage_stats.items_in += 1
+                    stage_stats.items_out += output is not None
+                    stage_stats.busy += busy
+                    stage_stats.waiting_input += waited
+                    stage_stats.waiting_output += blocked
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # The other threads of the stage see the end of the input too and the last one tells the next stage.
+            with stage_stats.lock:
+                stage_stats.running -= 1
+                last = stage_stats.running == 0
+            if not stop.is_set():
+                if not last:
+                    put(source, _DONE)
+                elif target is not None:
+                    put(target, _DONE)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=feed, name="pipeline.feed", daemon=True)]
+    for index, stage in enumerate(stages):
+        threads.extend(threading.Thread(target=work, args=(index,), name=f"pipeline.{stage.name}.{worker}", daemon=True) for worker in range(stage.workers))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    if is_enabled():
+        for stage_stats in stats:
+            record(f"pipeline.{stage_stats.stage.name}", stage_stats.busy, rows=stage_stats.items_in, failed=bool(errors))
+    if errors:
+        raise errors[0]
+    report = {
+        "seconds": seconds,
+        "items": len(results),
+        "stages": {stage_stats.stage.name: stage_stats.report(seconds) for stage_stats in stats},
+    }
+    return results, report
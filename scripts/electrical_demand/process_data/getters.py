@@ -1,24 +1,99 @@
+import functools
 import json
-import s3fs
 import pandas as pd
 from electrical_demand.logger import get_logger
-from electrical_demand.database.models import Demand
+from electrical_demand.instrumentation import text_nbytes, timed
+from electrical_demand.storage import get_storage
 
 
 
 def get_demand(client, region):
+    from electrical_demand.database.models import Demand
+
     query = Demand.select_query(region)
     dataframe = client.get_dataframe(query, index_col="datetime", parse_dates=True)
     return dataframe
 
+HISTORICAL_DEMAND_PATH = "historical_demand.parquet"
+# Key of the parquet metadata with the checksum of the workbook the file was converted from
+WORKBOOK_CHECKSUM_KEY = b"workbook_sha256"
+
+
 def get_csv_path(date):
     return "csv/year=%4d/month=%02d/%02d.csv" % (date.year, date.month, date.day, )
 
+def get_month_path(year, month):
+    """Path of the compacted file of a month. It keeps the partition scheme of the daily csv files."""
+    return "parquet/year=%4d/month=%02d/month.parquet" % (year, month, )
+
+@functools.lru_cache(maxsize=4)
+def get_compacted_month(bucket, year, month):
+    """
+    Returns the compacted file of a month as a Pandas dataframe indexed by datetime with a
+    "partition_date" column with the date of the daily file of each row, or None if the month
+    is not compacted. The months are cached, so reading every day of a month reads the file once.
+    """
+    storage = get_storage()
+    month_path = get_month_path(year, month)
+    if not storage.exists(bucket, month_path):
+        return None
+    with storage.open(bucket, month_path, "rb") as f:
+        return pd.read_parquet(f)
+
+def get_daily_from_s3(bucket, date, index_col="datetime"):
+    """
+    Returns the data of one daily partition. The compacted file of the month is used when it
+    exists, otherwise the daily csv file is read (current month or months not compacted yet).
+
+    Parameters
+    ----------
+    bucket : str
+        Bucket of the dataset.
+    date : datetime.date
+        Date of the partition.
+    index_col : str, optional
+        Index column of the daily csv file.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe
+        Data of the partition or None if there is no data for the date.
+    """
+    compacted = get_compacted_month(bucket, date.year, date.month)
+    if compacted is None:
+        return get_csv_from_s3(bucket, get_csv_path(date), index_col=index_col, parse_dates=True)
+    dataframe = compacted[compacted["partition_date"] == pd.Timestamp(date.year, date.month, date.day)]
+    if dataframe.empty:
+        return None
+    return dataframe.drop(columns=["partition_date"])
+
+@timed(rows=len)
+def get_historical_demand(bucket, start_date=None, end_date=None, path=HISTORICAL_DEMAND_PATH):
+    """
+    Returns the historical demand with datetime in (start_date, end_date], the hours of the
+    days from start_date to the day before end_date. Only the row groups of the range are read.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe
+        Region and demand indexed by datetime.
+    """
+    filters = []
+    if start_date is not None:
+        filters.append(("datetime", ">", pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append(("datetime", "<=", pd.Timestamp(end_date)))
+    with get_storage().open(bucket, path, "rb") as f:
+        dataframe = pd.read_parquet(f, filters=filters or None)
+    dataframe["region"] = dataframe["region"].astype(str)
+    return dataframe.set_index("datetime")
+
 def get_region_dicts(general_bucket):
     region_dicts = get_file_from_s3(general_bucket, "region_dicts.json")
     region_dicts = json.loads(region_dicts)
     return region_dicts
 
+@timed(rows=len)
 def get_csv_from_s3(bucket, csv_path, index_col=None, parse_dates=False):
     """
     Parameters
@@ -33,19 +108,18 @@ def get_csv_from_s3(bucket, csv_path, index_col=None, parse_dates=False):
     """
     logger = get_logger(get_csv_from_s3.__name__)
     try:
-        dataframe = pd.read_csv("s3://" + bucket + "/" + csv_path, index_col=index_col, parse_dates=parse_dates, encoding="utf-8")
+        with get_storage().open(bucket, csv_path, "rb") as f:
+            dataframe = pd.read_csv(f, index_col=index_col, parse_dates=parse_dates, encoding="utf-8")
         if index_col:
             dataframe.index.name = index_col
         return dataframe
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
 
+@timed(nbytes=text_nbytes)
 def get_file_from_s3(bucket, file_path):
     logger = get_logger(get_file_from_s3.__name__)
     try:
-        fs = s3fs.S3FileSystem(anon=False)
-        with fs.open(bucket + "/" + file_path, "r") as f:
-            file = f.read()
-        return file
+        return get_storage().read_text(bucket, file_path)
     except FileNotFoundError as e:
         logger.error(f"File not found: {e}")
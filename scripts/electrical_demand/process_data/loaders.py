@@ -1,34 +1,147 @@
-import s3fs
+import os
+import resource
+import time
+from collections import Counter
+import numpy as np
 import pandas as pd
 from electrical_demand.logger import get_logger
+from electrical_demand.instrumentation import is_enabled, record, span, timed
+from electrical_demand.storage import get_storage, sha256
+from electrical_demand.process_data.getters import get_csv_path, get_month_path, get_compacted_month, HISTORICAL_DEMAND_PATH, WORKBOOK_CHECKSUM_KEY
 
-def load_holidays(file_path, bucket_path, file_name):
+# About one month of hourly demand of every region per row group
+HISTORICAL_DEMAND_ROW_GROUP_ROWS = 24 * 31 * 24
+
+def peak_rss_mib():
+    """Returns the peak resident memory of the process in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def current_rss_mib():
+    """Returns the resident memory of the process in MiB, the peak one where /proc is not available."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return peak_rss_mib()
+
+def process_holidays(file_path):
+    """Returns the holidays file indexed by date."""
     dataframe = pd.read_csv(file_path)
     dataframe["date"] = pd.to_datetime(dataframe[["year", "month", "day"]])
     dataframe.set_index("date", inplace=True)
     dataframe.drop(columns=["year", "month", "day"], inplace=True)
-    dataframe.to_csv("s3://" + bucket_path + "/" + file_name, index=True)
     return dataframe
 
-def load_historical_demand(file_path, bucket_path, file_name):
-    dataframe = pd.read_excel(file_path, header=3)
+def load_holidays(file_path, bucket_path, file_name):
+    dataframe = process_holidays(file_path)
+    with get_storage().open(bucket_path, file_name, "w") as f:
+        dataframe.to_csv(f, index=True)
+    return dataframe
+
+def file_checksum(file_path):
+    """Returns the sha256 of a local file."""
+    with open(file_path, "rb") as f:
+        return sha256(f)
+
+def read_workbook(file_path, header=3):
+    """
+    Reads the first sheet of an Excel workbook as pd.read_excel(file_path, header=header).
+    python-calamine is used when it is installed, it is much faster than openpyxl.
+    """
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        return pd.read_excel(file_path, header=header)
+    rows = CalamineWorkbook.from_path(file_path).get_sheet_by_index(0).to_python(skip_empty_area=False)
+    dataframe = pd.DataFrame(rows[header + 1:], columns=rows[header]).replace("", np.nan)
+    dataframe.dropna(how="all", inplace=True)
+    return dataframe
+
+def load_historical_demand(file_path, bucket_path, file_name=HISTORICAL_DEMAND_PATH):
+    """
+    Converts the historical demand workbook to a long format parquet file with the datetime,
+    region and demand columns, sorted by datetime so the readers of a date range only read its
+    row groups. The checksum of the workbook is saved in the metadata of the file and the
+    workbook is not parsed again while it does not change.
+
+    Parameters
+    ----------
+    file_path : str
+        Local path of the workbook.
+    bucket_path : str
+        Bucket where the file is saved.
+    file_name : str
+        Path of the file in the bucket.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe or None
+        Historical demand indexed by datetime, None if the file was already converted.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    logger = get_logger(load_historical_demand.__name__, level="INFO")
+    storage = get_storage()
+    workbook_checksum = file_checksum(file_path)
+    if storage.exists(bucket_path, file_name):
+        with storage.open(bucket_path, file_name, "rb") as f:
+            metadata = pq.read_schema(f).metadata or {}
+        if metadata.get(WORKBOOK_CHECKSUM_KEY) == workbook_checksum.encode():
+            logger.info(f"load_historical_demand - {file_path} did not change, it is not converted again")
+            return None
+
+    start = time.perf_counter()
+    with span("load_historical_demand.read_workbook", nbytes=os.path.getsize(file_path)):
+        dataframe = read_workbook(file_path)
     dataframe.drop(columns=["AÑO", "MES", "N° MES", "N° DIA", "TIPO DIA", "DIA", "TOTAL"], inplace=True)
-    dataframe["datetime"] = dataframe["FECHA"] + pd.to_timedelta(dataframe["HORA"], unit="h")
+    dataframe["datetime"] = pd.to_datetime(dataframe["FECHA"]) + pd.to_timedelta(pd.to_numeric(dataframe["HORA"]), unit="h")
     dataframe.rename(columns={"SGO.DEL ESTERO": "SANTIAGO DEL ESTERO"}, inplace=True)
     dataframe.drop(columns=["HORA", "FECHA"], inplace=True)
     dataframe = pd.melt(dataframe, id_vars=["datetime"], var_name="region", value_name="demand")
-    dataframe.set_index("datetime", inplace=True)
-    dataframe.to_csv("s3://" + bucket_path + "/" + file_name)
-    return dataframe
+    dataframe["demand"] = pd.to_numeric(dataframe["demand"]).astype("float64")
+    dataframe["region"] = dataframe["region"].astype("category")
+    dataframe.sort_values(["datetime", "region"], inplace=True, kind="stable", ignore_index=True)
+
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), WORKBOOK_CHECKSUM_KEY: workbook_checksum.encode()})
+    with span("load_historical_demand.write", rows=len(dataframe)), storage.open(bucket_path, file_name, "wb") as f:
+        pq.write_table(table, f, row_group_size=HISTORICAL_DEMAND_ROW_GROUP_ROWS)
+    logger.info(
+        f"load_historical_demand - converted {len(dataframe)} rows in {time.perf_counter() - start:.2f} s, "
+        f"dataframe {dataframe.memory_usage(deep=True).sum() / 2**20:.1f} MiB, peak RSS {peak_rss_mib():.0f} MiB"
+    )
+    return dataframe.set_index("datetime")
 
 def load_file_to_s3(local_file_path, bucket, s3_file_path):
-    with open(local_file_path, "r") as f:
-        file = f.read()
-    fs = s3fs.S3FileSystem(anon=False)
-    with fs.open(bucket + "/" + s3_file_path, "w") as f:
-        f.write(file)
+    with span("load_file_to_s3", nbytes=os.path.getsize(local_file_path)):
+        get_storage().put_file(local_file_path, bucket, s3_file_path)
 
-def load_to_db(dataframe, table_model, client, keep_index=False):
+def load_files_to_s3(files, bucket):
+    """
+    Uploads local files to the bucket concurrently. The files whose checksum is the one of the
+    file in the bucket are not uploaded again.
+
+    Parameters
+    ----------
+    files : dict
+        {path in the bucket: local path}.
+    bucket : str
+        Bucket where the files are saved.
+
+    Returns
+    -------
+    uploaded : dict
+        {path in the bucket: "uploaded" or "unchanged"}.
+    """
+    logger = get_logger(load_files_to_s3.__name__, level="INFO")
+    with span("load_files_to_s3", rows=len(files), nbytes=sum(os.path.getsize(local_path) for local_path in files.values())):
+        results = get_storage().upload_files([(local_path, bucket, path) for path, local_path in files.items()])
+    uploaded = {path: "uploaded" if results[(bucket, path)] else "unchanged" for path in files}
+    logger.info(f"load_files_to_s3 - {uploaded}")
+    return uploaded
+
+def load_to_db(dataframe, table_model, client, keep_index=False, batch_rows=None):
     """
     Parameters
     ----------
@@ -38,21 +151,87 @@ def load_to_db(dataframe, table_model, client, keep_index=False):
         Table model of the table where the dataframe is to be inserted.
     client : stock.database Client
         Database client.
+    batch_rows : int, optional
+        If given, the rows are converted to dicts and inserted batch_rows at a time, one
+        transaction per batch, instead of all of them in one transaction.
+
+    Returns
+    -------
+    counts : collections.Counter
+        Number of rows "inserted", "updated" and "unchanged".
     """
     logger = get_logger(load_to_db.__name__)
+    counts = Counter(inserted=0, updated=0, unchanged=0)
     try:
         if not dataframe.empty:
             if keep_index:
                 dataframe[dataframe.index.name] = dataframe.index
-            dataframe_dict = dataframe.to_dict(orient="records")
+            batch_rows = batch_rows or len(dataframe)
             fn_session = client.get_session()
-            with fn_session() as session:
-                table_model.insert(session, dataframe_dict)
-                session.commit()
+            for start in range(0, len(dataframe), batch_rows):
+                batch = dataframe.iloc[start:start + batch_rows]
+                with span("load_to_db", rows=len(batch)):
+                    dataframe_dict = batch.to_dict(orient="records")
+                    with fn_session() as session:
+                        counts.update(table_model.insert(session, dataframe_dict))
+                        session.commit()
+                    del dataframe_dict
+            if is_enabled():
+                for outcome in ("inserted", "updated", "unchanged"):
+                    record(f"load_to_db.{outcome}", 0.0, rows=counts[outcome])
+        return counts
     except Exception as e:
         logger.error(f"Exception: {e}")
         raise e
 
+@timed(rows=len)
 def load_df_csv_to_s3(dataframe, bucket, csv_path, index=True):
-    dataframe.to_csv("s3://" + bucket + "/" + csv_path, index=index)
-    return dataframe
\ No newline at end of file
+    with get_storage().open(bucket, csv_path, "w") as f:
+        dataframe.to_csv(f, index=index)
+    return dataframe
+
+def compact_month(bucket, year, month, index_col="datetime"):
+    """
+    Merges the daily csv files of a month into one parquet file, sorted by datetime, with a
+    "partition_date" column with the date of the daily file of each row.
+
+    Parameters
+    ----------
+    bucket : str
+        Bucket of the dataset.
+    year : int
+        Year of the month.
+    month : int
+        Month.
+    index_col : str, optional
+        Index column of the daily csv files.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe
+        Compacted month or None if the month has no daily files.
+    """
+    storage = get_storage()
+    prefix = get_csv_path(pd.Timestamp(year, month, 1)).rsplit("/", 1)[0] + "/"
+    list_df = []
+    for csv_path in storage.list(bucket, prefix):
+        with storage.open(bucket, csv_path, "rb") as f:
+            dataframe = pd.read_csv(f, index_col=index_col, parse_dates=True, encoding="utf-8")
+        dataframe["partition_date"] = pd.Timestamp(year, month, int(csv_path.rsplit("/", 1)[1][:2]))
+        list_df.append(dataframe)
+    if not list_df:
+        return None
+    dataframe = pd.concat(list_df).sort_index(kind="mergesort")
+    with span("compact_month", rows=len(dataframe)):
+        with storage.open(bucket, get_month_path(year, month), "wb") as f:
+            dataframe.to_parquet(f, index=True)
+    get_compacted_month.cache_clear()
+    return dataframe
+
+def drop_compacted_month(bucket, date):
+    """
+    Deletes the compacted file of the month of date. It is called when a daily file is written,
+    so the readers use the daily files until the month is compacted again.
+    """
+    get_storage().delete(bucket, get_month_path(date.year, date.month))
+    get_compacted_month.cache_clear()
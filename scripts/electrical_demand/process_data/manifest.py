@@ -0,0 +1,244 @@
+"""
+This module provides the ingestion manifest: a record of what the ETL has already done for
+every date of a dataset. Each entry keeps the checksum of the downloaded source, the rows
+parsed, the path and version of the object written to the bucket and the version of the
+object that was loaded to the database. The ETL steps check the manifest to only touch
+missing or changed dates and update it after every date.
+
+The manifest of a dataset is stored in the general bucket, one JSON file per month:
+manifest/<dataset>/year=YYYY/month=MM.json
+The changes are buffered and a month file is written once the dates of another month are updated
+or the manifest is flushed, which the manifest does when it is used as a context manager.
+
+A date downloaded without data (an empty response or a forecast not available yet) is downloaded
+again until MANIFEST_EMPTY_RETRY_DAYS days after the date, the data may be published late.
+"""
+
+import hashlib
+import json
+from datetime import datetime, timezone
+from electrical_demand.config import MANIFEST_EMPTY_RETRY_DAYS
+from electrical_demand.storage import get_storage
+
+
+def checksum(texts):
+    """
+    Parameters
+    ----------
+    texts : str or list of str
+        Raw data downloaded from an API.
+
+    Returns
+    -------
+    checksum : str
+        sha256 of the texts.
+    """
+    if isinstance(texts, str):
+        texts = [texts]
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update((text or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def date_of(date):
+    """Returns the datetime.date of a date, datetime or pendulum DateTime."""
+    return date.date() if isinstance(date, datetime) else date
+
+
+class SourceChecksum():
+    """
+    Checksum of a text downloaded in chunks. After all the chunks are added, hexdigest()
+    is equal to checksum of the whole text.
+    """
+
+    def __init__(self):
+        self._digest = hashlib.sha256()
+
+    def update(self, chunk):
+        self._digest.update(chunk.encode("utf-8"))
+
+    def hexdigest(self):
+        digest = self._digest.copy()
+        digest.update(b"\0")
+        return digest.hexdigest()
+
+
+class IngestionManifest():
+    """
+    Ingestion manifest of one dataset.
+    ...
+
+    Attributes
+    ----------
+    bucket : str
+        Bucket where the manifest is stored.
+    dataset : str
+        Dataset name, for example "temp_forecast".
+    _months : dict
+        Months already read, {(year, month): {date_iso: entry}}.
+    _dirty : set
+        Months changed since they were written.
+    ...
+    Methods
+    -------
+    get(date)
+        Returns the entry of the date.
+    update(date, **fields)
+        Updates the entry of the date.
+    flush()
+        Writes the months changed since they were written.
+    needs_download(date)
+        Returns True if the date has not been downloaded yet or it had no data.
+    source_changed(date, source_checksum)
+        Returns True if the downloaded data is different from the recorded one.
+    record_object(date, source_checksum, rows, bucket, path)
+        Records a downloaded date and the object written to the bucket.
+    needs_db_load(date)
+        Returns True if the object of the date has not been loaded to the database.
+    record_db_load(date, bucket, path, rows)
+        Records that the object of the date was loaded to the database.
+    """
+
+    def __init__(self, bucket, dataset):
+        """
+        Parameters
+        ----------
+        bucket : str
+            Bucket where the manifest is stored, usually the general bucket.
+        dataset : str
+            Dataset name.
+        """
+        self.bucket = bucket
+        self.dataset = dataset
+        self._months = {}
+        self._dirty = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Also on errors, so an interrupted run keeps everything done before the interruption.
+        self.flush()
+        return False
+
+    def _path(self, date):
+        return "manifest/%s/year=%4d/month=%02d.json" % (self.dataset, date.year, date.month)
+
+    def _write(self, key):
+        path = "manifest/%s/year=%4d/month=%02d.json" % (self.dataset, key[0], key[1])
+        get_storage().write_text(self.bucket, path, json.dumps(self._months[key], indent=1, sort_keys=True))
+        self._dirty.discard(key)
+
+    def flush(self):
+        """Writes the month files changed since they were written."""
+        for key in sorted(self._dirty):
+            self._write(key)
+
+    def _changed(self, date):
+        key = (date.year, date.month)
+        for other in self._dirty - {key}:
+            self._write(other)
+        self._dirty.add(key)
+
+    def _month(self, date):
+        key = (date.year, date.month)
+        if key not in self._months:
+            try:
+                self._months[key] = json.loads(get_storage().read_text(self.bucket, self._path(date)))
+            except FileNotFoundError:
+                self._months[key] = {}
+        return self._months[key]
+
+    def get(self, date):
+        """Returns the entry of the date as a dict or None if the date is not in the manifest."""
+        return self._month(date).get(date.isoformat()[:10])
+
+    def update(self, date, **fields):
+        """
+        Updates the fields of the entry of the date. The month file is written when the dates of
+        another month are updated or the manifest is flushed.
+        """
+        month = self._month(date)
+        entry = month.setdefault(date.isoformat()[:10], {})
+        entry.update(fields, updated_at=datetime.now(timezone.utc).isoformat())
+        self._changed(date)
+        return entry
+
+    def remove(self, date):
+        """Removes the entry of the date, so the next run downloads it again."""
+        month = self._month(date)
+        if month.pop(date.isoformat()[:10], None) is not None:
+            self._changed(date)
+
+    def needs_download(self, date, today=None):
+        """
+        Returns True if the date is not in the manifest, or if it was downloaded without data and
+        it is not more than MANIFEST_EMPTY_RETRY_DAYS days old.
+        """
+        entry = self.get(date)
+        if entry is None:
+            return True
+        if entry.get("object") is not None and entry.get("rows") != 0:
+            return False
+        today = today or datetime.now(timezone.utc).date()
+        return (today - date_of(date)).days <= MANIFEST_EMPTY_RETRY_DAYS
+
+    def source_changed(self, date, source_checksum):
+        """
+        Returns True if source_checksum, as returned by checksum, is different from the recorded
+        one or if the object written for the date does not exist anymore.
+        """
+        entry = self.get(date)
+        if entry is None or entry.get("source_checksum") != source_checksum:
+            return True
+        return entry.get("object") is not None and not get_storage().exists(entry["bucket"], entry["object"])
+
+    def record_object(self, date, source_checksum, rows, bucket, path):
+        """
+        Parameters
+        ----------
+        date : datetime.date
+            Date of the data.
+        source_checksum : str
+            Checksum of the raw data downloaded from the API, as returned by checksum.
+        rows : int
+            Number of rows parsed.
+        bucket : str
+            Bucket of the object.
+        path : str or None
+            Path of the object written to the bucket, None if there was no data to write.
+        """
+        version = get_storage().version(bucket, path) if path is not None else None
+        return self.update(date, source_checksum=source_checksum, rows=rows, bucket=bucket, object=path, object_version=version)
+
+    def needs_db_load(self, date):
+        """
+        Returns True if the date is not in the manifest (it was written to the bucket before the
+        manifest existed) or if the version of its object is not the one loaded to the database.
+        Dates without an object have nothing to load.
+        """
+        entry = self.get(date)
+        if entry is None:
+            return True
+        if entry.get("object") is None:
+            return False
+        return entry.get("db_version") != entry.get("object_version")
+
+    def record_db_load(self, date, bucket, path, rows):
+        """
+        Parameters
+        ----------
+        date : datetime.date
+            Date of the data.
+        bucket : str
+            Bucket of the object loaded.
+        path : str
+            Path of the object loaded.
+        rows : int
+            Number of rows loaded to the database.
+        """
+        entry = self.get(date) or {}
+        version = entry.get("object_version") or get_storage().version(bucket, path)
+        return self.update(date, bucket=bucket, object=path, object_version=version, db_version=version, db_rows=rows)
@@ -1,6 +1,11 @@
+import functools
+import numpy as np
 import pandas as pd
 from datetime import timedelta
 import pendulum
+from electrical_demand.config import MANIFEST_EMPTY_RETRY_DAYS
+
+DEFAULT_DAY_TYPE = "working_day"
 
 
 def get_new_data_date(current_date):
@@ -8,25 +13,119 @@ def get_new_data_date(current_date):
     new_data_date = current_date.subtract(days=1)
     return new_data_date
 
+def get_new_data_dates(current_date, retry_days=MANIFEST_EMPTY_RETRY_DAYS):
+    """
+    Returns the date of the new data of current_date and, before it, the retry_days previous
+    dates. The dates already ingested are skipped by the manifests, so only the ones that had
+    no data yet are downloaded again.
+    """
+    new_data_date = get_new_data_date(current_date)
+    return [new_data_date.subtract(days=days) for days in range(retry_days, -1, -1)]
+
 def daterange(start_date, end_date):
     for n in range(int((end_date - start_date).days)):
         yield start_date + timedelta(n)
 
+def holidays_key(holidays_df):
+    """
+    Returns a hashable representation of the holidays dataframe so it can be used as a cache key.
+
+    Parameters
+    ----------
+    holidays_df : Pandas dataframe
+        Holidays indexed by date with a "day_type" column.
+
+    Returns
+    -------
+    key : tuple
+        Sorted tuple of (numpy datetime64[D], day_type) pairs.
+    """
+    dates = pd.to_datetime(holidays_df.index).values.astype("datetime64[D]")
+    return tuple(sorted(zip(dates, holidays_df["day_type"].astype(str))))
+
+@functools.lru_cache(maxsize=16)
+def year_calendar(year, holidays):
+    """
+    Builds the hourly calendar of a whole year. The result is cached, so multi-year
+    ranges and daily runs only compute every year once per process.
+
+    Parameters
+    ----------
+    year : int
+        Year of the calendar.
+    holidays : tuple
+        Holidays as returned by holidays_key.
+
+    Returns
+    -------
+    hours : numpy array of datetime64[ns]
+        Every hour of the year, from January 1st 00:00 to December 31st 23:00.
+    day_type_codes : numpy array of int8
+        Code of the day type of every hour. See categories.
+    categories : numpy array of str
+        Day type names. The first one is always DEFAULT_DAY_TYPE.
+    """
+    first_day = np.datetime64("%04d-01-01" % year, "D")
+    days = np.arange(first_day, np.datetime64("%04d-01-01" % (year + 1), "D"))
+    categories = [DEFAULT_DAY_TYPE] + sorted({day_type for _, day_type in holidays} - {DEFAULT_DAY_TYPE})
+    codes_by_day = np.zeros(len(days), dtype=np.int8)
+    for holiday_date, day_type in holidays:
+        offset = (holiday_date - first_day).astype(int)
+        if 0 <= offset < len(days):
+            codes_by_day[offset] = categories.index(day_type)
+    hours = (days.astype("datetime64[h]")[:, None] + np.arange(24)).ravel()
+    day_type_codes = np.repeat(codes_by_day, 24)
+    hours = hours.astype("datetime64[ns]")
+    hours.setflags(write=False)
+    day_type_codes.setflags(write=False)
+    return hours, day_type_codes, np.array(categories)
+
+def build_calendar(regions, holidays_df, start, end):
+    """
+    Builds the region x hour grid between start (excluded) and end (included) with the day type
+    of every hour. The grid is built with one vectorized cross product over the cached yearly calendars.
+
+    Parameters
+    ----------
+    regions : list of str
+        Region names.
+    holidays_df : Pandas dataframe
+        Holidays indexed by date with a "day_type" column.
+    start : datetime.date or datetime.datetime
+        The grid starts one hour after this value.
+    end : datetime.date or datetime.datetime
+        Last hour of the grid.
+
+    Returns
+    -------
+    dataframe : Pandas dataframe
+        Dataframe indexed by datetime with "region" and "day_type" columns, ordered by region and datetime.
+    """
+    start = pd.Timestamp(start).tz_localize(None)
+    end = pd.Timestamp(end).tz_localize(None)
+    holidays = holidays_key(holidays_df)
+    years = [year_calendar(year, holidays) for year in range(start.year, end.year + 1)]
+    start = start.to_datetime64()
+    end = end.to_datetime64()
+    hours = np.concatenate([year[0] for year in years])
+    codes = np.concatenate([year[1] for year in years])
+    categories = years[0][2]
+    mask = (hours > start) & (hours <= end)
+    hours = hours[mask]
+    codes = codes[mask]
+    n_regions = len(regions)
+    dataframe = pd.DataFrame(
+        {
+            "region": np.repeat(np.asarray(regions, dtype=object), len(hours)),
+            "day_type": categories[np.tile(codes, n_regions)].astype(object),
+        },
+        index=pd.DatetimeIndex(np.tile(hours, n_regions), name="datetime"),
+    )
+    return dataframe
+
 def new_rows(region_dicts, holidays_df, start_date, end_date=None):
     if end_date is None:
         end_date = start_date + timedelta(hours=24)
     end_date_adjusted = end_date + timedelta(days=4)
-    df_list = []
-    for region in region_dicts:
-        datetime_index = pd.date_range(start=start_date, end=end_date_adjusted, freq='60min')[1:]
-        df = pd.DataFrame(columns=["region"], index=datetime_index)
-        df["region"] = region["region"]
-        df["date"] = df.index.date
-        df["date"] = pd.to_datetime(df["date"])
-        df = df.reset_index().merge(holidays_df, how="left", left_on="date", right_on="date").set_index("index")
-        df["day_type"].fillna("working_day", inplace = True)
-        df.drop(columns=["date"], inplace=True)
-        df_list.append(df)
-    dataframe = pd.concat(df_list)
-    dataframe.index.name = "datetime"
-    return dataframe
\ No newline at end of file
+    regions = [region["region"] for region in region_dicts]
+    return build_calendar(regions, holidays_df, start_date, end_date_adjusted)
@@ -0,0 +1,173 @@
+"""
+Opt-in CPU and memory profiling of the Airflow tasks and of the database api. A profile runs
+cProfile and tracemalloc and writes three artifacts:
+
+    <name>.pstats            cProfile stats, for pstats, snakeviz or a flame graph with flameprof
+    <name>.txt               the functions with the largest cumulative time
+    <name>.allocations.json  peak traced memory and the lines holding the most memory at the end
+
+Profiling is disabled unless the PROFILE_DIR environment variable is set. When PROFILE_TASK is set
+too (the dags set it to the task id and PROFILE_DATE to the logical date) the first import of
+electrical_demand starts a profile of the whole process, every thread included, and it is written
+at exit to PROFILE_DIR/<PROFILE_DATE>/<PROFILE_TASK>.*. The database api profiles a
+PROFILE_API_SAMPLE_RATE fraction of the /get-region requests, one at a time, to
+PROFILE_DIR/api/<date>/get-region.<region>.<day>.<time>.*.
+"""
+
+import atexit
+import cProfile
+import json
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from electrical_demand.logger import get_logger
+from electrical_demand.config import PROFILE_DIR, PROFILE_TASK, PROFILE_DATE, PROFILE_API_SAMPLE_RATE, PROFILE_TOP_ALLOCATIONS
+
+# Only one request of the api is profiled at a time, cProfile and tracemalloc are not per request
+_request_lock = threading.Lock()
+# Allocations of the profilers themselves, left out of the top allocations
+_IGNORED_FILES = {tracemalloc.__file__, cProfile.__file__, pstats.__file__, "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>"}
+
+
+class Profiler():
+    """
+    cProfile and tracemalloc from start() to write().
+
+    Parameters
+    ----------
+    all_threads : bool
+        If True the threads started after start() are profiled too, each one with its own
+        cProfile profile. The stats of every thread are merged by write().
+    """
+
+    def __init__(self, all_threads=False):
+        self.all_threads = all_threads
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._start = None
+        self._owns_tracemalloc = False
+        self.snapshot = None
+
+    def _profile_thread(self, *args):
+        # Called by the first profiling event of a new thread, the profile replaces it.
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profiles.append(profile)
+        profile.enable()
+
+    def start(self):
+        self._start = time.perf_counter()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        # From Python 3.12 cProfile uses sys.monitoring, so one profile already sees every thread.
+        if self.all_threads and sys.version_info < (3, 12):
+            threading.setprofile(self._profile_thread)
+        self._profile_thread()
+        return self
+
+    def stop(self):
+        """Stops cProfile and tracemalloc. It must be called by the thread that called start()."""
+        if self.all_threads and sys.version_info < (3, 12):
+            threading.setprofile(None)
+        self._profiles[0].disable()
+        self.seconds = time.perf_counter() - self._start
+        self.snapshot = tracemalloc.take_snapshot()
+        self.current_bytes, self.peak_bytes = tracemalloc.get_traced_memory()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+    def write(self, directory, name):
+        """
+        Stops the profile, if it is running, and writes its artifacts to directory/name.*.
+        Only stop() has to run in the thread of start(), write() can run in any thread.
+
+        Returns
+        -------
+        pstats_path : pathlib.Path
+            Path of the cProfile stats.
+        """
+        if self.snapshot is None:
+            self.stop()
+        with self._lock:
+            stats = pstats.Stats(*self._profiles)
+        # Grouped by line before leaving out the profilers, filtering the traces is much slower
+        statistics = [
+            statistic for statistic in self.snapshot.statistics("lineno")
+            if statistic.traceback[0].filename not in _IGNORED_FILES
+        ]
+
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = name.replace(":", "_").replace("+", "_").replace("/", "_")
+        pstats_path = directory / f"{name}.pstats"
+        stats.dump_stats(pstats_path)
+        with open(directory / f"{name}.txt", "w") as f:
+            stats.stream = f
+            stats.sort_stats("cumulative").print_stats(50)
+        allocations = {
+            "name": name,
+            "seconds": self.seconds,
+            "threads": len(self._profiles),
+            "current_bytes": self.current_bytes,
+            "peak_bytes": self.peak_bytes,
+            "top": [
+                {"file": statistic.traceback[0].filename, "line": statistic.traceback[0].lineno, "bytes": statistic.size, "count": statistic.count}
+                for statistic in statistics[:PROFILE_TOP_ALLOCATIONS]
+            ],
+        }
+        with open(directory / f"{name}.allocations.json", "w") as f:
+            json.dump(allocations, f, indent=4)
+        return pstats_path
+
+
+def profile_process(directory=PROFILE_DIR, task=PROFILE_TASK, date=PROFILE_DATE):
+    """
+    Profiles the process until it exits and writes the profile to directory/date/task.*.
+
+    Returns
+    -------
+    profiler : Profiler
+        Running profiler.
+    """
+    profiler = Profiler(all_threads=True).start()
+    atexit.register(profiler.write, Path(directory) / date, task)
+    return profiler
+
+def sample_request(sample_rate=PROFILE_API_SAMPLE_RATE):
+    """
+    Starts the profile of a request with probability sample_rate, if no other request is being
+    profiled. The profile must be stopped by the same thread and written with write_request.
+
+    Returns
+    -------
+    profiler : Profiler or None
+        Running profiler, None if the request is not profiled.
+    """
+    if not PROFILE_DIR or random.random() >= sample_rate or not _request_lock.acquire(blocking=False):
+        return None
+    try:
+        return Profiler().start()
+    except Exception:
+        _request_lock.release()
+        raise
+
+def write_request(profiler, name):
+    """
+    Writes the profile of a request to PROFILE_DIR/api/<date>/<name>.<time>.*. Another request
+    can be profiled once it is written.
+    """
+    logger = get_logger(write_request.__name__, level="INFO")
+    try:
+        now = datetime.now()
+        pstats_path = profiler.write(Path(PROFILE_DIR) / "api" / now.date().isoformat(), f"{name}.{now.strftime('%H%M%S%f')}")
+        logger.info(f"write_request - {pstats_path}")
+        return pstats_path
+    finally:
+        _request_lock.release()
+
@@ -0,0 +1,411 @@
+"""
+Local time-series store of the demand table. Each variable (demand, temperature,
+temperature_forecast, demand_forecast and the day_type code) is a .npy file with one row per
+region and one column per hour from the first day of the table, so the hours of a region are a
+fixed-stride array. The files are memory-mapped: a time window of a region is a slice of its row,
+found with arithmetic on the datetime and returned without copying.
+
+The store is refreshed incrementally from the database. The coverage table tells which days
+changed since the last refresh (their masks or their version are different from the stored
+ones, the version is incremented by every insert or update of their rows), the last
+SERIES_STORE_REFRESH_DAYS days are read again in case rows were written without refreshing the
+coverage, and the latest demand forecast is read again only for the hours of the forecasts
+issued since the last refresh.
+
+A refresh never writes the files being read: it copies them to a new generation
+({variable}.{generation}.npy), updates the copy and then publishes it by replacing meta.json,
+which names the generation. Readers keep the memory maps of the generation of the metadata they
+read, and the files of older generations are removed after the next refresh.
+
+    python -m electrical_demand.series_store refresh
+    python -m electrical_demand.series_store info
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from electrical_demand.config import SERIES_STORE_DIR, SERIES_STORE_REFRESH_DAYS
+from electrical_demand.instrumentation import span
+from electrical_demand.logger import get_logger
+
+VALUE_VARIABLES = ("demand", "temperature", "temperature_forecast", "demand_forecast")
+VARIABLES = VALUE_VARIABLES + ("day_type",)
+# Columns of the demand table, the dataset of train_and_predictions
+DATASET_VARIABLES = ("demand", "day_type", "temperature", "temperature_forecast")
+COVERAGE_COLUMNS = ("demand", "temperature", "temperature_forecast")
+# Masks and version of every day and region kept in the coverage file
+COVERAGE_FIELDS = COVERAGE_COLUMNS + ("version",)
+# day_type codes of the hours without a row in the demand table and of the rows without day type
+NO_ROW = -1
+NO_DAY_TYPE = -2
+HOURS = 24
+# Days read from the database per query and days added when the files grow
+CHUNK_DAYS = 31
+GROW_DAYS = 366
+META_FILE = "meta.json"
+HOUR = np.timedelta64(1, "h")
+DAY = np.timedelta64(1, "D")
+
+
+class SeriesStore():
+    """
+    Memory-mapped hourly series of every region.
+    ...
+
+    Attributes
+    ----------
+    directory : pathlib.Path
+        Directory of the files.
+    meta : dict
+        First hour ("start"), number of hours, regions, day types, watermark of the demand forecasts
+        and generation of the files.
+    ...
+    Methods
+    -------
+    window(region, start, end, variables)
+        Returns the hourly values of a region in [start, end) without copying them.
+    frame(region, start, end, variables)
+        Returns the hours of a region with a row in the demand table as a Pandas dataframe.
+    refresh(client, full)
+        Updates the store with the changes of the database since the last refresh.
+    """
+
+    def __init__(self, directory=SERIES_STORE_DIR):
+        self.directory = Path(directory)
+        self._meta = None
+        self._arrays = {}
+
+    def exists(self):
+        return (self.directory / META_FILE).exists()
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            with open(self.directory / META_FILE, "r") as f:
+                self._meta = json.load(f)
+        return self._meta
+
+    @property
+    def regions(self):
+        return self.meta["regions"]
+
+    @property
+    def start(self):
+        return np.datetime64(self.meta["start"], "h")
+
+    @property
+    def hours(self):
+        return self.meta["hours"]
+
+    def _path(self, name, generation=None):
+        """Returns the file of a variable in a generation, the one of the metadata if not given."""
+        generation = self.meta.get("generation") if generation is None else generation
+        # Stores written before the generations have a single {name}.npy file
+        return self.directory / (f"{name}.npy" if generation is None else f"{name}.{generation}.npy")
+
+    def array(self, variable):
+        """Returns the memory-mapped (regions, hours) array of a variable."""
+        if variable not in self._arrays:
+            try:
+                self._arrays[variable] = np.load(self._path(variable), mmap_mode="r")
+            except FileNotFoundError:
+                # Refreshes since the metadata was read removed its generation
+                self.close()
+                self._arrays[variable] = np.load(self._path(variable), mmap_mode="r")
+        return self._arrays[variable]
+
+    def close(self):
+        """Drops the memory maps and the metadata, so the next reads see the last refresh."""
+        self._arrays = {}
+        self._meta = None
+
+    def _offset(self, when, default):
+        """Returns the column of an hour, clipped to the columns of the store."""
+        if when is None:
+            return default
+        return int(np.clip((np.datetime64(pd.Timestamp(when).to_datetime64(), "h") - self.start) // HOUR, 0, self.hours))
+
+    def datetimes(self, start=None, end=None):
+        """Returns the hours of [start, end) of the store as datetime64 values."""
+        i, j = self._offset(start, 0), self._offset(end, self.hours)
+        return self.start + np.arange(i, j) * HOUR
+
+    def window(self, region, start=None, end=None, variables=VARIABLES):
+        """
+        Returns the values of every hour of [start, end) of a region. The arrays are views of the
+        memory-mapped files: they are not copied and are read-only.
+
+        Parameters
+        ----------
+        region : str
+            Region name.
+        start : datetime-like, optional
+            First hour. The first hour of the store if not given.
+        end : datetime-like, optional
+            Hour after the last one. The end of the store if not given.
+        variables : tuple of str
+            Variables to return, some of VARIABLES.
+
+        Returns
+        -------
+        window : dict
+            {variable: numpy array}. The values of the hours without data are NaN and their
+            day_type code is NO_ROW.
+        """
+        row = self.regions.index(region)
+        i, j = self._offset(start, 0), self._offset(end, self.hours)
+        return {variable: self.array(variable)[row, i:j] for variable in variables}
+
+    def frame(self, region, start=None, end=None, variables=DATASET_VARIABLES):
+        """
+        Returns the hours of [start, end) of a region that have a row in the demand table, as
+        get_demand does without the id and region columns.
+
+        Returns
+        -------
+        dataframe : Pandas dataframe
+            Variables indexed by datetime. day_type has the names of the day types.
+        """
+        window = self.window(region, start, end, tuple(set(variables) | {"day_type"}))
+        present = window["day_type"] != NO_ROW
+        index = pd.DatetimeIndex(self.datetimes(start, end)[present].astype("datetime64[ns]"), name="datetime")
+        data = {}
+        for variable in variables:
+            values = window[variable][present]
+            if variable == "day_type":
+                names = np.array(self.meta["day_types"] + [None], dtype=object)
+                values = names[np.where(values == NO_DAY_TYPE, len(names) - 1, values)]
+            data[variable] = values
+        return pd.DataFrame(data, index=index)
+
+    def _write_meta(self, meta):
+        path = self.directory / META_FILE
+        with open(path.with_suffix(".tmp"), "w") as f:
+            json.dump(meta, f, indent=1)
+        os.replace(path.with_suffix(".tmp"), path)
+        self._meta = meta
+
+    def _create(self, generation, start, hours, regions, copy=False):
+        """
+        Creates the empty files of a generation for hours hours from start and returns its
+        metadata. With copy the values of the current generation, with the same start and regions,
+        are copied, so the files can be updated or grow without reading the database again.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        shapes = {variable: (len(regions), hours) for variable in VARIABLES}
+        shapes["coverage"] = (len(regions), hours // HOURS, len(COVERAGE_FIELDS))
+        for name, shape in shapes.items():
+            dtype = np.float64 if name in VALUE_VARIABLES else np.int8 if name == "day_type" else np.int32
+            fill = np.nan if name in VALUE_VARIABLES else NO_ROW
+            array = np.lib.format.open_memmap(self._path(name, generation), mode="w+", dtype=dtype, shape=shape)
+            array[:] = fill
+            if copy:
+                old_array = self.array(name)
+                array[:, :old_array.shape[1]] = old_array
+            array.flush()
+            del array
+        return {
+            "start": str(start),
+            "hours": hours,
+            "regions": regions,
+            "day_types": list(self.meta["day_types"]) if copy else [],
+            "forecast_issued_at": self.meta["forecast_issued_at"] if copy else None,
+            "refreshed_at": self.meta["refreshed_at"] if copy else None,
+            "generation": generation,
+        }
+
+    def _remove_generations(self, keep):
+        """
+        Removes the files of the generations not in keep ("" for the files written before the
+        generations). Processes that memory-mapped them keep reading them until they close them.
+        """
+        for path in self.directory.glob("*.npy"):
+            if path.stem.partition(".")[2] not in keep:
+                path.unlink(missing_ok=True)
+
+    def _day_type_codes(self, day_types):
+        """Returns the codes of a series of day types, adding the new ones to the metadata."""
+        codes, names = pd.factorize(day_types, use_na_sentinel=True)
+        known = self.meta["day_types"]
+        for name in names:
+            if name not in known:
+                known.append(name)
+        lookup = np.array([known.index(name) for name in names] + [NO_DAY_TYPE], dtype=np.int8)
+        return lookup[codes]
+
+    def _scatter(self, arrays, dataframe, variables):
+        """Writes the values of a dataframe with datetime and region columns to the arrays."""
+        rows = dataframe["region"].map({region: row for row, region in enumerate(self.regions)})
+        columns = (dataframe["datetime"].to_numpy(dtype="datetime64[ns]").astype("datetime64[h]") - self.start) // HOUR
+        keep = rows.notna().to_numpy() & (columns >= 0) & (columns < self.hours)
+        rows = rows.to_numpy()[keep].astype(np.intp)
+        columns = columns[keep]
+        for variable in variables:
+            if variable == "day_type":
+                values = self._day_type_codes(dataframe["day_type"].to_numpy(dtype=object)[keep])
+            else:
+                values = pd.to_numeric(dataframe[variable], errors="coerce").to_numpy(dtype=np.float64)[keep]
+            arrays[variable][rows, columns] = values
+        return int(keep.sum())
+
+    def refresh(self, client, full=False, refresh_days=SERIES_STORE_REFRESH_DAYS):
+        """
+        Updates the store with the changes of the database since the last refresh. The store is
+        built again when it does not exist, when the regions changed, when the database has days
+        before its start, when its coverage file has no versions or with full. The changes are
+        written to a new generation of the files, published when the refresh ends.
+
+        Parameters
+        ----------
+        client : stock.database Client
+            Database client.
+        full : boolean
+            If True every day is read again.
+        refresh_days : int
+            Last days of the demand table that are always read again.
+
+        Returns
+        -------
+        report : dict
+            Days and rows read from the database, hours of demand forecast read and seconds.
+        """
+        from sqlalchemy import select
+        from electrical_demand.database.models import Coverage, Forecast
+
+        logger = get_logger(SeriesStore.refresh.__qualname__, level="INFO")
+        started = time.perf_counter()
+        report = {"days": 0, "rows": 0, "forecast_rows": 0}
+        coverage = client.get_dataframe(select(Coverage.day, Coverage.region, *[getattr(Coverage, column) for column in COVERAGE_FIELDS]))
+        if coverage.empty:
+            return report
+        coverage["day"] = pd.to_datetime(coverage["day"]).to_numpy(dtype="datetime64[D]")
+        regions = sorted(coverage["region"].unique())
+        first_day = coverage["day"].min().to_datetime64().astype("datetime64[D]")
+        last_day = coverage["day"].max().to_datetime64().astype("datetime64[D]")
+
+        rebuild = (
+            full or not self.exists() or self.regions != regions or first_day < self.start.astype("datetime64[D]")
+            or self.array("coverage").shape[2] != len(COVERAGE_FIELDS)
+        )
+        watermark = None if rebuild else self.meta["forecast_issued_at"]
+        issued = client.get_dataframe(Forecast.issued_after_query(watermark and datetime.fromisoformat(watermark)))
+        forecast_end = pd.to_datetime(issued["end"]).max()
+        last_hour = (last_day + DAY).astype("datetime64[h]")
+        if pd.notna(forecast_end):
+            last_hour = max(last_hour, np.datetime64(forecast_end.to_datetime64(), "h") + HOUR)
+        start = first_day.astype("datetime64[h]") if rebuild else self.start
+        hours = 0 if rebuild else self.hours
+        if last_hour > start + hours * HOUR:
+            hours = int(((last_hour - start) // HOUR // HOURS // GROW_DAYS + 1) * GROW_DAYS * HOURS)
+        previous = self.meta.get("generation") if self.exists() else None
+        generation = (previous or 0) + 1
+        meta = self._create(generation, start, hours, regions, copy=not rebuild)
+        # The metadata is only written when the new generation is complete
+        self.close()
+        self._meta = meta
+        try:
+            report.update(self._update(client, coverage, issued, generation, last_day, refresh_days))
+        except BaseException:
+            self.close()
+            for name in VARIABLES + ("coverage",):
+                self._path(name, generation).unlink(missing_ok=True)
+            raise
+        meta["refreshed_at"] = datetime.now(timezone.utc).isoformat()
+        self.close()
+        self._write_meta(meta)
+        self._remove_generations({str(generation), "" if previous is None else str(previous)})
+        report["seconds"] = time.perf_counter() - started
+        logger.info(f"series_store.refresh - {report}")
+        return report
+
+    def _update(self, client, coverage, issued, generation, last_day, refresh_days):
+        """Reads the changed days and forecasts of the database into the files of a generation."""
+        from electrical_demand.database.models import Demand, Forecast
+
+        report = {"days": 0, "rows": 0, "forecast_rows": 0}
+        arrays = {name: np.load(self._path(name, generation), mmap_mode="r+") for name in VARIABLES + ("coverage",)}
+        meta = self.meta
+        regions = self.regions
+        forecast_end = pd.to_datetime(issued["end"]).max()
+        first_day_store = self.start.astype("datetime64[D]")
+        rows = coverage["region"].map({region: row for row, region in enumerate(regions)}).to_numpy(dtype=np.intp)
+        days = ((coverage["day"].to_numpy(dtype="datetime64[D]") - first_day_store) // DAY).astype(np.intp)
+        masks = coverage[list(COVERAGE_FIELDS)].to_numpy(dtype=np.int32)
+        changed = (arrays["coverage"][rows, days] != masks).any(axis=1)
+        last = int((last_day - first_day_store) // DAY)
+        to_read = set(days[changed].tolist()) | set(range(max(last - refresh_days + 1, 0), last + 1))
+        report["days"] = len(to_read)
+
+        with span("series_store.refresh") as stage:
+            for chunk_start, chunk_end in _runs(sorted(to_read), CHUNK_DAYS):
+                start_date = (first_day_store + chunk_start * DAY).astype(object)
+                end_date = (first_day_store + chunk_end * DAY).astype(object)
+                dataframe = client.get_dataframe(Demand.series_query(start_date, end_date))
+                for variable in DATASET_VARIABLES:
+                    arrays[variable][:, chunk_start * HOURS:chunk_end * HOURS] = NO_ROW if variable == "day_type" else np.nan
+                report["rows"] += self._scatter(arrays, dataframe, DATASET_VARIABLES)
+            arrays["coverage"][rows, days] = masks
+
+            if pd.notna(forecast_end):
+                forecast_start = pd.to_datetime(issued["start"]).min().to_datetime64().astype("datetime64[D]")
+                forecast_days = range(max(int((forecast_start - first_day_store) // DAY), 0), int((forecast_end.to_datetime64().astype("datetime64[D]") - first_day_store) // DAY) + 1)
+                for chunk_start, chunk_end in _runs(list(forecast_days), CHUNK_DAYS):
+                    start_date = (first_day_store + chunk_start * DAY).astype(object)
+                    end_date = (first_day_store + chunk_end * DAY).astype(object)
+                    dataframe = client.get_dataframe(Forecast.latest_query(start_date, end_date))
+                    arrays["demand_forecast"][:, chunk_start * HOURS:chunk_end * HOURS] = np.nan
+                    report["forecast_rows"] += self._scatter(arrays, dataframe, ("demand_forecast",))
+                meta["forecast_issued_at"] = pd.to_datetime(issued["issued_at"]).max().isoformat()
+            stage.add(rows=report["rows"] + report["forecast_rows"])
+
+        for array in arrays.values():
+            array.flush()
+        del arrays
+        return report
+
+
+def _runs(days, max_days):
+    """Groups sorted day numbers in [start, end) ranges of consecutive days of at most max_days days."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] and day - runs[-1][0] < max_days:
+            runs[-1][1] = day + 1
+        else:
+            runs.append([day, day + 1])
+    return [tuple(run) for run in runs]
+
+def refresh_series_store(client, directory=SERIES_STORE_DIR, full=False):
+    """
+    Refreshes the store of directory. It does nothing if directory is empty, so the tasks can
+    call it whether the store is enabled or not.
+
+    Returns
+    -------
+    report : dict or None
+        Report of SeriesStore.refresh.
+    """
+    if not directory:
+        return None
+    return SeriesStore(directory).refresh(client, full=full)
+
+
+if __name__ == "__main__":
+    import argparse
+    from electrical_demand.database.client import ComplexClient
+    from electrical_demand.database_api.config import DATABASE_TYPE, DATABASE_USER, DATABASE_PASSWORD, DATABASE_HOST, DATABASE_NAME
+
+    parser = argparse.ArgumentParser(description="Memory-mapped hourly series of the demand table.")
+    parser.add_argument("command", choices=["refresh", "info"])
+    parser.add_argument("--dir", default=SERIES_STORE_DIR, required=not SERIES_STORE_DIR)
+    parser.add_argument("--full", action="store_true", help="read every day again")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        client = ComplexClient(DATABASE_TYPE, DATABASE_NAME, DATABASE_HOST, DATABASE_USER, DATABASE_PASSWORD)
+        print(refresh_series_store(client, args.dir, full=args.full))
+    else:
+        print(json.dumps(SeriesStore(args.dir).meta, indent=1))
@@ -0,0 +1,541 @@
+"""
+This module provides storage backends for the files of the buckets.
+The getters and loaders read and write through get_storage(), so S3 can be replaced by a local
+folder or by memory, and a size-bounded local disk cache can be put in front of S3 to serve
+repeated reads (reruns, backtests, reference files) from local disk.
+"""
+
+import abc
+import glob
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from electrical_demand.config import (
+    STORAGE_BACKEND, STORAGE_ROOT, STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES, STORAGE_UPLOAD_WORKERS, STORAGE_MULTIPART_CHUNK_BYTES,
+)
+from electrical_demand.instrumentation import is_enabled, span
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def sha256(file):
+    """Returns the sha256 of a binary file object, read in chunks."""
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.read(CHUNK_SIZE), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+def _nbytes(data):
+    return len(data.encode("utf-8")) if isinstance(data, str) else memoryview(data).nbytes
+
+
+class _CountedFile():
+    """
+    File object that counts the bytes read or written through it. The time from open to close
+    and the bytes are recorded as a stage of the instrumentation when it is closed.
+    """
+
+    def __init__(self, file, stage):
+        self._file = file
+        self._span = span(stage).__enter__()
+        self._recorded = False
+
+    def read(self, *args):
+        data = self._file.read(*args)
+        self._span.add(nbytes=_nbytes(data))
+        return data
+
+    def readline(self, *args):
+        data = self._file.readline(*args)
+        self._span.add(nbytes=_nbytes(data))
+        return data
+
+    def readinto(self, buffer):
+        nbytes = self._file.readinto(buffer)
+        self._span.add(nbytes=nbytes or 0)
+        return nbytes
+
+    def write(self, data):
+        self._span.add(nbytes=_nbytes(data))
+        return self._file.write(data)
+
+    def __iter__(self):
+        for line in self._file:
+            self._span.add(nbytes=_nbytes(line))
+            yield line
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def _close(self, exc_type=None):
+        try:
+            self._file.close()
+        finally:
+            if not self._recorded:
+                self._recorded = True
+                self._span.__exit__(exc_type, None, None)
+
+    def close(self):
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._close(exc_type)
+        return False
+
+
+class Storage():
+    """
+    Abstract class used to store files in buckets.
+    This is an abstract class. For each backend there is a class that inherits this one.
+    ...
+
+    Methods
+    -------
+    open(bucket, path, mode)
+        Returns a file object of the file.
+    exists(bucket, path)
+        Returns True if the file exists.
+    list(bucket, prefix)
+        Returns the paths of the files of the bucket that start with prefix.
+    delete(bucket, path)
+        Deletes the file.
+    version(bucket, path)
+        Returns an identifier of the current version of the file.
+    put_file(local_path, bucket, path, checksum)
+        Copies a local file to the bucket.
+    checksum(bucket, path)
+        Returns the sha256 of the file.
+    upload_files(files)
+        Copies local files to the buckets concurrently, skipping the unchanged ones.
+    """
+
+    @abc.abstractmethod
+    def open(self, bucket, path, mode="rb"):
+        """
+        Parameters
+        ----------
+        bucket : str
+            Bucket name.
+        path : str
+            Path of the file inside the bucket.
+        mode : {"rb", "r", "wb", "w"}
+            File mode.
+
+        Returns
+        -------
+        file : file object
+            It raises FileNotFoundError if the file does not exist and mode is a read mode.
+        """
+
+    @abc.abstractmethod
+    def exists(self, bucket, path):
+        """Returns True if the file exists."""
+
+    @abc.abstractmethod
+    def list(self, bucket, prefix=""):
+        """Returns the sorted paths of the files of the bucket that start with prefix."""
+
+    @abc.abstractmethod
+    def delete(self, bucket, path):
+        """Deletes the file. It does nothing if the file does not exist."""
+
+    @abc.abstractmethod
+    def version(self, bucket, path):
+        """
+        Returns a string that changes every time the file is written (S3 version id or ETag,
+        modification time and size of a local file). It raises FileNotFoundError if the file does not exist.
+        """
+
+    def _counted(self, file, mode):
+        """Returns file, counting the bytes read or written through it when the instrumentation is enabled."""
+        if not is_enabled():
+            return file
+        return _CountedFile(file, f"{self.__class__.__name__}.{'write' if 'w' in mode else 'read'}")
+
+    def read_bytes(self, bucket, path):
+        with self.open(bucket, path, "rb") as f:
+            return f.read()
+
+    def read_text(self, bucket, path, encoding="utf-8"):
+        return self.read_bytes(bucket, path).decode(encoding)
+
+    def write_bytes(self, bucket, path, data):
+        with self.open(bucket, path, "wb") as f:
+            f.write(data)
+
+    def write_text(self, bucket, path, text, encoding="utf-8"):
+        self.write_bytes(bucket, path, text.encode(encoding))
+
+    def put_file(self, local_path, bucket, path, checksum=None):
+        """Copies a local file to the bucket. checksum is the sha256 of the file, if it is known."""
+        with span(f"{self.__class__.__name__}.put_file", nbytes=os.path.getsize(local_path)):
+            with open(local_path, "rb") as source, self.open(bucket, path, "wb") as destination:
+                shutil.copyfileobj(source, destination, CHUNK_SIZE)
+
+    def checksum(self, bucket, path):
+        """Returns the sha256 of the file, or None if the file does not exist."""
+        try:
+            with self.open(bucket, path, "rb") as f:
+                return sha256(f)
+        except FileNotFoundError:
+            return None
+
+    def upload_file(self, local_path, bucket, path):
+        """
+        Copies a local file to the bucket if its checksum is not the one of the file in the bucket.
+
+        Returns
+        -------
+        uploaded : bool
+            False if the file in the bucket was the same.
+        """
+        with open(local_path, "rb") as f:
+            checksum = sha256(f)
+        if self.checksum(bucket, path) == checksum:
+            return False
+        self.put_file(local_path, bucket, path, checksum=checksum)
+        return True
+
+    def upload_files(self, files, max_workers=STORAGE_UPLOAD_WORKERS):
+        """
+        Copies local files to the buckets concurrently with upload_file. The files are streamed,
+        they are never read whole into memory.
+
+        Parameters
+        ----------
+        files : list of tuples
+            (local_path, bucket, path) of every file.
+        max_workers : int
+            Maximum number of concurrent uploads.
+
+        Returns
+        -------
+        uploaded : dict
+            {(bucket, path): bool}, False for the files skipped because they did not change.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as executor:
+            results = executor.map(lambda file: self.upload_file(*file), files)
+            return {(bucket, path): uploaded for (_, bucket, path), uploaded in zip(files, results)}
+
+
+class S3Storage(Storage):
+    """
+    Files stored in S3. One s3fs filesystem is shared by every call, also by the threads of
+    upload_files. The sha256 of the uploaded files is saved in the object metadata, so checksum
+    does not download the object.
+    """
+
+    CHECKSUM_METADATA = "sha256"
+
+    def __init__(self):
+        self._fs = None
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            import s3fs
+
+            self._fs = s3fs.S3FileSystem(anon=False)
+        return self._fs
+
+    def open(self, bucket, path, mode="rb"):
+        return self._counted(self.fs.open(bucket + "/" + path, mode), mode)
+
+    def exists(self, bucket, path):
+        return self.fs.exists(bucket + "/" + path)
+
+    def list(self, bucket, prefix=""):
+        prefix_path = bucket + "/" + prefix
+        return sorted(key[len(bucket) + 1:] for key in self.fs.find(prefix_path.rsplit("/", 1)[0]) if key.startswith(prefix_path))
+
+    def delete(self, bucket, path):
+        if self.exists(bucket, path):
+            self.fs.rm(bucket + "/" + path)
+
+    def version(self, bucket, path):
+        info = self.fs.info(bucket + "/" + path, refresh=True)
+        return info.get("VersionId") or info["ETag"].strip('"')
+
+    def put_file(self, local_path, bucket, path, checksum=None):
+        if checksum is None:
+            with open(local_path, "rb") as f:
+                checksum = sha256(f)
+        # s3fs streams the file and uses a multipart upload when it is bigger than chunksize.
+        with span(f"{self.__class__.__name__}.put_file", nbytes=os.path.getsize(local_path)):
+            self.fs.put_file(local_path, bucket + "/" + path, chunksize=STORAGE_MULTIPART_CHUNK_BYTES, Metadata={self.CHECKSUM_METADATA: checksum})
+
+    def checksum(self, bucket, path):
+        try:
+            metadata = self.fs.metadata(bucket + "/" + path)
+        except FileNotFoundError:
+            return None
+        # The objects uploaded before the checksum was saved have none and are uploaded again once.
+        return metadata.get(self.CHECKSUM_METADATA)
+
+
+class LocalStorage(Storage):
+    """Files stored in root/bucket/path on the local filesystem."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, bucket, path):
+        return self.root / bucket / path
+
+    def open(self, bucket, path, mode="rb"):
+        local_path = self._path(bucket, path)
+        if "w" in mode:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+        return self._counted(open(local_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})), mode)
+
+    def exists(self, bucket, path):
+        return self._path(bucket, path).is_file()
+
+    def list(self, bucket, prefix=""):
+        bucket_dir = self.root / bucket
+        if not bucket_dir.is_dir():
+            return []
+        paths = (local_path.relative_to(bucket_dir).as_posix() for local_path in bucket_dir.rglob("*") if local_path.is_file())
+        return sorted(path for path in paths if path.startswith(prefix))
+
+    def delete(self, bucket, path):
+        self._path(bucket, path).unlink(missing_ok=True)
+
+    def version(self, bucket, path):
+        stat = self._path(bucket, path).stat()
+        return "%x-%x" % (stat.st_mtime_ns, stat.st_size)
+
+
+class _MemoryWriter(io.BytesIO):
+    """Buffer that saves its content in the memory storage when it is closed."""
+
+    def __init__(self, files, key):
+        super().__init__()
+        self._files = files
+        self._key = key
+
+    def close(self):
+        if not self.closed:
+            self._files[self._key] = self.getvalue()
+        super().close()
+
+
+class MemoryStorage(Storage):
+    """Files stored in memory. Useful for tests and benchmarks."""
+
+    def __init__(self):
+        self.files = {}
+
+    def open(self, bucket, path, mode="rb"):
+        key = (bucket, path)
+        if "w" in mode:
+            buffer = _MemoryWriter(self.files, key)
+        elif key in self.files:
+            buffer = io.BytesIO(self.files[key])
+        else:
+            raise FileNotFoundError(f"{bucket}/{path}")
+        return self._counted(buffer if "b" in mode else io.TextIOWrapper(buffer, encoding="utf-8"), mode)
+
+    def exists(self, bucket, path):
+        return (bucket, path) in self.files
+
+    def list(self, bucket, prefix=""):
+        return sorted(path for file_bucket, path in self.files if file_bucket == bucket and path.startswith(prefix))
+
+    def delete(self, bucket, path):
+        self.files.pop((bucket, path), None)
+
+    def version(self, bucket, path):
+        if (bucket, path) not in self.files:
+            raise FileNotFoundError(f"{bucket}/{path}")
+        return hashlib.md5(self.files[(bucket, path)]).hexdigest()
+
+
+class CachedStorage(Storage):
+    """
+    Read-through local disk cache in front of another storage.
+    The cached copies are kept by version of the file in the backend, in cache_dir/bucket/path@<version>,
+    and every read asks the backend for the current version first. A read is served from the
+    cached copy of that version, otherwise the file is downloaded once and cached, so a file
+    rewritten by another process is never served stale (the ingestion manifests are rewritten).
+    Writes and deletes go to the backend and drop the cached copies.
+    The size of the cache is counted once and then kept up to date by the fills and the
+    invalidations. When it is bigger than max_bytes the least recently used files are evicted
+    until it is below EVICT_FRACTION of max_bytes, so the cache directory is only scanned once
+    every many fills. The directory can be shared by several processes: a file evicted by another
+    process while it is opened is read from the backend.
+
+    Attributes
+    ----------
+    backend : Storage
+        Storage where the files are.
+    cache_dir : pathlib.Path
+        Local cache directory.
+    max_bytes : int
+        Maximum size of the cache.
+    """
+
+    EVICT_FRACTION = 0.9
+
+    def __init__(self, backend, cache_dir, max_bytes):
+        self.backend = backend
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _scan(self):
+        return [(cache_file.stat(), cache_file) for cache_file in self.cache_dir.rglob("*") if cache_file.is_file()]
+
+    def _add_size(self, nbytes):
+        """Adds nbytes to the size of the cache and returns True if it is bigger than max_bytes."""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(stat.st_size for stat, _ in self._scan())
+            else:
+                self._size = max(self._size + nbytes, 0)
+            return self._size > self.max_bytes
+
+    def _path(self, bucket, path, version):
+        base = self.cache_dir / bucket / path
+        return base.with_name(f"{base.name}@{hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]}")
+
+    def _versions(self, bucket, path):
+        """Returns the cached copies of every version of a file."""
+        base = self.cache_dir / bucket / path
+        return list(base.parent.glob(f"{glob.escape(base.name)}@*")) if base.parent.is_dir() else []
+
+    def _fill(self, bucket, path, version):
+        """
+        Caches the file as its version. The bytes are read after the version, so if the file is
+        written in between the copy holds newer bytes, never older ones.
+        """
+        cache_path = self._path(bucket, path, version)
+        data = self.backend.read_bytes(bucket, path)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_path.parent, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, cache_path)
+        nbytes = len(data)
+        # The copies of the older versions are never read again
+        for old_path in self._versions(bucket, path):
+            if old_path != cache_path:
+                nbytes -= self._unlink(old_path)
+        if self._add_size(nbytes):
+            self._evict()
+        return cache_path
+
+    @staticmethod
+    def _unlink(cache_path):
+        """Deletes a cached copy and returns its size, 0 if it was already deleted."""
+        try:
+            nbytes = cache_path.stat().st_size
+            cache_path.unlink()
+        except FileNotFoundError:
+            return 0
+        return nbytes
+
+    def _evict(self):
+        with self._lock:
+            # The other processes of the cache directory fill and evict it too, the scan counts their files
+            files = self._scan()
+            total = sum(stat.st_size for stat, _ in files)
+            for stat, cache_file in sorted(files, key=lambda item: item[0].st_mtime):
+                if total <= self.max_bytes * self.EVICT_FRACTION:
+                    break
+                cache_file.unlink(missing_ok=True)
+                total -= stat.st_size
+            self._size = total
+
+    def invalidate(self, bucket, path):
+        nbytes = sum(self._unlink(cache_path) for cache_path in self._versions(bucket, path))
+        if nbytes:
+            self._add_size(-nbytes)
+
+    def open(self, bucket, path, mode="rb"):
+        if "w" in mode:
+            self.invalidate(bucket, path)
+            return self.backend.open(bucket, path, mode)
+        # It raises FileNotFoundError if the file does not exist
+        version = self.backend.version(bucket, path)
+        cache_path = self._path(bucket, path, version)
+        try:
+            os.utime(cache_path)
+        except FileNotFoundError:
+            cache_path = self._fill(bucket, path, version)
+        try:
+            return self._counted(open(cache_path, mode, **({} if "b" in mode else {"encoding": "utf-8"})), mode)
+        except FileNotFoundError:
+            # Evicted by another process sharing the cache directory
+            return self.backend.open(bucket, path, mode)
+
+    def exists(self, bucket, path):
+        return self.backend.exists(bucket, path)
+
+    def list(self, bucket, prefix=""):
+        return self.backend.list(bucket, prefix)
+
+    def delete(self, bucket, path):
+        self.invalidate(bucket, path)
+        self.backend.delete(bucket, path)
+
+    def version(self, bucket, path):
+        return self.backend.version(bucket, path)
+
+    def put_file(self, local_path, bucket, path, checksum=None):
+        self.invalidate(bucket, path)
+        self.backend.put_file(local_path, bucket, path, checksum=checksum)
+
+    def checksum(self, bucket, path):
+        return self.backend.checksum(bucket, path)
+
+
+_storage = None
+
+
+def create_storage(backend=STORAGE_BACKEND, root=STORAGE_ROOT, cache_dir=STORAGE_CACHE_DIR, cache_max_bytes=STORAGE_CACHE_MAX_BYTES):
+    """
+    Creates a storage from its configuration.
+
+    Parameters
+    ----------
+    backend : {"s3", "local", "memory"}
+        Storage backend.
+    root : str, optional
+        Root folder of the local backend.
+    cache_dir : str, optional
+        If given, a local disk cache in this folder is put in front of the backend.
+    cache_max_bytes : int, optional
+        Maximum size of the cache.
+    """
+    if backend == "s3":
+        storage = S3Storage()
+    elif backend == "local":
+        storage = LocalStorage(root)
+    elif backend == "memory":
+        storage = MemoryStorage()
+    else:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    if cache_dir:
+        storage = CachedStorage(storage, cache_dir, cache_max_bytes)
+    return storage
+
+def get_storage():
+    """Returns the storage of the process, created from the STORAGE_* environment variables."""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+def set_storage(storage):
+    """Replaces the storage of the process."""
+    global _storage
+    _storage = storage
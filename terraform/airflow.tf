@@ -77,7 +77,7 @@ resource "null_resource" "airflow" {
       # "echo \"DATABASE_API_DOCKER_IMAGE=${aws_ecr_repository.database_api.repository_url}:${local.envs["DATABASE_API_DOCKER_IMAGE_TAG"]}\" >> .env",
       # "echo \"DASHBOARD_DOCKER_IMAGE=${aws_ecr_repository.dashboard.repository_url}:${local.envs["DASHBOARD_DOCKER_IMAGE_TAG"]}\" >> .env",
       "echo \"DATABASE_HOST=${aws_db_instance.postgresdb.endpoint}\" >> .env",
-      "mkdir versions plugins logs",
+      "mkdir -p plugins logs storage_cache metrics series_store profiles",
       "aws2 ecr get-login-password | docker login --username AWS --password-stdin ${data.aws_caller_identity.current.account_id}.dkr.ecr.${var.region}.amazonaws.com",
       "docker pull ${aws_ecr_repository.demand.repository_url}:${local.envs["DEMAND_DOCKER_IMAGE_TAG"]}",
       # "docker pull ${aws_ecr_repository.database_api.repository_url}:${local.envs["DATABASE_API_DOCKER_IMAGE_TAG"]}",